@@ -6,8 +6,9 @@ import os
 import subprocess
 from typing import Optional, Sequence
 
-from qstone.generators import generator
-from qstone.profiling import profile
+from qstone.generators import generator, replay
+from qstone.profiling import live, profile
+from qstone.utils import worker
 
 
 def generate(args: Optional[Sequence[str]] = None) -> None:
@@ -23,12 +24,25 @@ def generate(args: Optional[Sequence[str]] = None) -> None:
     else:
         job_count = None
 
+    recorded = None
+    if args.from_profile:  # type: ignore[union-attr]
+        logger.info("Replaying the jobs of %s", args.from_profile)  # type: ignore[union-attr]
+        recorded = replay.recorded_jobs(
+            args.from_profile,  # type: ignore[union-attr]
+            filters=_filters(args.filter),  # type: ignore[union-attr]
+            speedup=args.speedup,  # type: ignore[union-attr]
+        )
+
     generated_files = generator.generate_suite(
         config=args.src,  # type: ignore[union-attr]
         job_count=job_count,  # type: ignore[arg-type]
         output_folder=args.dst,  # type: ignore[union-attr]
         atomic=args.atomic,  # type: ignore[union-attr]
         scheduler=args.scheduler,  # type: ignore[union-attr]
+        workers=args.workers,  # type: ignore[union-attr]
+        replay=recorded,
+        array=args.array,  # type: ignore[union-attr]
+        chain=args.chain,  # type: ignore[union-attr]
     )
 
     logger.info("Generated %s tar balls:", len(generated_files))
@@ -65,10 +79,86 @@ def prof(args: Optional[Sequence[str]] = None) -> None:
     """Qstone cli subcommand for profiling scheduler exection."""
     logger = logging.getLogger()
     logging.basicConfig(level=logging.INFO, format="%(message)s")
-    logger.info("Extracting scheduler tar file")
-    # Folder can be a list of folders
-    f = [args.folder] if isinstance(args.folder, str) else args.folder  # type: ignore[union-attr]
-    profile.profile(args.cfg, f, args.pickle)  # type: ignore[union-attr]
+    if args.folder:  # type: ignore[union-attr]
+        logger.info("Extracting scheduler tar file")
+        # Folder can be a list of folders
+        f = [args.folder] if isinstance(args.folder, str) else args.folder  # type: ignore[union-attr]
+        profile.profile(
+            args.cfg,  # type: ignore[union-attr]
+            f,
+            args.store,  # type: ignore[union-attr]
+            workers=args.workers,  # type: ignore[union-attr]
+            rescan=args.rescan,  # type: ignore[union-attr]
+            run=args.run,  # type: ignore[union-attr]
+        )
+    filters = _filters(args.filter)  # type: ignore[union-attr]
+    if args.percentiles or args.histograms:  # type: ignore[union-attr]
+        profile.latency(
+            args.store,  # type: ignore[union-attr]
+            filters=filters,
+            histograms=args.histograms,  # type: ignore[union-attr]
+        )
+    if args.occupancy:  # type: ignore[union-attr]
+        profile.contention(args.store, filters=filters)  # type: ignore[union-attr]
+    if args.resources:  # type: ignore[union-attr]
+        profile.resource_usage(args.store, filters=filters)  # type: ignore[union-attr]
+    if args.export_chrome:  # type: ignore[union-attr]
+        profile.export_chrome(
+            args.store,  # type: ignore[union-attr]
+            args.export_chrome,  # type: ignore[union-attr]
+            filters=filters,
+        )
+    if args.flame:  # type: ignore[union-attr]
+        _output(
+            profile.flames(args.store, filters=filters),  # type: ignore[union-attr]
+            args.output,  # type: ignore[union-attr]
+        )
+    elif args.timeline:  # type: ignore[union-attr]
+        _output(
+            profile.timeline(args.store, filters=filters),  # type: ignore[union-attr]
+            args.output,  # type: ignore[union-attr]
+        )
+    elif args.columns or args.query:  # type: ignore[union-attr]
+        df = profile.query(
+            args.store,  # type: ignore[union-attr]
+            columns=args.columns.split(",") if args.columns else None,  # type: ignore[union-attr]
+            filters=filters,
+            expr=args.query,  # type: ignore[union-attr]
+        )
+        _output(df, args.output)  # type: ignore[union-attr]
+
+
+def metrics(args: Optional[Sequence[str]] = None) -> None:
+    """Qstone cli subcommand for the live metrics of the node."""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    live.serve(
+        args.listen,  # type: ignore[union-attr]
+        args.port,  # type: ignore[union-attr]
+        args.host,  # type: ignore[union-attr]
+    )
+
+
+def work(args: Optional[Sequence[str]] = None) -> None:
+    """Qstone cli subcommand for the warm worker of the node."""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    worker.serve(args.listen)  # type: ignore[union-attr]
+
+
+def _filters(items: Optional[Sequence[str]]) -> dict:
+    """Filters on the partitions of the store from KEY=VALUE arguments"""
+    filters: dict = {}
+    for f in items or []:
+        key, value = f.split("=", 1)
+        filters.setdefault(key, []).append(value)
+    return filters
+
+
+def _output(df, output: Optional[str]) -> None:
+    """Writes a profile table to a csv file, or prints it"""
+    if output:
+        df.to_csv(output, index=False)
+    else:
+        print(df.to_string(index=False))
 
 
 def main(arg_strings: Optional[Sequence[str]] = None) -> None:
@@ -123,11 +213,54 @@ def main(arg_strings: Optional[Sequence[str]] = None) -> None:
         "--scheduler",
         help="Generate the configuration for a specific scheduler",
         default="bare_metal",
-        choices=["slurm", "jsrun", "bare_metal"],
+        choices=["slurm", "jsrun", "bare_metal", "pilot"],
         required=False,
         type=str,
     )
 
+    gen_cmd.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of processes packing the user suites, defaults to the CPU count",
+        default=None,
+    )
+
+    gen_cmd.add_argument(
+        "--array",
+        help="Submit one Slurm or LSF array job per user and job type",
+        default=False,
+        action="store_true",
+    )
+
+    gen_cmd.add_argument(
+        "--chain",
+        help="Submit pre, run and post as dependent jobs, only run requesting the QPU",
+        default=False,
+        action="store_true",
+    )
+
+    gen_cmd.add_argument(
+        "--from-profile",
+        type=str,
+        help="Profile store whose recorded jobs and arrival times are replayed",
+        default=None,
+    )
+
+    gen_cmd.add_argument(
+        "--filter",
+        type=str,
+        action="append",
+        help="Replay: KEY=VALUE on the run, user or date partitions, repeatable",
+    )
+
+    gen_cmd.add_argument(
+        "--speedup",
+        type=float,
+        help="Replay: factor by which the recorded arrival times are compressed",
+        default=1.0,
+    )
+
     gen_cmd.set_defaults(func=generate)
 
     runner = subparsers.add_parser("run", help="Run scheduler")
@@ -161,15 +294,138 @@ def main(arg_strings: Optional[Sequence[str]] = None) -> None:
         help="Folder that contains the runs, repeatable argument",
     )
     profiler.add_argument(
-        "--pickle",
+        "--store",
+        type=str,
+        help="Folder of the profile store, partitioned by run, user and date",
+        default="./QS_Profile",
+    )
+    # Replaced by --store, only kept to point the users of older scripts to it
+    profiler.add_argument("--pickle", type=str, help=argparse.SUPPRESS, default=None)
+    profiler.add_argument(
+        "--run",
+        type=str,
+        help="Identifier of the profiled run, defaults to the time the folder is first profiled",
+        default=None,
+    )
+    profiler.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of processes used to read the traces, defaults to the CPU count",
+        default=None,
+    )
+    profiler.add_argument(
+        "--rescan",
+        help="Read again all the traces, including the ones already profiled",
+        default=False,
+        action="store_true",
+    )
+
+    profiler.add_argument(
+        "--columns",
+        type=str,
+        help="Query the store: comma separated list of columns to load",
+        default=None,
+    )
+    profiler.add_argument(
+        "--filter",
+        type=str,
+        action="append",
+        help="Query the store: KEY=VALUE on the run, user or date partitions, repeatable",
+    )
+    profiler.add_argument(
+        "--query",
+        type=str,
+        help="Query the store: pandas expression to filter the rows",
+        default=None,
+    )
+    profiler.add_argument(
+        "--percentiles",
+        help="Print the latency percentiles of the store, per job type, step, user and connector",
+        default=False,
+        action="store_true",
+    )
+    profiler.add_argument(
+        "--histograms",
+        help="Print the latency percentiles and histograms of the store",
+        default=False,
+        action="store_true",
+    )
+    profiler.add_argument(
+        "--occupancy",
+        help="Print the QPU occupancy of the store, per scheduling mode and run",
+        default=False,
+        action="store_true",
+    )
+    profiler.add_argument(
+        "--resources",
+        help="Print the CPU efficiency and resource usage of the store, per job type and step",
+        default=False,
+        action="store_true",
+    )
+    profiler.add_argument(
+        "--export-chrome",
         type=str,
-        help="Optional Pickle filepath to store pickled dataframe",
-        default="./QS_Profile.pkl",
+        help="Export the store to a Trace Event Format json file, to open in Perfetto",
+        default=None,
+    )
+    profiler.add_argument(
+        "--flame",
+        help="Print the traced call stacks of each job with their inclusive and exclusive times",
+        default=False,
+        action="store_true",
+    )
+    profiler.add_argument(
+        "--timeline",
+        help="Print the spans of the store on one timeline across hosts and processes",
+        default=False,
+        action="store_true",
+    )
+    profiler.add_argument(
+        "--output",
+        type=str,
+        help="CSV file where the query result is written, printed if not set",
+        default=None,
     )
 
     profiler.set_defaults(func=prof)
 
+    metrics_cmd = subparsers.add_parser(
+        "metrics", help="Serve live Prometheus metrics of the jobs of this node"
+    )
+    metrics_cmd.add_argument(
+        "--listen",
+        type=str,
+        help="Unix socket path, host:port or port the jobs push to (trace_metrics)",
+        required=True,
+    )
+    metrics_cmd.add_argument(
+        "--port", type=int, help="HTTP port of the metrics", default=9464
+    )
+    metrics_cmd.add_argument(
+        "--host", type=str, help="Interface of the HTTP server", default="127.0.0.1"
+    )
+
+    metrics_cmd.set_defaults(func=metrics)
+
+    worker_cmd = subparsers.add_parser(
+        "worker", help="Run the job steps of this node in preloaded processes"
+    )
+    worker_cmd.add_argument(
+        "--listen",
+        type=str,
+        help="Unix socket path the jobs hand their steps over to (worker_socket)",
+        required=True,
+    )
+
+    worker_cmd.set_defaults(func=work)
+
     args = parser.parse_args(arg_strings)
+    if getattr(args, "pickle", None):
+        profiler.error(
+            "--pickle is no longer supported, profiles are stored in a folder of "
+            "Parquet files set with --store"
+        )
     args.func(args)
 
 
@@ -3,51 +3,65 @@
 import importlib
 import os
 
-from qstone.apps.PyMatching import PyMatching
-from qstone.apps.QBC import QBC
-from qstone.apps.RB import RB
-from qstone.apps.VQE import VQE
 from qstone.connectors import connector
+from qstone.utils.registry import LazyRegistry
 
-# Mapping computation name to its class
-_computation_registry = {
-    "VQE": VQE,
-    "RB": RB,
-    "PyMatching": PyMatching,
-    "QBC": QBC,
-}
-
-ENV_VARS = {
-    "CONNECTIVITY_QPU_IP_ADDRESS": os.environ.get(
-        "CONNECTIVITY_QPU_IP_ADDRESS", "127.0.0.1"
-    ),
-    "CONNECTIVITY_QPU_PORT": int(os.environ.get("CONNECTIVITY_QPU_PORT", "0")),
-    "CONNECTIVITY_COMPILER_IP_ADDRESS": os.environ.get(
-        "CONNECTIVITY_COMPILER_IP_ADDRESS", "127.0.0.1"
-    ),
-    "CONNECTIVITY_COMPILER_PORT": int(
-        os.environ.get("CONNECTIVITY_COMPILER_PORT", "0")
-    ),
-    "CONNECTIVITY_MODE": connector.ConnectorType[
-        os.environ.get("CONNECTIVITY_MODE", "NO_LINK")
-    ],
-    "QPU_MODE": os.environ.get("QPU_MODE", "RANDOM"),
-    "CONNECTIVITY_TARGET": os.environ.get("CONNECTIVITY_TARGET", ""),
-    "LOCKFILE": (
-        os.environ.get("LOCK_FILE", "qstone.lock")
-        if os.environ.get("SCHEDULING_MODE", "NONE") == "LOCK"
-        else None
-    ),
-    "OUTPUT_PATH": os.environ.get("OUTPUT_PATH", ""),
-    "JOB_ID": os.environ.get("JOB_ID", 0),
-    "NUM_QUBITS": int(os.environ.get("NUM_QUBITS", "0")),
-}
+_BUILTIN_COMPUTATIONS = ("VQE", "RB", "PyMatching", "QBC")
+# Mapping computation name to its class, imported when the computation is
+# selected. Plugins register theirs under the `qstone.apps` entry point group.
+_computation_registry = LazyRegistry(
+    "qstone.apps",
+    {name: f"qstone.apps.{name}:{name}" for name in _BUILTIN_COMPUTATIONS},
+)
+
+
+def register_computation(name: str, computation):
+    """Registers a computation class, or the `module:class` path to import it
+    from, under a name"""
+    _computation_registry.register(name, computation)
+
+
+def load_computations() -> list:
+    """Imports all the computations, returns the names of those that failed to"""
+    return _computation_registry.load_all()
+
+
+def load_env_vars() -> dict:
+    """Reads the settings of the job from the environment"""
+    return {
+        "CONNECTIVITY_QPU_IP_ADDRESS": os.environ.get(
+            "CONNECTIVITY_QPU_IP_ADDRESS", "127.0.0.1"
+        ),
+        "CONNECTIVITY_QPU_PORT": int(os.environ.get("CONNECTIVITY_QPU_PORT", "0")),
+        "CONNECTIVITY_COMPILER_IP_ADDRESS": os.environ.get(
+            "CONNECTIVITY_COMPILER_IP_ADDRESS", "127.0.0.1"
+        ),
+        "CONNECTIVITY_COMPILER_PORT": int(
+            os.environ.get("CONNECTIVITY_COMPILER_PORT", "0")
+        ),
+        "CONNECTIVITY_MODE": connector.connector_type(
+            os.environ.get("CONNECTIVITY_MODE", "NO_LINK")
+        ),
+        "QPU_MODE": os.environ.get("QPU_MODE", "RANDOM"),
+        "CONNECTIVITY_TARGET": os.environ.get("CONNECTIVITY_TARGET", ""),
+        "LOCKFILE": (
+            os.environ.get("LOCK_FILE", "qstone.lock")
+            if os.environ.get("SCHEDULING_MODE", "NONE") == "LOCK"
+            else None
+        ),
+        "OUTPUT_PATH": os.environ.get("OUTPUT_PATH", ""),
+        "JOB_ID": os.environ.get("JOB_ID", 0),
+        "NUM_QUBITS": int(os.environ.get("NUM_QUBITS", "0")),
+    }
+
+
+ENV_VARS = load_env_vars()
 
 
 def get_computation_src(src: str):
     """Extracts the computation src either from the standard set or from the user"""
     if src in _computation_registry:
-        computation_src = _computation_registry[src]  # type: ignore [abstract]
+        computation_src = _computation_registry.get(src)
     else:
         try:
             src_module, src_class = src.rsplit(".", 1)
@@ -57,3 +71,10 @@ def get_computation_src(src: str):
                 f"{src} app not found in standard list or as a folder"
             ) from exc
     return computation_src
+
+
+def __getattr__(name: str):
+    """Imports the built-in computation classes on first access"""
+    if name in _BUILTIN_COMPUTATIONS:
+        return _computation_registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,18 +1,10 @@
 """Connectors for different Quantum Stacks"""
 
-import warnings
 from enum import Enum
-from typing import Optional
+from typing import Optional, Union
 
 from qstone.connectors import connection
-
-try:
-    from qstone.connectors.grpc.runner import GRPCConnecction
-except ImportError:
-    warnings.warn("grpc failed to import", ImportWarning)
-from qstone.connectors.backends.rigetti.runner import RigettiConnection
-from qstone.connectors.http.runner import HttpConnection
-from qstone.connectors.no_link.no_link import NoLinkConnection
+from qstone.utils.registry import LazyRegistry
 
 
 class ConnectorType(Enum):
@@ -24,12 +16,51 @@ class ConnectorType(Enum):
     RIGETTI = "RIGETTI"
 
 
+# Mapping connector type to its connection class, imported when the connector is
+# selected. Plugins register theirs under the `qstone.connectors` entry point group.
+_connection_registry = LazyRegistry(
+    "qstone.connectors",
+    {
+        "GRPC": "qstone.connectors.grpc.runner:GRPCConnecction",
+        "NO_LINK": "qstone.connectors.no_link.no_link:NoLinkConnection",
+        "HTTPS": "qstone.connectors.http.runner:HttpConnection",
+        "RIGETTI": "qstone.connectors.backends.rigetti.runner:RigettiConnection",
+    },
+)
+
+
+def register_connection(name: str, connection_cls):
+    """Registers a connection class, or the `module:class` path to import it
+    from, under a connector name"""
+    _connection_registry.register(name, connection_cls)
+
+
+def load_connections() -> list:
+    """Imports all the connections, returns the names of those that failed to"""
+    return _connection_registry.load_all()
+
+
+def connector_type(name: str) -> Union[ConnectorType, str]:
+    """Type of the connector of the given name, the name itself for plugins"""
+    return ConnectorType[name] if name in ConnectorType.__members__ else name
+
+
+def get_connection(conn_type: Union[ConnectorType, str]) -> type:
+    """Returns the connection class of a connector type, importing it on first use
+
+    Raises:
+        KeyError: the connector is neither built in nor registered
+    """
+    name = conn_type.value if isinstance(conn_type, ConnectorType) else conn_type
+    return _connection_registry.get(name)
+
+
 class Connector:
     """Class used to hold connection between HPC compute node and Quantum bridge"""
 
     def __init__(
         self,
-        conn_type: ConnectorType,
+        conn_type: Union[ConnectorType, str],
         mode: str,
         qpu_host: str,
         qpu_port: int,
@@ -46,18 +77,9 @@ class Connector:
         self._compiler_host = compiler_host
         self._compiler_port = compiler_port
         self._target = target
-        self._connection: connection.Connection
+        self._connection: connection.Connection = get_connection(conn_type)()
         self._lockfile: Optional[str] = None if lockfile == "NONE" else lockfile
 
-        if self.protocol == ConnectorType.GRPC:
-            self._connection = GRPCConnecction()
-        elif self.protocol == ConnectorType.HTTPS:
-            self._connection = HttpConnection()
-        elif self.protocol == ConnectorType.NO_LINK:
-            self._connection = NoLinkConnection()
-        elif self.protocol == ConnectorType.RIGETTI:
-            self._connection = RigettiConnection()
-
     @property
     def protocol(self):
         """Returns the protocol information"""
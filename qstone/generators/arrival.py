@@ -0,0 +1,131 @@
+"""
+Arrival processes of the generated jobs.
+
+Open-loop models give the release time of each job, in seconds from the start
+of the run, whether or not the previous jobs are done, so that jobs overlap as
+on a shared machine. The think-time model is closed-loop: each job is released
+a think time after the previous one completed. Without a model the jobs of a
+user run back-to-back.
+"""
+
+from typing import Callable, Optional, Tuple
+
+import numpy
+
+OPEN_LOOP = "open"
+CLOSED_LOOP = "closed"
+# Candidate arrivals drawn at once when thinning a time-varying rate
+_THINNING_BATCH = 1024
+
+
+def _poisson(cfg: dict, job_count: int) -> numpy.ndarray:
+    """Poisson process at `rate` jobs per second"""
+    gaps = numpy.random.exponential(1.0 / float(cfg["rate"]), size=job_count)
+    return numpy.cumsum(gaps)
+
+
+def _mmpp(cfg: dict, job_count: int) -> numpy.ndarray:
+    """
+    Bursty arrivals: a Markov-modulated Poisson process alternating between the
+    states of `rates` (jobs per second), staying in each for an exponential time
+    of mean `durations` (seconds). Starts in the first state.
+    """
+    rates = [float(r) for r in cfg["rates"]]
+    durations = [float(d) for d in cfg["durations"]]
+    if len(rates) != len(durations):
+        raise ValueError("MMPP needs one duration per rate")
+    if max(rates, default=0) <= 0:
+        raise ValueError("MMPP needs a positive rate")
+    times: list = []
+    start, state = 0.0, 0
+    while len(times) < job_count:
+        end = start + numpy.random.exponential(durations[state])
+        if rates[state] > 0:
+            t = start + numpy.random.exponential(1.0 / rates[state])
+            while t < end and len(times) < job_count:
+                times.append(t)
+                t += numpy.random.exponential(1.0 / rates[state])
+        start, state = end, (state + 1) % len(rates)
+    return numpy.array(times)
+
+
+def _diurnal(cfg: dict, job_count: int) -> numpy.ndarray:
+    """
+    Poisson process whose rate follows a daily cycle,
+    rate * (1 + amplitude * sin(2 pi (t / period + phase))), drawn by thinning.
+    The period defaults to a day, the phase is a fraction of it.
+    """
+    rate = float(cfg["rate"])
+    amplitude = float(cfg.get("amplitude", 0.5))
+    period = float(cfg.get("period", 86400))
+    phase = float(cfg.get("phase", 0.0))
+    if not 0 <= amplitude <= 1:
+        raise ValueError("The amplitude of the diurnal cycle is in [0, 1]")
+    peak = rate * (1 + amplitude)
+    times = numpy.empty(0)
+    start = 0.0
+    while len(times) < job_count:
+        candidates = start + numpy.cumsum(
+            numpy.random.exponential(1.0 / peak, size=_THINNING_BATCH)
+        )
+        current = rate * (
+            1 + amplitude * numpy.sin(2 * numpy.pi * (candidates / period + phase))
+        )
+        accepted = numpy.random.uniform(size=_THINNING_BATCH) * peak < current
+        times = numpy.concatenate([times, candidates[accepted]])
+        start = candidates[-1]
+    return times[:job_count]
+
+
+def _think(cfg: dict, job_count: int) -> numpy.ndarray:
+    """
+    Think time before each job, after the previous one completed, drawn from
+    `distribution`: constant or exponential of `mean`, uniform in [`low`,
+    `high`), or lognormal of `mean` and log standard deviation `sigma`
+    """
+    distribution = cfg.get("distribution", "exponential")
+    if distribution == "constant":
+        return numpy.full(job_count, float(cfg["mean"]))
+    if distribution == "exponential":
+        return numpy.random.exponential(float(cfg["mean"]), size=job_count)
+    if distribution == "uniform":
+        return numpy.random.uniform(
+            float(cfg["low"]), float(cfg["high"]), size=job_count
+        )
+    if distribution == "lognormal":
+        sigma = float(cfg.get("sigma", 1.0))
+        # Location of the underlying normal giving the requested mean
+        mu = numpy.log(float(cfg["mean"])) - sigma**2 / 2
+        return numpy.random.lognormal(mu, sigma, size=job_count)
+    raise ValueError(f"Unknown think time distribution {distribution}")
+
+
+ARRIVAL_MODELS: dict[str, Tuple[str, Callable[[dict, int], numpy.ndarray]]] = {
+    "poisson": (OPEN_LOOP, _poisson),
+    "mmpp": (OPEN_LOOP, _mmpp),
+    "diurnal": (OPEN_LOOP, _diurnal),
+    "think": (CLOSED_LOOP, _think),
+}
+
+
+def arrival_times(
+    arrival_cfg: Optional[dict], job_count: int
+) -> Tuple[str, Optional[numpy.ndarray]]:
+    """
+    Draws the arrivals of the jobs of a user.
+
+    Args:
+        arrival_cfg: `arrival` setting of the user, with the name of the `model`
+        job_count: number of jobs of the user
+
+    Returns the loop, open or closed, and the release time of each job for an
+    open loop, the think time before each job for a closed loop, or None when
+    the jobs run back-to-back
+    """
+    if not isinstance(arrival_cfg, dict):
+        return CLOSED_LOOP, None
+    model = arrival_cfg.get("model", "poisson")
+    if model not in ARRIVAL_MODELS:
+        raise ValueError(f"Unknown arrival model {model}")
+    loop, draw = ARRIVAL_MODELS[model]
+    return loop, draw(arrival_cfg, job_count)
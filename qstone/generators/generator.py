@@ -4,31 +4,78 @@ Generation of the testbench.
 
 import argparse
 import base64
+import collections
+import contextlib
+import functools
+import gzip
+import io
+import json
 import math
 import os
 import pickle
-import shutil
 import tarfile
-from typing import Any, List, Union
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Union
 
 import numpy
 import pandas as pa
-from jinja2 import Template
-
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+)
+
+from qstone.generators.arrival import OPEN_LOOP, arrival_times
 from qstone.utils.utils import QpuConfiguration, parse_json
 
 SCHEDULERS = {
     "bare_metal": "bare_metal",
     "jsrun": "lsf/jsrun",
+    "pilot": "pilot",
     "slurm": "slurm/schedmd",
 }
-SCHEDULER_CMDS = {"bare_metal": "bash", "jsrun": "jrun", "slurm": "sbatch"}
-SCHEDULER_EXTS = {"bare_metal": "sh", "jsrun": "bsub", "slurm": "sbatch"}
+SCHEDULER_CMDS = {
+    "bare_metal": "bash",
+    "jsrun": "jrun",
+    "pilot": "bash",
+    "slurm": "sbatch",
+}
+SCHEDULER_EXTS = {"bare_metal": "sh", "jsrun": "bsub", "pilot": "sh", "slurm": "sbatch"}
+# Submission option making a job wait for the success of the job of the given id
+SCHEDULER_DEPENDENCIES = {
+    "bare_metal": "",
+    "jsrun": "-w done({})",
+    "pilot": "",
+    "slurm": "--dependency=afterok:{}",
+}
+# Resource request of the jobs holding the QPU, in the SCHEDULER scheduling mode
+SCHEDULER_QPU_REQUESTS = {
+    "bare_metal": "",
+    "jsrun": '-R "rusage[qpu=1]"',
+    "pilot": "",
+    "slurm": "--gres=qpu:1",
+}
+# Steps submitted as separate jobs when chained
+CHAIN_STEPS = ("pre", "run", "post")
 
 SCHEDULER_ARGS = {"walltime": "3", "nthreads": "1"}
 
 CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 GEN_PATH = "qstone_suite"
+# Jobs of a suite, streamed by the runner
+MANIFEST = "jobs.jsonl.gz"
+# Jobs of each array job, read by its tasks
+TASKS = "tasks_{app}.jsonl"
+# Schedulers supporting array jobs and job dependencies
+ARRAY_SCHEDULERS = ("slurm", "jsrun")
+# Size above which the manifest is spooled to disk while packed
+MANIFEST_SPOOL = 1 << 24
+# Compiled templates, shared by all the generate invocations of the user, in
+# the user cache folder
+CACHE_FOLDER = os.path.join("qstone", "templates")
 
 
 def _check_nan(val):
@@ -61,45 +108,114 @@ def _find_files(sched_path: str):
     return (jinja_files, non_jinja_files)
 
 
+def _cache_path() -> str:
+    """Folder of the compiled templates, under `$XDG_CACHE_HOME` (`~/.cache`)"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, CACHE_FOLDER)
+
+
+@functools.lru_cache(maxsize=None)
+def _environment(sched_path: str) -> Environment:
+    """Jinja environment of a scheduler and the common templates. Templates are
+    parsed and compiled once per process, and the compiled code is kept in a
+    bytecode cache in the user cache folder, or in the temporary folder when it
+    cannot be written."""
+    cache_path = _cache_path()
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        writable = os.access(cache_path, os.W_OK)
+    except OSError:
+        writable = False
+    cache = (
+        FileSystemBytecodeCache(cache_path) if writable else FileSystemBytecodeCache()
+    )
+    return Environment(
+        loader=FileSystemLoader([sched_path, os.path.join(CURRENT_PATH, "common")]),
+        bytecode_cache=cache,
+        autoescape=select_autoescape(),
+    )
+
+
 def _render_templates(
     sched: str,
     sched_path: str,
     subs: dict,
     job_types: List[str],
     jobs_cfg: pa.DataFrame,
-):
-    """Convert all templates and add all the files that are in the scheduler folder"""
-    # Ignore folders and search in the search paths all the paths
-    jinja_files, non_jinja_files = _find_files(sched_path)
-    # Adding templated files
+) -> Iterator[Tuple[str, bytes]]:
+    """Renders all the templates of the scheduler folder and the common ones,
+    yields the name and content of each rendered file"""
+    jinja_files, _ = _find_files(sched_path)
+    env = _environment(sched_path)
     for jinja_file in jinja_files:
-        with open(jinja_file, encoding="utf-8") as fid:
-            source = fid.read()
+        template = env.get_template(os.path.basename(jinja_file))
+        name = os.path.basename(jinja_file.replace(".jinja", ""))
         if "{app}" in jinja_file:
             for t in job_types:
-                outfile = os.path.join(
-                    GEN_PATH,
-                    os.path.basename(
-                        jinja_file.replace(".jinja", "").replace("{app}", t)
-                    ),
-                )
                 j = jobs_cfg[jobs_cfg["type"] == t]
                 args = {
                     key: _get_value(j, key, val) for key, val in SCHEDULER_ARGS.items()
                 }
                 sched_args = {"sched_args": _get_value(j, f"{sched}_opt", "")}
-                Template(source).stream({**subs, **args, **sched_args}).dump(outfile)
+                array = {"array_size": subs.get("arrays", {}).get(t, 0)}
+                # Chained jobs get one script per step
+                for step in CHAIN_STEPS if subs.get("chain") else ("",):
+                    rendered = template.render(
+                        {**subs, **args, **sched_args, **array, "step": step}
+                    )
+                    app = f"{t}_{step}" if step else t
+                    yield name.replace("{app}", app), rendered.encode("utf-8")
         else:
-            outfile = os.path.join(
-                GEN_PATH, os.path.basename(jinja_file.replace(".jinja", ""))
-            )
-            Template(source).stream(subs).dump(outfile)
-    # Adding non template files
-    for non_jinja_file in non_jinja_files:
-        shutil.copy(
-            non_jinja_file,
-            f"{os.path.join(GEN_PATH, os.path.basename(non_jinja_file))}",
+            yield name, template.render(subs).encode("utf-8")
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes, mode: int = 0o644):
+    """Adds a file to the archive straight from memory"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _add_stream(
+    tar: tarfile.TarFile, name: str, chunks: Iterable[bytes], compress: bool = False
+):
+    """Adds a file to the archive out of chunks of data, spooled to disk when
+    large so that packing does not hold the whole file in memory"""
+    with tempfile.SpooledTemporaryFile(MANIFEST_SPOOL) as spool:
+        stream = (
+            gzip.GzipFile(fileobj=spool, mode="wb", mtime=0)
+            if compress
+            else contextlib.nullcontext(spool)
         )
+        with stream as output:
+            for chunk in chunks:
+                output.write(chunk)
+        info = tarfile.TarInfo(name)
+        info.size = spool.tell()
+        info.mode = 0o644
+        info.mtime = int(time.time())
+        spool.seek(0)
+        tar.addfile(info, spool)
+
+
+def _add_manifest(tar: tarfile.TarFile, name: str, jobs: List[tuple]):
+    """Adds the manifest of the jobs to the archive: one JSON list of the job
+    settings per line, gzip compressed, encoded job by job"""
+    lines = (json.dumps(job).encode("utf-8") + b"\n" for job in jobs)
+    _add_stream(tar, name, lines, compress=True)
+
+
+def _add_tasks(tar: tarfile.TarFile, name: str, jobs: List[tuple]):
+    """Adds the jobs of an array job to the archive: one JSON list of the job
+    settings per line, padded to the same width so that a task reads its job at
+    the offset of its index"""
+    lines = [json.dumps(job).encode("utf-8") for job in jobs]
+    width = max(len(line) for line in lines)
+    _add_stream(tar, name, (line.ljust(width) + b"\n" for line in lines))
 
 
 def _render_and_pack(
@@ -108,19 +224,35 @@ def _render_and_pack(
     subs: dict,
     job_types: List[str],
     jobs_cfg: pa.DataFrame,
+    jobs: List[tuple],
 ):
     """
-    Renders and packs all the necessary files to run as a user
+    Renders and packs all the necessary files to run as a user, and the manifest
+    of the jobs. Rendered files are written to the archive from memory, so that
+    users can be packed concurrently.
     """
     sched = SCHEDULERS[scheduler]
     sched_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), sched)
-    shutil.rmtree(GEN_PATH, ignore_errors=True)
-    os.makedirs(GEN_PATH)
-    _render_templates(sched, sched_path, subs, job_types, jobs_cfg)
-    # Copy the required files.
+    _, non_jinja_files = _find_files(sched_path)
     with tarfile.open(output_filename, "w:gz") as tar:
-        # Adding necessary scripts excluding original templates
-        tar.add(GEN_PATH, recursive=True)
+        folder = tarfile.TarInfo(GEN_PATH)
+        folder.type = tarfile.DIRTYPE
+        folder.mode = 0o755
+        folder.mtime = int(time.time())
+        tar.addfile(folder)
+        # Adding rendered templates and the files of the scheduler folder
+        for name, data in _render_templates(
+            sched, sched_path, subs, job_types, jobs_cfg
+        ):
+            _add_bytes(tar, f"{GEN_PATH}/{name}", data)
+        _add_manifest(tar, f"{GEN_PATH}/{MANIFEST}", jobs)
+        for job_type in subs.get("arrays", {}):
+            tasks = [job for job in jobs if job[0] == job_type]
+            _add_tasks(tar, f"{GEN_PATH}/{TASKS.format(app=job_type)}", tasks)
+        for non_jinja_file in non_jinja_files:
+            tar.add(
+                non_jinja_file, arcname=f"{GEN_PATH}/{os.path.basename(non_jinja_file)}"
+            )
         for job_type in job_types:
             # Adding user defined apps
             job_cfg = jobs_cfg[jobs_cfg["type"] == job_type]
@@ -132,7 +264,7 @@ def _render_and_pack(
                     arcname=f"{GEN_PATH}/{os.path.basename(app)}",
                     recursive=False,
                 )
-    shutil.rmtree(GEN_PATH)
+    return output_filename
 
 
 def _compute_job_pdf(usr_cfg: "pa.Series[Any]") -> List[float]:
@@ -147,24 +279,57 @@ def _compute_job_pdf(usr_cfg: "pa.Series[Any]") -> List[float]:
     return normalized
 
 
-def _randomise(vals, def_val):
-    """Return randomised value from range when available"""
-
-    if pa.isnull(vals).any():
-        value = def_val
-    else:
-        values = vals.tolist()[0]
-        if len(values) > 1:
-            value = numpy.random.randint(values[0], values[1])
-        else:
-            value = values[0]
-    return value
+def _bounds(vals, def_val) -> tuple[Any, int, int]:
+    """Value of a job parameter, or the range [low, high) it is drawn from when
+    configured as a pair. Returns the value, None for a range, low and high"""
+    if not isinstance(vals, (list, tuple)):
+        return (def_val if pa.isnull(vals) else vals), 0, 0
+    if len(vals) > 1:
+        return None, int(vals[0]), int(vals[1])
+    return vals[0], 0, 0
 
 
 def _to_bytes(ob):
     return base64.b64encode(pickle.dumps(ob)).decode("utf-8")
 
 
+DEFAULT_QUBITS = 2
+DEFAULT_SHOTS = 100
+DEFAULT_LOGGING_LEVEL = 2
+
+
+def _job_type_table(jobs_cfg: pa.DataFrame, job_types: List[str]) -> pa.DataFrame:
+    """
+    Parameters of each job type, computed once: qubits and shots (or the bounds
+    they are drawn from), logging level and encoded app arguments. Types missing
+    from the configuration, or settings missing from a type, take the defaults.
+    """
+    configured = jobs_cfg.drop_duplicates("type").set_index("type")
+    rows = []
+    for job_type in job_types:
+        cfg = configured.loc[job_type] if job_type in configured.index else {}
+        qubits = _bounds(cfg.get("qubits", numpy.nan), DEFAULT_QUBITS)
+        shots = _bounds(cfg.get("num_shots", numpy.nan), DEFAULT_SHOTS)
+        app_args = cfg.get("app_args", numpy.nan)
+        level = cfg.get("app_logging_level", numpy.nan)
+        rows.append(
+            {
+                "qubits": qubits[0],
+                "qubits_low": qubits[1],
+                "qubits_high": qubits[2],
+                "num_shots": shots[0],
+                "num_shots_low": shots[1],
+                "num_shots_high": shots[2],
+                "app_logging_level": (
+                    DEFAULT_LOGGING_LEVEL if _check_nan(level) else int(level)
+                ),
+                "app_args": "" if _check_nan(app_args) else _to_bytes(app_args),
+            }
+        )
+    # Values are kept as configured, e.g. integers are not turned into floats
+    return pa.DataFrame(rows, index=job_types, dtype=object)
+
+
 def _generate_user_jobs(
     usr_cfg: "pa.Series[Any]",
     jobs_cfg: pa.DataFrame,
@@ -173,60 +338,106 @@ def _generate_user_jobs(
 ):
     """
     Generates the different user jobs provided given the configuration and the number of
-    calls.
+    calls. Each job is the list of the arguments of its runner: type, qubits, id,
+    shots, logging level and app arguments.
     """
-    runner = 'python "$EXEC_PATH"/type_exec.py'
-    job_types = numpy.random.choice(
-        list(usr_cfg["computations"].keys()), p=job_pdf, size=(job_count)
-    )
+    computations = list(usr_cfg["computations"].keys())
+    job_types = numpy.random.choice(computations, p=job_pdf, size=job_count)
     # Check that we have generated a not empty
     assert (
         len(job_types) > 0
     ), "Configuration generated zero jobs. Please check your configuration file."
 
-    # Randomise number of qubits
-    num_qubits = []
-    num_shots = []
-    app_logging_level = []
-    app_args = []
-
-    def_qubits = 2
-    def_shots = 100
-    for j in job_types:
-        app_cfg = jobs_cfg[jobs_cfg["type"] == j]
-        if app_cfg.empty:
-            num_qubits.append(def_qubits)
-            num_shots.append(def_shots)
-            app_args.append("")
-            app_logging_level.append(2)
-        else:
-            num_qubits.append(_randomise(app_cfg["qubits"], def_qubits))
-            num_shots.append(_randomise(app_cfg["num_shots"], def_shots))
-            if "app_args" in app_cfg.columns:
-                t = app_cfg["app_args"].tolist()[0]
-                if not _check_nan(t):
-                    app_args.append(_to_bytes(t))
-            if "app_logging_level" in app_cfg.columns:
-                t = app_cfg["app_logging_level"].tolist()[0]
-                if not _check_nan(t):
-                    app_logging_level.append(int(t))
+    table = _job_type_table(jobs_cfg, computations)
+    return _job_settings(table, job_types), set(job_types)
+
+
+def _job_settings(
+    table: pa.DataFrame, job_types: numpy.ndarray, known: Optional[numpy.ndarray] = None
+) -> List[tuple]:
+    """
+    Settings of jobs of the given types, from the table of the job types. Qubits
+    and shots are the known ones when given (NaN when not known), the configured
+    ones otherwise.
+    """
+    codes = table.index.get_indexer(job_types)
+    params = ["qubits", "num_shots"]
+    values = numpy.stack(
+        [table[p].to_numpy(dtype=object)[codes] for p in params], axis=1
+    )
+    low, high = (
+        numpy.stack(
+            [table[f"{p}_{b}"].to_numpy(dtype="int64")[codes] for p in params], axis=1
+        )
+        for b in ("low", "high")
+    )
+    if known is not None:
+        recorded = ~numpy.isnan(known)
+        values[recorded] = known[recorded].astype("int64").tolist()
+    # Randomise the number of qubits and shots of all the jobs in one call. The
+    # draws are made job by job, qubits first, as one call per parameter would.
+    ranged = pa.isnull(values)
+    if ranged.any():
+        values[ranged] = numpy.random.randint(low[ranged], high[ranged]).tolist()
     # Assign job id and pack
     job_ids = list(range(len(job_types)))
-    return (
-        list(
-            zip(
-                [f"{runner} {s}" for s in job_types],
-                num_qubits,
-                job_ids,
-                num_shots,
-                app_logging_level,
-                app_args,
-            )
-        ),
-        set(job_types),
+    return list(
+        zip(
+            job_types.tolist(),
+            values[:, 0].tolist(),
+            job_ids,
+            values[:, 1].tolist(),
+            table["app_logging_level"].to_numpy(dtype=object)[codes].tolist(),
+            table["app_args"].to_numpy(dtype=object)[codes].tolist(),
+        )
     )
 
 
+def _replay_user_jobs(recorded: pa.DataFrame, jobs_cfg: pa.DataFrame):
+    """
+    Replays the jobs recorded for a user, in order of release: their type,
+    qubits and shots, and their release time. Qubits and shots not recorded are
+    taken from the configuration of the job type.
+    """
+    job_types = recorded["job_type"].to_numpy(dtype=str)
+    table = _job_type_table(jobs_cfg, sorted(set(job_types)))
+    known = recorded[["qubits", "shots"]].to_numpy(dtype="float64")
+    jobs = _job_settings(table, job_types, known)
+    releases = recorded["release"].round(6).tolist()
+    return [(*job, r) for job, r in zip(jobs, releases)], set(job_types)
+
+
+def _configured_jobs(
+    users_cfg: pa.DataFrame, jobs_cfg: pa.DataFrame, job_count: int
+) -> Iterator[Tuple[str, List[tuple], set, str]]:
+    """Draws the jobs of each configured user, yields the user, jobs, job types
+    and arrival loop"""
+    for _, user_cfg in users_cfg.iterrows():
+        pdf = _compute_job_pdf(user_cfg)
+        # Get the job count either from global or user configuration.
+        job_count_user = float(
+            _get_value(user_cfg.to_frame(), "job_count", str(job_count))
+        )
+        jobs, job_types = _generate_user_jobs(
+            user_cfg, jobs_cfg, pdf, int(job_count_user)
+        )
+        # Release or think time of each job, after the job settings are drawn
+        loop, delays = arrival_times(user_cfg.get("arrival"), len(jobs))
+        if delays is not None:
+            jobs = [(*job, round(float(d), 6)) for job, d in zip(jobs, delays)]
+        yield user_cfg["user"], jobs, job_types, loop
+
+
+def _replayed_jobs(
+    replay: pa.DataFrame, jobs_cfg: pa.DataFrame
+) -> Iterator[Tuple[str, List[tuple], set, str]]:
+    """Replays the recorded jobs of each user, yields the user, jobs, job types
+    and arrival loop"""
+    for user, recorded in replay.groupby("user", sort=True):
+        jobs, job_types = _replay_user_jobs(recorded, jobs_cfg)
+        yield str(user), jobs, job_types, OPEN_LOOP
+
+
 def _environment_variables_exports(env_vars: dict) -> List[str]:
     """
     Generates export statements for environment variables, handling nested dictionaries.
@@ -267,20 +478,59 @@ def _environment_variables_exports(env_vars: dict) -> List[str]:
 
 
 def generate_suite(
-    config: str, job_count: int, output_folder: str, atomic: bool, scheduler: str
+    config: str,
+    job_count: int,
+    output_folder: str,
+    atomic: bool,
+    scheduler: str,
+    workers: Optional[int] = None,
+    replay: Optional[pa.DataFrame] = None,
+    array: bool = False,
+    chain: bool = False,
 ) -> List[str]:
     """
     Generates the suites of jobs for the required users.
 
+    The jobs of all the users are drawn first, in order, so that the suites only
+    depend on the random seed. The suites are then rendered and packed in
+    parallel over a pool of processes.
+
+    A replay, as loaded by `qstone.generators.replay.recorded_jobs`, replaces the
+    configured users and their jobs by the recorded ones, released at their
+    recorded times. The configuration still provides the environment and the
+    settings of the job types.
+
+    In array mode, the jobs of each type are submitted at once as one Slurm or
+    LSF array job, whose tasks read their settings by index. Jobs are then
+    released by the scheduler rather than at their arrival times.
+
+    With the pilot scheduler, the suite is run in one allocation by a task farm
+    running the jobs of the manifest on its cores, with the concurrency set by
+    the `pilot_workers` environment setting.
+
+    In chained mode, the pre, run and post steps of each job are submitted as
+    separate jobs, each depending on the success of the previous one, and only
+    the run job requests the QPU from the scheduler.
+
     Args:
         config: Input configuration for generate, defines QPU configuration and user jobs
         job_count: Number of jobs to generate per user
         output_folder: Scheduler tar file output location
         atomic: optional flag to create a single job out of the three phase
         scheduler: target HPC scheduler
+        workers: number of processes packing the suites, defaults to the CPU count
+        replay: recorded jobs to replay instead of the configured users
+        array: submit one array job per user and job type
+        chain: submit the steps of each job as dependent jobs
 
     Returns list of output file paths
     """
+    if (array or chain) and scheduler not in ARRAY_SCHEDULERS:
+        raise ValueError(
+            f"Array and chained jobs need one of the {ARRAY_SCHEDULERS} schedulers"
+        )
+    if chain and (array or atomic):
+        raise ValueError("Chained jobs need the three-phase layout, without arrays")
     # Get configurations
     config_dict = parse_json(config)
     env_cfg = config_dict["environment"]
@@ -292,47 +542,51 @@ def generate_suite(
     qpu_config = QpuConfiguration()
     qpu_config.load_configuration(env_cfg)
 
-    if not job_count:
-        job_count = env_cfg["job_count"]
-
     # Generating list of jobs
-    output_paths = []
-    for prog_id, user_cfg in users_cfg.iterrows():
-        pdf = _compute_job_pdf(user_cfg)
-        # Get the job count either from global or user configuration.
-        job_count_user = float(
-            _get_value(user_cfg.to_frame(), "job_count", str(job_count))
-        )
-        jobs, job_types = _generate_user_jobs(
-            user_cfg, jobs_cfg, pdf, int(job_count_user)
-        )
-
+    if replay is not None:
+        users = _replayed_jobs(replay, jobs_cfg)
+    else:
+        users = _configured_jobs(users_cfg, jobs_cfg, job_count or env_cfg["job_count"])
+    tasks = []
+    for prog_id, (user_name, jobs, job_types, loop) in enumerate(users):
         # generate substitutions for Jinja templates
-        formatted_jobs = [" ".join(map(str, job)) for job in jobs]
-
-        user_name = user_cfg["user"]
         usr_env_exports = [
             f'export PROG_ID="{prog_id}"',
             f'export QS_USER="{user_name}"',
+            f'export QS_ARRIVAL="{loop}"',
         ]
         subs = {
             "exports": "\n".join(env_exports + usr_env_exports),
-            "jobs": "\n".join(formatted_jobs),
+            "manifest": MANIFEST,
+            # The jobs are farmed out to the cores of one allocation
+            "pilot": scheduler == "pilot",
+            # Number of tasks of the array job of each type
+            "arrays": (
+                dict(sorted(collections.Counter(job[0] for job in jobs).items()))
+                if array
+                else {}
+            ),
             "project_name": env_cfg["project_name"],
             "atomic": atomic,
             "sched_ext": SCHEDULER_EXTS[scheduler],
             "sched_cmd": SCHEDULER_CMDS[scheduler],
+            "sched_dependency": SCHEDULER_DEPENDENCIES[scheduler],
+            "chain": chain,
             "sched_aware": (
-                "--gres=qpu:1" if env_cfg["scheduling_mode"] == "SCHEDULER" else ""
+                SCHEDULER_QPU_REQUESTS[scheduler]
+                if env_cfg["scheduling_mode"] == "SCHEDULER"
+                else ""
             ),
         }
 
         # Pack project files
         filename = os.path.join(output_folder, f"{scheduler}_{user_name}.qstone.tar.gz")
-        # render and pack all the files
-        _render_and_pack(scheduler, filename, subs, job_types, jobs_cfg)
-        output_paths.append(filename)
-    return output_paths
+        tasks.append((scheduler, filename, subs, sorted(job_types), jobs_cfg, jobs))
+    # render and pack all the files
+    if workers == 1 or len(tasks) <= 1:
+        return [_render_and_pack(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_and_pack, *zip(*tasks)))
 
 
 def main():
@@ -0,0 +1,64 @@
+"""
+Replay of the workloads recorded in a profile store.
+"""
+
+from typing import Optional
+
+import numpy
+import pandas as pa
+
+from qstone.profiling.store import Filters, ProfileStore
+from qstone.utils.tracing import JOB_SETTINGS
+
+NS_TO_S = 1e9
+RECORDED_COLUMNS = ["user", "job_type", "qubits", "shots", "release"]
+
+
+def recorded_jobs(
+    store: str, filters: Optional[Filters] = None, speedup: float = 1.0
+) -> pa.DataFrame:
+    """
+    Loads the jobs recorded in the partitions of a profile store matching the
+    filters, to be replayed by `generate_suite`.
+
+    A job is released when its first span starts, on the timeline shared by all
+    the hosts, and release times count from the first job recorded. Jobs traced
+    before their qubits and shots were recorded have NaN for these.
+
+    Args:
+        store: folder of the profile store
+        filters: accepted value(s) for the run, user and date partition keys
+        speedup: factor by which the recorded times are compressed
+
+    Returns one row per job, sorted by release time: its user, type, qubits,
+    shots and release time in seconds
+    """
+    if speedup <= 0:
+        raise ValueError("The speedup of a replay must be positive")
+    columns = ["run", "user", "prog_id", "job_id", "job_type", "start"]
+    columns += ["clock_offset"] + JOB_SETTINGS
+    stats = ProfileStore(store).read(columns, filters, "job_type != 'CONNECTION'")
+    if stats.empty:
+        raise ValueError(f"No jobs recorded in {store} for {filters or 'any run'}")
+    for name in JOB_SETTINGS:
+        if name not in stats:
+            stats[name] = numpy.nan
+    stats["arrival"] = stats["start"]
+    if "clock_offset" in stats:
+        # Spans of all the hosts on one timeline
+        stats["arrival"] += stats["clock_offset"].fillna(0).astype("int64")
+    jobs = (
+        stats.sort_values("arrival", kind="stable")
+        .groupby(["run", "user", "prog_id", "job_id"], sort=False)
+        .agg(
+            job_type=("job_type", "first"),
+            qubits=("qubits", "max"),
+            shots=("shots", "max"),
+            arrival=("arrival", "min"),
+        )
+        .reset_index()
+    )
+    jobs["release"] = (jobs["arrival"] - jobs["arrival"].min()) / NS_TO_S / speedup
+    return jobs.sort_values("release", kind="stable")[RECORDED_COLUMNS].reset_index(
+        drop=True
+    )
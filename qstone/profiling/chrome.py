@@ -0,0 +1,153 @@
+"""Export of the profiled traces to the Chrome Trace Event Format (Perfetto)"""
+
+import json
+from typing import IO, Optional
+
+import numpy
+import pandas as pd
+
+NS_TO_US = 1000
+# Events serialised before being written out
+CHUNK_EVENTS = 10000
+# Complete event of a span, nested in the enclosing spans of the same track
+SLICE_EVENT = (
+    '{"name": %s, "cat": %s, "ph": "X", "ts": %.3f, "dur": %.3f, "pid": %d, '
+    '"tid": %d, "args": {"label": %s, "success": %s, "span_id": %d}}'
+)
+
+
+def frame_names(stats: pd.DataFrame) -> numpy.ndarray:
+    """Name of the traced call of each span, e.g. `CONNECTION.RUN:label`"""
+    names = (stats["job_type"] + "." + stats["job_step"]).to_numpy(dtype=object)
+    if "label" in stats:
+        labelled = stats["label"].notna().to_numpy()
+        labels = stats["label"].to_numpy(dtype=object)[labelled]
+        names[labelled] = names[labelled] + ":" + labels.astype(str).astype(object)
+    return names
+
+
+def _encoded(values: numpy.ndarray) -> numpy.ndarray:
+    """JSON encoding of each value, the distinct values being encoded once"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    encoded = numpy.array(
+        [json.dumps(None if pd.isna(u) else u) for u in uniques], dtype=object
+    )
+    return encoded[codes]
+
+
+class ChromeTraceWriter:
+    """
+    Streams profiled traces to a JSON file in the Trace Event Format, which
+    Perfetto and chrome://tracing open.
+
+    Each host is a process and each job of a process on that host a thread, so
+    that nested calls are shown as nested slices of the job track. Events are
+    written as the traces are given, only the track ids are kept in memory.
+
+    Args:
+        path: output file
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fid: Optional[IO[str]] = None
+        self._hosts: dict[str, int] = {}
+        self._tracks: dict[tuple, int] = {}
+        self._events = 0
+
+    def __enter__(self) -> "ChromeTraceWriter":
+        self._fid = open(self._path, "w", encoding="utf-8")
+        self._fid.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+        return self
+
+    def __exit__(self, *exc):
+        self._fid.write("\n]}\n")  # type: ignore[union-attr]
+        self._fid.close()  # type: ignore[union-attr]
+        self._fid = None
+
+    @property
+    def events(self) -> int:
+        """Returns the number of events written"""
+        return self._events
+
+    def _emit(self, events: list[str]):
+        if not events:
+            return
+        separator = ",\n" if self._events else ""
+        self._fid.write(separator + ",\n".join(events))  # type: ignore[union-attr]
+        self._events += len(events)
+
+    def _track(self, host: str, pid: int, job: tuple, events: list[str]) -> tuple:
+        """Process and thread ids of a job, declaring new tracks with metadata"""
+        if host not in self._hosts:
+            self._hosts[host] = len(self._hosts) + 1
+            events.append(
+                json.dumps(
+                    {
+                        "ph": "M",
+                        "name": "process_name",
+                        "pid": self._hosts[host],
+                        "args": {"name": host},
+                    }
+                )
+            )
+        key = (host, pid, *job)
+        if key not in self._tracks:
+            self._tracks[key] = len(self._tracks) + 1
+            user, prog_id, job_id = job
+            events.append(
+                json.dumps(
+                    {
+                        "ph": "M",
+                        "name": "thread_name",
+                        "pid": self._hosts[host],
+                        "tid": self._tracks[key],
+                        "args": {
+                            "name": f"{user} prog {prog_id} job {job_id} (pid {pid})"
+                        },
+                    }
+                )
+            )
+        return self._hosts[host], self._tracks[key]
+
+    def write(self, stats: pd.DataFrame):
+        """Writes the spans of the traces, which need their global times
+
+        Args:
+            stats: profiled traces
+        """
+        names = _encoded(frame_names(stats))
+        categories = _encoded(stats["job_type"].to_numpy(dtype=object))
+        labels = _encoded(
+            stats["label"].to_numpy(dtype=object)
+            if "label" in stats
+            else numpy.full(len(stats), None)
+        )
+        hosts = stats["host"].fillna("unknown").to_numpy(dtype=object)
+        jobs = stats[["user", "prog_id", "job_id"]].to_numpy(dtype=object)
+        pids = stats["pid"].to_numpy()
+        span_ids = stats["span_id"].to_numpy()
+        start = stats["global_start"].to_numpy() / NS_TO_US
+        duration = (stats["end"] - stats["start"]).to_numpy() / NS_TO_US
+        success = numpy.where(stats["success"].to_numpy(dtype=bool), "true", "false")
+        events: list[str] = []
+        for i in range(len(stats)):
+            pid, tid = self._track(hosts[i], int(pids[i]), tuple(jobs[i]), events)
+            events.append(
+                SLICE_EVENT
+                % (
+                    names[i],
+                    categories[i],
+                    start[i],
+                    duration[i],
+                    pid,
+                    tid,
+                    labels[i],
+                    success[i],
+                    span_ids[i],
+                )
+            )
+            if len(events) >= CHUNK_EVENTS:
+                self._emit(events)
+                events = []
+        self._emit(events)
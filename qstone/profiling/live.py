@@ -0,0 +1,381 @@
+"""Node-local aggregator of the live span events, exposed as Prometheus metrics"""
+
+import bisect
+import collections
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from qstone.profiling.occupancy import SERVICE_LABEL
+from qstone.utils.metrics import parse_address
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# Window over which the throughput is computed, in seconds
+RATE_WINDOW = 60.0
+# Time after which a span whose end was not received is no longer in flight, in
+# seconds: its job was killed, or its end event dropped
+IN_FLIGHT_TTL = 3600.0
+NS_TO_S = 1e9
+MAX_DATAGRAM = 65536
+# Period at which the receiving thread checks whether the server is stopped
+RECEIVE_TIMEOUT = 0.2
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(**labels: str) -> str:
+    """Prometheus label set, values escaped"""
+    if not labels:
+        return ""
+    escaped = (
+        str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for v in labels.values()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class _Histogram:
+    """Cumulative histogram in the Prometheus layout"""
+
+    def __init__(self):
+        self.buckets = [0.0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0.0
+
+    def observe(self, value: float, weight: float = 1.0):
+        """Adds a value observed weight times"""
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += weight
+        self.sum += value * weight
+        self.count += weight
+
+    def lines(self, name: str, **labels: str) -> list[str]:
+        """Bucket, sum and count samples of the histogram"""
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.buckets):
+            cumulative += count
+            lines.append(
+                f"{name}_bucket{_labels(**labels, le=str(bound))} {cumulative:g}"
+            )
+        lines.append(f"{name}_sum{_labels(**labels)} {self.sum:g}")
+        lines.append(f"{name}_count{_labels(**labels)} {self.count:g}")
+        return lines
+
+
+class MetricsAggregator:
+    """
+    Live counters of the spans pushed by the traced jobs of a node.
+
+    A circuit is a connector request, i.e. an unlabelled CONNECTION RUN span, and
+    the part of it holding the QPU is traced with the `_request_and_process`
+    label: the lock wait is the time from the request to that span. A job is
+    done when its top-level POST step ends. Sampled spans count for the calls
+    they stand for.
+
+    Args:
+        window: period over which the throughput is computed, in seconds
+        in_flight_ttl: time after which a span not ended is dropped, in seconds
+    """
+
+    def __init__(
+        self, window: float = RATE_WINDOW, in_flight_ttl: float = IN_FLIGHT_TTL
+    ):
+        self._window = window
+        self._in_flight_ttl = in_flight_ttl
+        self._lock = threading.Lock()
+        self._spans: dict[tuple[str, str], float] = collections.defaultdict(float)
+        # Started spans with their time of reception, oldest first
+        self._in_flight: dict[tuple, tuple[float, dict]] = {}
+        self._jobs = 0.0
+        self._circuits: dict[str, float] = collections.defaultdict(float)
+        self._completions: dict[str, collections.deque] = {
+            "jobs": collections.deque(),
+            "circuits": collections.deque(),
+        }
+        self._lock_wait = _Histogram()
+        self._latency: dict[str, _Histogram] = collections.defaultdict(_Histogram)
+
+    @staticmethod
+    def _is_circuit(event: dict) -> bool:
+        return (
+            event["job_type"] == "CONNECTION"
+            and event["job_step"] == "RUN"
+            and not event.get("label")
+        )
+
+    def _completed(self, kind: str, weight: float, now: float):
+        completions = self._completions[kind]
+        completions.append((now, weight))
+        while completions and completions[0][0] < now - self._window:
+            completions.popleft()
+
+    def _expire(self, now: float):
+        """Drops the spans started longer than the TTL ago"""
+        while self._in_flight:
+            key, (received, _) = next(iter(self._in_flight.items()))
+            if received >= now - self._in_flight_ttl:
+                return
+            del self._in_flight[key]
+
+    def handle(self, event: dict, now: Optional[float] = None):
+        """Accounts for a span event pushed by a job
+
+        Args:
+            event: start or end of a span
+            now: time of reception, in seconds of the monotonic clock
+        """
+        now = time.monotonic() if now is None else now
+        key = (event["host"], event["pid"], event["span_id"])
+        with self._lock:
+            self._expire(now)
+            if event["event"] == "start":
+                # Reinserted so that the spans stay ordered by reception
+                self._in_flight.pop(key, None)
+                self._in_flight[key] = (now, event)
+                request = self._in_flight.get(
+                    (event["host"], event["pid"], event["parent_id"])
+                )
+                if event.get("label") == SERVICE_LABEL and request is not None:
+                    wait = (event["start"] - request[1]["start"]) / NS_TO_S
+                    self._lock_wait.observe(max(wait, 0.0))
+                return
+            self._in_flight.pop(key, None)
+            weight = float(event.get("weight") or 1.0)
+            self._spans[(event["job_type"], event["job_step"])] += weight
+            if self._is_circuit(event):
+                connector = event.get("connector") or "UNKNOWN"
+                self._circuits[connector] += weight
+                self._latency[connector].observe(
+                    (event["end"] - event["start"]) / NS_TO_S, weight
+                )
+                self._completed("circuits", weight, now)
+            elif (
+                event["job_type"] != "CONNECTION"
+                and event["job_step"] == "POST"
+                and not event.get("parent_id")
+            ):
+                self._jobs += weight
+                self._completed("jobs", weight, now)
+
+    def _rate(self, kind: str, now: float) -> float:
+        recent = [w for t, w in self._completions[kind] if t >= now - self._window]
+        return sum(recent) / self._window
+
+    def render(self, now: Optional[float] = None) -> str:
+        """Returns the metrics in the Prometheus text exposition format"""
+        now = time.monotonic() if now is None else now
+        lines: list[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list[str]):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+            lines.extend(samples)
+
+        with self._lock:
+            self._expire(now)
+            started = [e for _, e in self._in_flight.values()]
+            in_flight = collections.Counter(
+                (e["job_type"], e["job_step"]) for e in started
+            )
+            circuits_in_flight = sum(1 for e in started if self._is_circuit(e))
+            metric(
+                "qstone_spans_total",
+                "counter",
+                "Traced calls completed",
+                [
+                    f"qstone_spans_total{_labels(job_type=t, job_step=s)} {v:g}"
+                    for (t, s), v in sorted(self._spans.items())
+                ],
+            )
+            metric(
+                "qstone_spans_in_flight",
+                "gauge",
+                "Traced calls in progress",
+                [
+                    f"qstone_spans_in_flight{_labels(job_type=t, job_step=s)} {v}"
+                    for (t, s), v in sorted(in_flight.items())
+                ],
+            )
+            metric(
+                "qstone_jobs_total",
+                "counter",
+                "Jobs completed",
+                [f"qstone_jobs_total {self._jobs:g}"],
+            )
+            metric(
+                "qstone_jobs_per_second",
+                "gauge",
+                f"Jobs completed per second over the last {self._window:g}s",
+                [f"qstone_jobs_per_second {self._rate('jobs', now):g}"],
+            )
+            metric(
+                "qstone_circuits_total",
+                "counter",
+                "Circuits run through the connector",
+                [
+                    f"qstone_circuits_total{_labels(connector=c)} {v:g}"
+                    for c, v in sorted(self._circuits.items())
+                ],
+            )
+            metric(
+                "qstone_circuits_per_second",
+                "gauge",
+                f"Circuits run per second over the last {self._window:g}s",
+                [f"qstone_circuits_per_second {self._rate('circuits', now):g}"],
+            )
+            metric(
+                "qstone_circuits_in_flight",
+                "gauge",
+                "Circuits submitted to the connector and not returned yet",
+                [f"qstone_circuits_in_flight {circuits_in_flight}"],
+            )
+            metric(
+                "qstone_lock_wait_seconds",
+                "histogram",
+                "Time from the connector request to holding the QPU",
+                self._lock_wait.lines("qstone_lock_wait_seconds"),
+            )
+            metric(
+                "qstone_connector_latency_seconds",
+                "histogram",
+                "Latency of the circuits run through the connector",
+                [
+                    line
+                    for c, histogram in sorted(self._latency.items())
+                    for line in histogram.lines(
+                        "qstone_connector_latency_seconds", connector=c
+                    )
+                ],
+            )
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Receives the span events pushed by the jobs of the node on a datagram socket
+    and serves the aggregated metrics over HTTP on localhost, e.g. for
+    `curl http://localhost:<port>/metrics` or a local Prometheus scraper.
+
+    Args:
+        listen: Unix socket path, `host:port` or port the jobs push to, as set in
+            `trace_metrics`
+        port: HTTP port of the metrics, a free port is picked for 0
+        host: interface of the HTTP server
+    """
+
+    def __init__(self, listen: str, port: int = 0, host: str = "127.0.0.1"):
+        self.aggregator = MetricsAggregator()
+        family, address = parse_address(listen)
+        self._listen = listen if family == socket.AF_UNIX else None
+        if self._listen and os.path.exists(self._listen):
+            os.unlink(self._listen)
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+        self._socket.settimeout(RECEIVE_TIMEOUT)
+        self._stopped = threading.Event()
+        aggregator = self.aggregator
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serves the metrics page"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Returns the metrics"""
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = aggregator.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self._http = ThreadingHTTPServer((host, port), Handler)
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def port(self) -> int:
+        """Returns the HTTP port of the metrics"""
+        return self._http.server_address[1]
+
+    def _receive(self):
+        while not self._stopped.is_set():
+            try:
+                data = self._socket.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            try:
+                self.aggregator.handle(json.loads(data))
+            except (ValueError, KeyError, TypeError):
+                logging.warning("Ignoring malformed metrics event")
+
+    def start(self) -> "MetricsServer":
+        """Starts receiving the events and serving the metrics in the background"""
+        self._threads = [
+            threading.Thread(target=self._receive, daemon=True),
+            threading.Thread(target=self._http.serve_forever, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        """Stops the server"""
+        self._stopped.set()
+        self._http.shutdown()
+        self._http.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._socket.close()
+        if self._listen and os.path.exists(self._listen):
+            os.unlink(self._listen)
+
+    def __enter__(self) -> "MetricsServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def serve(listen: str, port: int, host: str = "127.0.0.1"):
+    """Runs the metrics aggregator until interrupted
+
+    Args:
+        listen: Unix socket path, `host:port` or port the jobs push to
+        port: HTTP port of the metrics
+        host: interface of the HTTP server
+    """
+    with MetricsServer(listen, port, host) as server:
+        logging.info(
+            "Receiving span events on %s, metrics on http://%s:%d/metrics",
+            listen,
+            host,
+            server.port,
+        )
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
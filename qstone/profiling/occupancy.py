@@ -0,0 +1,185 @@
+"""QPU occupancy and contention analysis of the connector traces"""
+
+import numpy
+import pandas as pd
+
+# Label of the connector spans holding the QPU
+SERVICE_LABEL = "_request_and_process"
+UNKNOWN_MODE = "UNKNOWN"
+OCCUPANCY_COLUMNS = [
+    "requests",
+    "window",
+    "busy",
+    "utilisation",
+    "idle_gaps",
+    "idle_total",
+    "idle_max",
+    "depth_max",
+    "depth_mean",
+    "lock_wait_total",
+    "lock_wait_mean",
+    "arrival_rate",
+    "service_rate",
+    "offered_load",
+    "littles_l",
+    "littles_lq",
+]
+
+
+def _connector_spans(stats: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits the connector traces into QPU requests and QPU services.
+
+    A request is an unlabelled CONNECTION RUN span, from the call to the connector
+    to its return. The service is the part of it holding the QPU, traced with the
+    `_request_and_process` label. Connectors without such a label (e.g. NO_LINK)
+    are served for the whole request. Global times are used when available.
+    """
+    connection = stats[stats["job_type"] == "CONNECTION"]
+    if "global_start" in connection:
+        # Spans of different hosts are only comparable on the global timeline
+        connection = connection.assign(
+            start=connection["global_start"], end=connection["global_end"]
+        )
+    label = (
+        connection["label"]
+        if "label" in connection
+        else pd.Series(None, index=connection.index, dtype=object)
+    )
+    requests = connection[(connection["job_step"] == "RUN") & label.isna()]
+    services = connection[label == SERVICE_LABEL]
+    if services.empty:
+        services = requests
+    elif requests.empty:
+        requests = services
+    return requests, services
+
+
+def _union(start: numpy.ndarray, end: numpy.ndarray) -> tuple[numpy.ndarray, ...]:
+    """Merges overlapping intervals, returns the sorted disjoint intervals"""
+    order = numpy.argsort(start, kind="stable")
+    start, end = start[order], end[order]
+    reach = numpy.maximum.accumulate(end)
+    # A new busy period starts when nothing running reaches the next start
+    first = numpy.ones(len(start), dtype=bool)
+    first[1:] = start[1:] > reach[:-1]
+    last = numpy.roll(first, -1)
+    last[-1] = True
+    return start[first], reach[last]
+
+
+def timeline(spans: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds the occupancy timeline of a set of spans.
+
+    Args:
+        spans: traces with start and end times
+
+    Returns one row per change of the number of spans in progress, with the time
+    of the change, the new depth and how long it lasts
+    """
+    times = numpy.concatenate([spans["start"].to_numpy(), spans["end"].to_numpy()])
+    deltas = numpy.repeat([1, -1], len(spans))
+    # Ends are applied before starts at the same time: back to back spans do not
+    # overlap
+    order = numpy.lexsort((deltas, times))
+    times, depth = times[order], numpy.cumsum(deltas[order])
+    keep = numpy.ones(len(times), dtype=bool)
+    keep[:-1] = times[1:] != times[:-1]
+    times, depth = times[keep], depth[keep]
+    duration = numpy.diff(times, append=times[-1:] if len(times) else times)
+    return pd.DataFrame({"time": times, "depth": depth, "duration": duration})
+
+
+def lock_waits(requests: pd.DataFrame, services: pd.DataFrame) -> pd.Series:
+    """
+    Time each request spent before being served, i.e. waiting on the QPU lock.
+
+    Args:
+        requests: CONNECTION RUN spans
+        services: spans holding the QPU, nested in the requests of the same job
+
+    Returns the wait of each request, indexed as the requests
+    """
+    keys = ["user", "prog_id", "job_id"]
+    outer = requests[keys + ["start", "end"]].reset_index(names="request")
+    inner = services[keys + ["start", "end"]]
+    pairs = outer.merge(inner, on=keys, suffixes=("", "_service"))
+    pairs = pairs[
+        (pairs["start_service"] >= pairs["start"])
+        & (pairs["end_service"] <= pairs["end"])
+    ]
+    served = pairs.groupby("request")["start_service"].min()
+    # Requests never served waited for their whole duration
+    waits = (requests["end"] - requests["start"]).rename("wait")
+    waits.loc[served.index] = served - requests.loc[served.index, "start"]
+    return waits
+
+
+def _analyse(stats: pd.DataFrame) -> dict:
+    """Occupancy metrics of the traces of one scheduling mode"""
+    requests, services = _connector_spans(stats)
+    if services.empty:
+        return {}
+    start, end = services["start"].to_numpy(), services["end"].to_numpy()
+    window = int(requests["end"].max() - requests["start"].min())
+    busy_start, busy_end = _union(start, end)
+    busy = int((busy_end - busy_start).sum())
+    gaps = busy_start[1:] - busy_end[:-1]
+    demand = timeline(requests)
+    waits = lock_waits(requests, services)
+    service_time = float((end - start).mean())
+    residence = float((requests["end"] - requests["start"]).mean())
+    arrival_rate = len(requests) / window if window else float("nan")
+    return {
+        "requests": len(requests),
+        "window": window,
+        "busy": busy,
+        "utilisation": busy / window if window else float("nan"),
+        "idle_gaps": len(gaps),
+        "idle_total": int(gaps.sum()),
+        "idle_max": int(gaps.max()) if len(gaps) else 0,
+        "depth_max": int(demand["depth"].max()),
+        "depth_mean": (
+            float((demand["depth"] * demand["duration"]).sum()) / window
+            if window
+            else float("nan")
+        ),
+        "lock_wait_total": int(waits.sum()),
+        "lock_wait_mean": float(waits.mean()),
+        "arrival_rate": arrival_rate,
+        "service_rate": 1 / service_time if service_time else float("nan"),
+        "offered_load": arrival_rate * service_time,
+        # Little's law: mean number of requests in the system and waiting on the lock
+        "littles_l": arrival_rate * residence,
+        "littles_lq": arrival_rate * float(waits.mean()),
+    }
+
+
+def occupancy(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reports how busy the QPU was, per scheduling mode: utilisation, idle gaps,
+    depth of the concurrent demand, time lost waiting on the QPU lock, and the
+    arrival and service rates of the QPU requests.
+
+    Rates are per ns, durations in ns. An offered load above 1 means requests
+    arrive faster than the QPU serves them.
+
+    Args:
+        stats: profiled traces, with optional `scheduling_mode` and `run` columns
+
+    Returns one row per scheduling mode, and run when the traces come from the
+    profile store since the runs do not share a time origin
+    """
+    stats = stats.assign(
+        scheduling_mode=(
+            stats["scheduling_mode"].fillna(UNKNOWN_MODE)
+            if "scheduling_mode" in stats
+            else UNKNOWN_MODE
+        )
+    )
+    keys = ["scheduling_mode"] + (["run"] if "run" in stats else [])
+    rows = {key: _analyse(df) for key, df in stats.groupby(keys, sort=True)}
+    rows = {key: row for key, row in rows.items() if row}
+    table = pd.DataFrame(list(rows.values()), columns=OCCUPANCY_COLUMNS)
+    table.index = pd.MultiIndex.from_tuples(list(rows), names=keys)
+    return table
@@ -1,13 +1,31 @@
 """Profile utilities"""
 
 import argparse
+import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
+import numpy
 import pandas as pd
 import pandera as pa
 
-from qstone.utils.utils import ComputationStep, load_json_profile, parse_json
+from qstone.profiling.chrome import ChromeTraceWriter, frame_names
+from qstone.profiling.occupancy import occupancy
+from qstone.profiling.sketch import build_sketches, histogram_table, percentiles_table
+from qstone.profiling.store import Filters, ProfileStore, new_run_id
+from qstone.utils.tracing import (
+    JOB_SETTINGS,
+    RECORDS_EXT,
+    RESOURCE_FIELDS,
+    TRACE_EXT,
+    read_records,
+)
+from qstone.utils.utils import ComputationStep, parse_json
+
+TRACE_FILES = (".json", TRACE_EXT, RECORDS_EXT)
+JSON_BATCH_SIZE = 1000
 
 PROFILER_SCHEMA = pa.DataFrameSchema(
     {
@@ -21,89 +39,824 @@ PROFILER_SCHEMA = pa.DataFrameSchema(
         "start": pa.Column(int),
         "success": pa.Column(bool),
         "end": pa.Column(int),
+        "host": pa.Column(str, nullable=True, required=False),
+        "pid": pa.Column(int, required=False),
+        "clock_offset": pa.Column(int, required=False),
+        "global_start": pa.Column(int, required=False),
+        "global_end": pa.Column(int, required=False),
+        "span_id": pa.Column(int, required=False),
+        "parent_id": pa.Column(int, required=False),
+        "weight": pa.Column(float, required=False),
+        **{
+            name: pa.Column(float, nullable=True, required=False)
+            for name in RESOURCE_FIELDS + JOB_SETTINGS
+        },
     }
 )
 
 
+def _records_to_frame(records: numpy.ndarray) -> pd.DataFrame:
+    """Converts fixed-layout trace records into a dataframe"""
+    columns = {}
+    for name in records.dtype.names or ():
+        if records.dtype[name].kind == "S":
+            # Strings are highly repetitive: only the distinct values are decoded.
+            codes, uniques = pd.factorize(records[name])
+            decoded = [u.decode("utf-8", "ignore") for u in uniques]
+            columns[name] = numpy.array(decoded, dtype=object)[codes]
+        else:
+            columns[name] = numpy.asarray(records[name])
+    df = pd.DataFrame(columns)
+    for name in ("label", "host"):
+        if name in df:
+            df[name] = df[name].replace("", None)
+    return df
+
+
+def _read_jsonl_from(path: str, offset: int) -> tuple[list[dict], int]:
+    """Reads the complete jsonl records written after offset (in bytes)"""
+    with open(path, "rb") as fid:
+        fid.seek(offset)
+        data = fid.read()
+    # A trailing partial line is left for the next ingestion
+    end = data.rfind(b"\n") + 1
+    rows = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return rows, offset + end
+
+
+def _read_batch(
+    tasks: list[tuple[str, int]],
+) -> tuple[Optional[pd.DataFrame], list[tuple[str, int]]]:
+    """
+    Reads a batch of trace files, each from the position already ingested.
+    Textual traces are parsed into a single list of records and binary traces are
+    memory-mapped, so that the dataframe is built in one pass.
+
+    Returns the dataframe of the new entries and the position reached in each file
+    (bytes for jsonl, records for binary traces).
+    """
+    rows: list[dict] = []
+    frames = []
+    offsets = []
+    for path, offset in tasks:
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                rows.append(json.load(f))
+            offset = 1
+        elif path.endswith(TRACE_EXT):
+            new_rows, offset = _read_jsonl_from(path, offset)
+            rows.extend(new_rows)
+        elif path.endswith(RECORDS_EXT):
+            records = read_records(path)
+            frames.append(_records_to_frame(records[offset:]))
+            offset = len(records)
+        offsets.append((path, offset))
+    if rows:
+        frames.append(pd.DataFrame.from_records(rows))
+    df = pd.concat(frames, ignore_index=True, sort=False) if frames else None
+    return df, offsets
+
+
+def _list_traces(folder: str) -> list[str]:
+    """Lists the trace files of a folder"""
+    return [
+        os.path.abspath(os.path.join(folder, f))
+        for f in sorted(os.listdir(folder))
+        if f.endswith(TRACE_FILES)
+    ]
+
+
+def _read_dir(folder: str) -> pd.DataFrame:
+    """
+    Reads all the traces of a folder.
+    """
+    df, _ = _read_batch([(path, 0) for path in _list_traces(folder)])
+    if df is None:
+        raise ValueError(f"No traces found in {folder}")
+    logging.info("Folder: %s - found %d entries", folder, df.shape[0])
+    return df
+
+
 def _get_stats_from_dir(folder, schema):
     """
     Get the statistics from a folder applying the schema provided.
     """
-    df = None
-    for func_profile in os.listdir(folder):
-        if func_profile.endswith(".json"):
-            data = load_json_profile(os.path.join(folder, func_profile), schema)
-            df = pd.concat([data, df], sort=False)
-    logging.info("Folder: %s - found %d entries", folder, df.shape[0])
+    df = _align_clocks(_read_dir(folder))
+    schema.validate(df)
     return df
 
 
-def _extrapolate(stats):
+class Manifest:
     """
-    extrapolate provides an example of capabilities of Pandas.
+    Trace files already ingested by the profiler, keyed by path with their size,
+    modification time and the position reached when they were last read.
+    Trace files are append-only, so a file that grew is read from that position.
+    The run each folder is stored in is kept as well, so that the traces of a
+    growing folder all belong to the same run.
+
+    Args:
+        path: location of the manifest. Nothing is persisted if None.
+        load: load the content of an existing manifest
+    """
+
+    def __init__(self, path: Optional[str], load: bool = True):
+        self._path = path
+        self._files: dict[str, dict] = {}
+        self._runs: dict[str, str] = {}
+        if load and path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fid:
+                content = json.load(fid)
+            # Manifests written before the runs were kept only list the files
+            self._files = content.get("files", content)
+            self._runs = content.get("runs", {})
+        self._pending: dict[str, dict] = {}
+
+    def runs(
+        self, folders: list[str], run: Optional[str] = None
+    ) -> dict[str, list[str]]:
+        """Groups the folders by the run their traces are stored in: the given
+        run, else the run of a previous ingestion of the folder, else a new run
+        shared by the folders never ingested"""
+        new_run = run or new_run_id()
+        groups: dict[str, list[str]] = {}
+        for folder in dict.fromkeys(os.path.abspath(f) for f in folders):
+            self._runs[folder] = run or self._runs.get(folder, new_run)
+            groups.setdefault(self._runs[folder], []).append(folder)
+        return groups
+
+    def pending(self, folder: str) -> list[tuple[str, int]]:
+        """Returns the files of the folder with traces not ingested yet, and the
+        position from which they should be read"""
+        tasks = []
+        for path in _list_traces(folder):
+            st = os.stat(path)
+            entry = self._files.get(path)
+            if entry and [entry["size"], entry["mtime"]] == [
+                st.st_size,
+                st.st_mtime_ns,
+            ]:
+                continue
+            # A file that shrank has been replaced and is read again in full
+            offset = entry["offset"] if entry and st.st_size >= entry["size"] else 0
+            self._pending[path] = {"size": st.st_size, "mtime": st.st_mtime_ns}
+            tasks.append((path, offset))
+        return tasks
+
+    def update(self, offsets: list[tuple[str, int]]):
+        """Marks the files as ingested up to the given positions"""
+        for path, offset in offsets:
+            self._files[path] = {**self._pending.pop(path), "offset": offset}
+
+    def save(self):
+        """Persists the manifest, atomically replacing the previous one"""
+        if not self._path:
+            return
+        tmp = f"{self._path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fid:
+            json.dump({"files": self._files, "runs": self._runs}, fid)
+        os.replace(tmp, self._path)
+
+
+def _batches(tasks: list[tuple[str, int]]) -> list[list[tuple[str, int]]]:
+    """Groups the legacy per-call json traces, per-process traces are read alone"""
+    single = [t for t in tasks if t[0].endswith(".json")]
+    batches = [[t] for t in tasks if not t[0].endswith(".json")]
+    batches += [
+        single[i : i + JSON_BATCH_SIZE] for i in range(0, len(single), JSON_BATCH_SIZE)
+    ]
+    return batches
+
+
+def _ingest(
+    folders: list[str], manifest: Manifest, workers: Optional[int] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Reads the traces of all the folders not yet in the manifest, in parallel over
+    a pool of processes.
+
+    Returns the dataframe of the new entries, None if there are none.
+    """
+    folders = list(dict.fromkeys(os.path.abspath(f) for f in folders))
+    batches = _batches([t for f in folders for t in manifest.pending(f)])
+    if workers == 1 or len(batches) <= 1:
+        results = [_read_batch(b) for b in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_read_batch, batches))
+    frames = []
+    for df, offsets in results:
+        manifest.update(offsets)
+        if df is not None:
+            frames.append(df)
+    if not frames:
+        return None
+    stats = pd.concat(frames, ignore_index=True, sort=False)
+    logging.info(
+        "Ingested %d new entries from %d files",
+        stats.shape[0],
+        sum(len(b) for b in batches),
+    )
+    return stats
+
+
+STEPS = ["PRE", "RUN", "POST"]
+JOB_KEYS = ["user", "prog_id", "job_id"]
+
+
+# Default of the fields missing from older traces
+PROCESS_DEFAULTS = {"pid": -1, "clock_offset": 0, "span_id": 0, "parent_id": 0}
+# Spans are identified by their id within a process
+SPAN_KEYS = ["host", "pid", "span_id"]
+
+
+def _weights(stats: pd.DataFrame) -> pd.Series:
+    """Number of calls accounted for by each trace, above 1 for sampled labels"""
+    if "weight" not in stats:
+        return pd.Series(1.0, index=stats.index)
+    return stats["weight"].fillna(1.0).astype("float64")
+
+
+def _fill_process_info(stats: pd.DataFrame) -> pd.DataFrame:
+    """Sets the process, span and sampling fields of traces written without them.
+    Resource usage not captured and job settings not known are set to NaN."""
+    for name, default in PROCESS_DEFAULTS.items():
+        column = stats[name] if name in stats else pd.Series(default, index=stats.index)
+        stats[name] = column.fillna(default).astype("int64")
+    if "host" not in stats:
+        stats["host"] = None
+    stats["weight"] = _weights(stats)
+    for name in RESOURCE_FIELDS + JOB_SETTINGS:
+        if name in stats:
+            column = stats[name].astype("float64")
+            stats[name] = column.where(column >= 0)
+    return stats
+
+
+def _align_clocks(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Places the spans of all the processes and hosts on one timeline.
+
+    Start and end are read from the performance counter of each process, which is
+    only meaningful within the process. The global times add the offset of that
+    counter to the epoch, captured by the process when it started. Traces written
+    before the offset was recorded keep their own times.
+    """
+    _fill_process_info(stats)
+    stats["global_start"] = stats["start"] + stats["clock_offset"]
+    stats["global_end"] = stats["end"] + stats["clock_offset"]
+    return stats
+
+
+def global_timeline(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Orders the spans of all the hosts on one timeline.
+
+    Args:
+        stats: profiled traces with their global times
+
+    Returns the spans sorted by global start, with their start relative to the
+    first span and their duration, in ns
+    """
+    columns = ["host", "pid", "user", "prog_id", "job_id", "job_type", "job_step"]
+    spans = stats.sort_values(["global_start", "global_end"], kind="stable")
+    spans = spans[[c for c in columns + ["label"] if c in spans]].copy()
+    ordered = stats.loc[spans.index]
+    spans["offset"] = ordered["global_start"] - ordered["global_start"].min()
+    spans["duration"] = ordered["global_end"] - ordered["global_start"]
+    return spans.reset_index(drop=True)
+
+
+def _span_index(stats: pd.DataFrame, key: str = "span_id") -> pd.MultiIndex:
+    """Index of the spans (or of their parents), by host, pid and id"""
+    return pd.MultiIndex.from_arrays(
+        [stats["host"].fillna(""), stats["pid"], stats[key]], names=SPAN_KEYS
+    )
+
+
+def _exclusive(stats: pd.DataFrame, total: Optional[pd.Series] = None) -> pd.Series:
+    """
+    Time spent in each span outside of the traced calls nested in it, or the part
+    of any other quantity measured over the whole span (e.g. its CPU time).
+
+    Nested calls are matched to their parent by host, pid and span id. Traces
+    written without span ids have no children, their exclusive time is their
+    duration. Sampled children account for the calls that were not traced.
+    """
+    if total is None:
+        total = stats["end"] - stats["start"]
+    if "span_id" not in stats:
+        return total
+    nested = stats["parent_id"] > 0
+    weighted = (total.fillna(0) * _weights(stats))[nested]
+    children = weighted.groupby(_span_index(stats[nested], "parent_id")).sum()
+    child_time = children.reindex(_span_index(stats), fill_value=0).to_numpy()
+    # Children running concurrently, e.g. in threads, may outlast their parent
+    child_time = numpy.where(stats["span_id"] > 0, child_time, 0)
+    return (total - child_time).clip(lower=0)
+
+
+def _durations(stats):
+    """
+    Adds the total (inclusive) durations of the traces.
     """
-    # Adding an entry that defines the total duration
     stats["total"] = stats["end"] - stats["start"]
-    # Aggregating micro-jobs with that belong to the same ID
-    for pid in list(set(stats["prog_id"])):
-        # Filtering per id
-        mask = stats.prog_id == pid
-        jobs = stats[stats.prog_id == pid]
-        # We are aggregating all the steps associated with the same job
-        for s in ["PRE", "RUN", "POST"]:
-            stats.loc[mask, f"{s}_agg"] = jobs[jobs.job_step == s]["total"].sum()
-    stats["count"] = len(stats[stats["success"]].groupby(["job_id", "user"]).groups)
-    stats["connection_total"] = stats.query('job_type == "CONNECTION"')["total"].sum()
     return stats
 
 
-def _store(stats, pickle):
-    if os.path.exists(pickle):
-        df = pd.concat([stats, pd.read_pickle(pickle)])
-        df.to_pickle(pickle)
-    else:
-        stats.to_pickle(pickle)
+def _aggregate_steps(stats):
+    """
+    Adds the exclusive durations of the traces and the exclusive time of each
+    step summed over the program of the traces. Both depend on the other traces
+    loaded: programs are told apart per run when the traces of several runs are
+    loaded, and nested calls are only subtracted from their parent when loaded
+    along with it.
+    """
+    stats["exclusive"] = _exclusive(stats)
+    keys = [stats[k] for k in ("run", "prog_id") if k in stats]
+    # Exclusive times are summed so that nested calls are not counted twice, and
+    # scaled by the sampling weights to account for the calls not traced.
+    weighted = stats["exclusive"] * _weights(stats)
+    # Aggregating micro-jobs with that belong to the same ID, all steps in one pass.
+    per_prog = (
+        pd.DataFrame({s: weighted.where(stats["job_step"] == s, 0) for s in STEPS})
+        .groupby(keys, sort=False)
+        .transform("sum")
+    )
+    for s in STEPS:
+        stats[f"{s}_agg"] = per_prog[s].round().astype("int64")
+    return stats
+
+
+def _extrapolate(stats):
+    """
+    extrapolate provides an example of capabilities of Pandas.
+    """
+    return _aggregate_steps(_durations(stats))
+
+
+def _summary(jobs: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    """Aggregates the per-job summary over the keys"""
+    summary = jobs.groupby(keys, sort=True).agg(
+        jobs=("success", "size"),
+        successful=("success", "sum"),
+        **{s: (s, "sum") for s in STEPS + ["CONNECTION", "classical"]},
+    )
+    for col in ["classical", "RUN", "CONNECTION"]:
+        summary[f"{col}_mean"] = summary[col] / summary["jobs"]
+    return summary
+
+
+def summarise(stats: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Builds summary tables of the profiled traces, durations in ns.
+
+    Args:
+        stats: profiled traces
+
+    Returns a dictionary with the tables:
+        - job: PRE/RUN/POST and connection totals of each job
+        - user: totals and means per user
+        - job_type: totals and means per job type
+    """
+    # Nested calls are only accounted for once, sampled calls scaled up
+    total = _exclusive(stats) * _weights(stats)
+    app = stats["job_type"] != "CONNECTION"
+    # One column per quantity so that all of them are summed in a single groupby
+    parts = pd.DataFrame(
+        {
+            **{k: stats[k] for k in JOB_KEYS},
+            "job_type": stats["job_type"].where(app),
+            **{s: total.where(app & (stats["job_step"] == s), 0) for s in STEPS},
+            "CONNECTION": total.where(~app, 0),
+            "success": stats["success"].astype(bool),
+        }
+    )
+    jobs = parts.groupby(JOB_KEYS, sort=True).agg(
+        job_type=("job_type", "first"),
+        success=("success", "all"),
+        **{s: (s, "sum") for s in STEPS + ["CONNECTION"]},
+    )
+    jobs["classical"] = jobs["PRE"] + jobs["POST"]
+    flat = jobs.reset_index()
+    return {
+        "job": jobs,
+        "user": _summary(flat, ["user"]),
+        "job_type": _summary(flat, ["job_type"]),
+    }
+
+
+def flame(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds per-job flame summaries: the traced call stacks of each job with their
+    number of calls, inclusive and exclusive times in ns, scaled up for sampled
+    calls.
+
+    Stacks are written as the names of the nested calls separated by `;`, outermost
+    first, as in the folded format of flame graph tools.
+
+    Args:
+        stats: profiled traces
+
+    Returns one row per job and call stack
+    """
+    stats = _fill_process_info(stats.reset_index(drop=True))
+    names = frame_names(stats)
+    spans = _span_index(stats)
+    # Traces without span id, or of a recycled pid, cannot be told apart
+    known = (stats["span_id"] > 0).to_numpy() & ~spans.duplicated(keep=False)
+    position = pd.Series(numpy.flatnonzero(known), index=spans[known])
+    parents = position.reindex(_span_index(stats, "parent_id"), fill_value=-1)
+    parents = numpy.where(stats["parent_id"] > 0, parents.to_numpy(), -1)
+    stacks = names.copy()
+    # Walking up one level of the call tree of all the spans at a time
+    current = parents
+    while (current >= 0).any():
+        up = current >= 0
+        stacks[up] = names[current[up]] + ";" + stacks[up]
+        current = numpy.where(up, parents[current], -1)
+    table = pd.DataFrame(
+        {
+            **{k: stats[k] for k in JOB_KEYS},
+            "stack": stacks,
+            "calls": stats["weight"],
+            "inclusive": (stats["end"] - stats["start"]) * stats["weight"],
+            "exclusive": _exclusive(stats) * stats["weight"],
+        }
+    )
+    return (
+        table.groupby(JOB_KEYS + ["stack"], sort=True)
+        .agg(
+            calls=("calls", "sum"),
+            inclusive=("inclusive", "sum"),
+            exclusive=("exclusive", "sum"),
+        )
+        .reset_index()
+    )
+
+
+# Resources used over the whole span, of which the nested calls are subtracted
+RESOURCE_DELTAS = [name for name in RESOURCE_FIELDS if name != "max_rss"]
+EFFICIENCY_COLUMNS = ["spans", "wall", "cpu", "efficiency"] + RESOURCE_FIELDS
+
+
+def efficiency(
+    stats: pd.DataFrame, keys: tuple[str, ...] = ("job_type", "job_step")
+) -> pd.DataFrame:
+    """
+    Reports the resource usage of the calls traced with `trace_resources`: CPU
+    time, context switches, bytes read and written, peak RSS, and the CPU
+    efficiency (cpu / wall). An efficiency well below 1 points at a call waiting
+    on I/O or descheduled by other processes, above 1 at a multi-threaded one.
+
+    Usage is exclusive of the nested calls and scaled up for sampled calls, times
+    in ns and sizes in bytes. The peak RSS is the largest of the process.
+
+    Args:
+        stats: profiled traces
+        keys: columns the usage is aggregated over
+
+    Returns one row per value of the keys, empty if no usage was captured
+    """
+    if "cpu_user" not in stats:
+        return pd.DataFrame(columns=EFFICIENCY_COLUMNS)
+    stats = _fill_process_info(stats.reset_index(drop=True))
+    weights = _weights(stats)
+    parts = pd.DataFrame(
+        {
+            **{k: stats[k] for k in keys},
+            "spans": weights,
+            "wall": _exclusive(stats) * weights,
+            **{
+                name: _exclusive(stats, stats[name]) * weights
+                for name in RESOURCE_DELTAS
+            },
+            "max_rss": stats["max_rss"],
+        }
+    )[stats["cpu_user"].notna()]
+    table = parts.groupby(list(keys), sort=True).agg(
+        spans=("spans", "sum"),
+        wall=("wall", "sum"),
+        **{name: (name, "sum") for name in RESOURCE_DELTAS},
+        max_rss=("max_rss", "max"),
+    )
+    table["cpu"] = table["cpu_user"] + table["cpu_system"]
+    table["efficiency"] = table["cpu"] / table["wall"].where(table["wall"] > 0)
+    return table[EFFICIENCY_COLUMNS]
 
 
 NS_TO_MS = 1_000_000
+BYTES_TO_MB = 1 << 20
 
 
 def _print_stats(stats: pd.DataFrame):
     """
     Print general statistics
     """
-    tot_classical = (stats["PRE_agg"].iloc[0] + stats["POST_agg"].iloc[0]) / NS_TO_MS
-    tot_quantum = stats["RUN_agg"].iloc[0] / NS_TO_MS
-    connection_total = stats["connection_total"].iloc[0] / NS_TO_MS
-    tot_runs = stats["count"].iloc[0]
-    print("########### Stats ######################")
+    summaries = summarise(stats)
+    jobs = summaries["job"]
+    tot_classical = jobs["classical"].sum() / NS_TO_MS
+    tot_quantum = jobs["RUN"].sum() / NS_TO_MS
+    connection_total = jobs["CONNECTION"].sum() / NS_TO_MS
+    tot_runs = max(int(jobs["success"].sum()), 1)
+    print("########### Stats ######################")
     print(f"Total classical computation   [ms]:  {tot_classical:>12.2f}")
     print(f"Total quantum computation     [ms]:  {tot_quantum:>12.2f}")
     print(f"Average classical computation [ms]:  {tot_classical/tot_runs:>12.2f}")
     print(f"Average quantum computation   [ms]:  {tot_quantum/tot_runs:>12.2f}")
     print(f"Average connection time       [ms]:  {connection_total/tot_runs:>12.2f}")
+    columns = ["jobs", "successful", "classical_mean", "RUN_mean", "CONNECTION_mean"]
+    for name in ["user", "job_type"]:
+        table = summaries[name][columns].copy()
+        table[columns[2:]] = table[columns[2:]] / NS_TO_MS
+        print(f"########### Per {name} [ms] ##############")
+        print(table.to_string(float_format=lambda v: f"{v:.2f}"))
+    _print_percentiles(build_sketches(stats))
+    _print_occupancy(occupancy(stats))
+    for keys in (("job_step",), ("job_type",)):
+        _print_efficiency(efficiency(stats, keys))
+
+
+def _print_percentiles(sketches: dict, histograms: bool = False):
+    """
+    Print the latency percentiles, and optionally histograms, of the sketches
+    """
+    table = percentiles_table(sketches)
+    table[table.columns[1:]] = table[table.columns[1:]] / NS_TO_MS
+    print("########### Latency percentiles [ms] ###")
+    print(table.to_string(float_format=lambda v: f"{v:.3f}"))
+    if histograms:
+        print("########### Latency histograms #########")
+        print(histogram_table(sketches).to_string())
+
+
+OCCUPANCY_DURATIONS = ["window", "busy", "idle_total", "idle_max", "lock_wait_total"]
+OCCUPANCY_RATES = ["arrival_rate", "service_rate"]
+
+
+def _print_occupancy(table: pd.DataFrame):
+    """
+    Print the QPU occupancy per scheduling mode
+    """
+    if table.empty:
+        return
+    table = table.copy()
+    table[OCCUPANCY_DURATIONS + ["lock_wait_mean"]] /= NS_TO_MS
+    # Requests per second
+    table[OCCUPANCY_RATES] *= 1e9
+    print("########### QPU occupancy ##############")
+    print("durations [ms], rates [1/s]")
+    print(table.T.to_string(float_format=lambda v: f"{v:.3f}"))
+
+
+EFFICIENCY_DURATIONS = ["wall", "cpu", "cpu_user", "cpu_system"]
+EFFICIENCY_SIZES = ["io_read", "io_write", "max_rss"]
+
+
+def _print_efficiency(table: pd.DataFrame):
+    """
+    Print the CPU efficiency and resource usage of the traced calls
+    """
+    if table.empty:
+        return
+    table = table.copy()
+    table[EFFICIENCY_DURATIONS] /= NS_TO_MS
+    table[EFFICIENCY_SIZES] /= BYTES_TO_MB
+    print(f"########### CPU efficiency per {'/'.join(table.index.names)} ####")
+    print("durations [ms], sizes [MB]")
+    print(table.to_string(float_format=lambda v: f"{v:.2f}"))
 
 
 def profile(
-    config: str, folder: list[str], pickle: str
+    config: str,
+    folder: list[str],
+    store: str,
+    workers: Optional[int] = None,
+    rescan: bool = False,
+    run: Optional[str] = None,
 ):  # pylint: disable=unused-argument
     """
-    Profile the total execution across multiple users and store into
-    a generalised pickled object.
+    Profile the total execution across multiple users and append the results to
+    a profile store partitioned by run, user and date.
+
+    Only the traces not ingested by a previous call are read: the files already
+    processed, and the run each folder is stored in, are tracked in a manifest
+    kept in the store. The statistics printed are those of the whole runs.
+
+    Args:
+        config: configuration file used to generate the load
+        folder: folders that contain the runs
+        store: folder of the profile store
+        workers: number of processes used to read the traces, defaults to the CPU count
+        rescan: ignore the manifest and read all the traces again, in a new run
+        run: identifier of the run, defaults to the run the folders were first
+            profiled in, or else the current UTC time
     """
     # Get system configuration
 
-    config_dict = parse_json(config)  # pylint: disable=unused-variable
-    # Merging the results
-    stats = pd.concat(
-        [_get_stats_from_dir(f, PROFILER_SCHEMA) for f in folder], ignore_index=True
+    config_dict = parse_json(config)
+    profile_store = ProfileStore(store)
+    manifest = Manifest(profile_store.manifest_path, load=not rescan)
+    runs = manifest.runs(folder, run)
+    for run_id, folders in runs.items():
+        # Merging the new results, the whole dataset is validated at once
+        stats = _ingest(folders, manifest, workers)
+        if stats is None:
+            logging.info("No new traces found for run %s", run_id)
+            continue
+        _align_clocks(stats)
+        PROFILER_SCHEMA.validate(stats)
+        # The exclusive times and step aggregates depend on the whole run, e.g. on
+        # the children of a span ingested by an earlier call, they are computed
+        # on query
+        _durations(stats)
+        # Allows comparing the QPU occupancy of runs using different modes
+        stats["scheduling_mode"] = config_dict["environment"]["scheduling_mode"]
+        # Append to the store, existing partitions are left untouched
+        profile_store.append(stats, run_id)
+    manifest.save()
+    # Stats of the whole runs, including the traces ingested by previous calls
+    stats = profile_store.read(filters={"run": list(runs)})
+    if stats.empty:
+        logging.info("No traces found")
+        return
+    _print_stats(_align_clocks(stats))
+
+
+# Step aggregates of the programs, and the columns they are computed from
+AGG_COLUMNS = [f"{s}_agg" for s in STEPS]
+AGG_INPUTS = ["run", "prog_id", "job_step", "weight", "start", "end", "parent_id"]
+AGG_INPUTS.extend(SPAN_KEYS)
+
+
+def query(
+    store: str,
+    columns: Optional[list[str]] = None,
+    filters: Optional[Filters] = None,
+    expr: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Loads a subset of the profile store. Only the partitions matching the filters
+    and the requested columns are read.
+
+    The exclusive time of the traces and of each step summed over the program of
+    the traces (PRE_agg, RUN_agg and POST_agg) are computed over the loaded
+    traces, so that they account for all the ingestions of a run.
+
+    Args:
+        store: folder of the profile store
+        columns: columns to load, all of them if None
+        filters: accepted value(s) for the run, user and date partition keys
+        expr: pandas query expression to filter the rows
+
+    Returns the matching rows
+    """
+    aggregate = columns is None or bool(set(columns) & set(AGG_COLUMNS + ["exclusive"]))
+    if not aggregate:
+        return ProfileStore(store).read(columns, filters, expr)
+    to_read = None if columns is None else list(dict.fromkeys(columns + AGG_INPUTS))
+    stats = ProfileStore(store).read(to_read, filters)
+    if "start" in stats and not stats.empty:
+        _aggregate_steps(stats)
+    if expr:
+        stats = stats.query(expr)
+    return stats if columns is None else stats[[c for c in columns if c in stats]]
+
+
+def latency(
+    store: str, filters: Optional[Filters] = None, histograms: bool = False
+) -> pd.DataFrame:
+    """
+    Prints the latency percentiles per job type, step, user and connector label of
+    the partitions of the store matching the filters. Only the sketches stored
+    with each partition are read.
+
+    Args:
+        store: folder of the profile store
+        filters: accepted value(s) for the run, user and date partition keys
+        histograms: print the latency histograms as well
+
+    Returns the percentiles table, durations in ns
+    """
+    sketches = ProfileStore(store).sketches(filters)
+    if not sketches:
+        logging.info("No traces found")
+        return percentiles_table(sketches)
+    _print_percentiles(sketches, histograms)
+    return percentiles_table(sketches)
+
+
+def contention(store: str, filters: Optional[Filters] = None) -> pd.DataFrame:
+    """
+    Prints the QPU occupancy of the partitions of the store matching the filters,
+    per scheduling mode and run. Only the connector traces are loaded.
+
+    Args:
+        store: folder of the profile store
+        filters: accepted value(s) for the run, user and date partition keys
+
+    Returns the occupancy table, durations in ns and rates per ns
+    """
+    columns = [
+        "user",
+        "prog_id",
+        "job_id",
+        "job_type",
+        "job_step",
+        "label",
+        "start",
+        "end",
+        "clock_offset",
+        "scheduling_mode",
+        "run",
+    ]
+    stats = ProfileStore(store).read(columns, filters, "job_type == 'CONNECTION'")
+    _align_clocks(stats)
+    table = occupancy(stats)
+    _print_occupancy(table)
+    return table
+
+
+def flames(store: str, filters: Optional[Filters] = None) -> pd.DataFrame:
+    """
+    Builds the per-job flame summaries of the partitions of the store matching the
+    filters.
+
+    Args:
+        store: folder of the profile store
+        filters: accepted value(s) for the run, user and date partition keys
+
+    Returns the call stacks of each job, see flame
+    """
+    stats = ProfileStore(store).read(filters=filters)
+    if stats.empty:
+        return stats
+    # Pids, and so span ids, are only unique within a run
+    return pd.concat(
+        [flame(df).assign(run=run) for run, df in stats.groupby("run", sort=True)],
+        ignore_index=True,
     )
-    # Example of data extrapolation.
-    _extrapolate(stats)
-    # Store into an pickle file
-    _store(stats, pickle)
-    # Stats
-    _print_stats(stats)
+
+
+def resource_usage(store: str, filters: Optional[Filters] = None) -> pd.DataFrame:
+    """
+    Prints the CPU efficiency and resource usage per job type and step of the
+    partitions of the store matching the filters.
+
+    Args:
+        store: folder of the profile store
+        filters: accepted value(s) for the run, user and date partition keys
+
+    Returns the usage table, see efficiency
+    """
+    columns = JOB_KEYS + ["job_type", "job_step", "start", "end", "run", "weight"]
+    columns += SPAN_KEYS + ["parent_id"] + RESOURCE_FIELDS
+    stats = ProfileStore(store).read(columns, filters)
+    if stats.empty:
+        return efficiency(stats)
+    if "pid" in stats:
+        # Pids, and so span ids, are only unique within a run
+        stats["pid"] = stats.groupby(["run", "pid"], dropna=False).ngroup()
+    table = efficiency(stats)
+    _print_efficiency(table)
+    return table
+
+
+def export_chrome(store: str, output: str, filters: Optional[Filters] = None) -> int:
+    """
+    Exports the partitions of the store matching the filters to a Trace Event
+    Format file, to be opened in Perfetto. Partitions are read and written one at
+    a time, so that the whole dataset is never held in memory.
+
+    Args:
+        store: folder of the profile store
+        output: path of the json file written
+        filters: accepted value(s) for the run, user and date partition keys
+
+    Returns the number of events written
+    """
+    with ChromeTraceWriter(output) as writer:
+        for stats in ProfileStore(store).iter_partitions(filters=filters):
+            writer.write(_align_clocks(stats))
+    logging.info("Exported %d events to %s", writer.events, output)
+    return writer.events
+
+
+def timeline(store: str, filters: Optional[Filters] = None) -> pd.DataFrame:
+    """
+    Loads the spans of the partitions of the store matching the filters on one
+    global timeline across hosts and processes.
+
+    Args:
+        store: folder of the profile store
+        filters: accepted value(s) for the run, user and date partition keys
+
+    Returns the spans sorted by global start, see global_timeline
+    """
+    stats = ProfileStore(store).read(filters=filters)
+    if stats.empty:
+        return stats
+    # Recomputed from the offsets, which older partitions may lack
+    return global_timeline(_align_clocks(stats))
 
 
 def main():
@@ -114,10 +867,10 @@ def main():
     )
     parser.add_argument("folder", type=str, help="Folder that contains the runs")
     parser.add_argument(
-        "--pickle", type=str, help="Optional Pickle filepath to store pickled dataframe"
+        "--store", type=str, help="Folder of the profile store", default="QS_Profile"
     )
     args = parser.parse_args()
-    profile(args.config, args.folder, args.pickle)
+    profile(args.cfg, [args.folder], args.store)
 
 
 if __name__ == "__main__":
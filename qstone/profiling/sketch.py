@@ -0,0 +1,284 @@
+"""Mergeable streaming sketches of latency distributions"""
+
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy
+import pandas as pd
+
+PERCENTILES = (50, 90, 99, 99.9)
+# Coarse histogram edges, in ns: 1us to 1000s per decade
+HISTOGRAM_EDGES = tuple(10**e for e in range(3, 13))
+
+SketchKey = Tuple[str, str]
+
+
+def _duration(ns: int) -> str:
+    """Human readable duration of a histogram edge"""
+    for unit, scale in (("s", 10**9), ("ms", 10**6), ("us", 10**3)):
+        if ns >= scale:
+            return f"{ns / scale:g}{unit}"
+    return f"{ns}ns"
+
+
+def _histogram_labels(edges: list) -> list[str]:
+    """Labels of the buckets of a histogram with the edges"""
+    return [f"<{_duration(e)}" for e in edges] + [f">={_duration(edges[-1])}"]
+
+
+class LatencySketch:
+    """
+    Log-linear histogram of non negative integer durations (HDR histogram layout).
+
+    Values below 2**precision are counted exactly, larger values fall in buckets
+    whose width is a power of two, with 2**(precision - 1) buckets per power of
+    two. The relative error on any reported value is then below 2**(1 - precision).
+    Sketches with the same precision are merged by adding their counts, so they
+    can be built incrementally over arbitrarily large trace sets.
+
+    Args:
+        precision: number of bits kept for each value
+    """
+
+    def __init__(self, precision: int = 7):
+        self._precision = precision
+        half = 1 << (precision - 1)
+        # Counts are weighted, sampled traces accounting for several calls
+        self._counts = numpy.zeros((64 - precision) * half + 2 * half)
+        self._sum = 0.0
+        self._min: Optional[int] = None
+        self._max: Optional[int] = None
+
+    @property
+    def precision(self) -> int:
+        """Returns the number of bits kept for each value"""
+        return self._precision
+
+    @property
+    def count(self) -> float:
+        """Returns the number of recorded values"""
+        return float(self._counts.sum())
+
+    @property
+    def mean(self) -> float:
+        """Returns the exact mean of the recorded values"""
+        return self._sum / self.count if self.count else float("nan")
+
+    @property
+    def sum(self) -> float:
+        """Returns the weighted sum of the recorded values"""
+        return self._sum
+
+    @property
+    def counts(self) -> numpy.ndarray:
+        """Returns the weighted count of values in each bucket"""
+        return self._counts
+
+    @property
+    def min(self) -> Optional[int]:
+        """Returns the smallest recorded value"""
+        return self._min
+
+    @property
+    def max(self) -> Optional[int]:
+        """Returns the largest recorded value"""
+        return self._max
+
+    def _index(self, values: numpy.ndarray) -> numpy.ndarray:
+        """Bucket index of each value"""
+        p = self._precision
+        half = 1 << (p - 1)
+        # frexp may round up values just below a power of two, fixed below
+        shift = numpy.maximum(numpy.frexp(values.astype(numpy.float64))[1] - p, 0)
+        mantissa = values >> shift
+        low = (shift > 0) & (mantissa < half)
+        shift = numpy.where(low, shift - 1, shift)
+        mantissa = values >> shift
+        return numpy.where(
+            shift == 0, values, (1 << p) + (shift - 1) * half + mantissa - half
+        )
+
+    def _bounds(self, index: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Lower bound and width of each bucket"""
+        p = self._precision
+        half = 1 << (p - 1)
+        k = numpy.maximum(index - (1 << p), 0)
+        shift = numpy.where(index < (1 << p), 0, k // half + 1)
+        mantissa = numpy.where(index < (1 << p), index, k % half + half)
+        return mantissa << shift, numpy.int64(1) << shift
+
+    def record(self, values: Iterable[int], weights: Optional[Iterable[float]] = None):
+        """Adds the values to the sketch, each counted as many times as its weight"""
+        values = numpy.maximum(numpy.asarray(values, dtype=numpy.int64), 0)
+        if values.size == 0:
+            return
+        weights = (
+            numpy.ones(values.size)
+            if weights is None
+            else numpy.asarray(weights, dtype=numpy.float64)
+        )
+        self._counts += numpy.bincount(
+            self._index(values), weights=weights, minlength=len(self._counts)
+        )
+        self._sum += float((values * weights).sum())
+        vmin, vmax = int(values.min()), int(values.max())
+        self._min = vmin if self._min is None else min(self._min, vmin)
+        self._max = vmax if self._max is None else max(self._max, vmax)
+
+    def merge(self, other: "LatencySketch") -> "LatencySketch":
+        """Adds the content of another sketch to this one"""
+        if other.precision != self._precision:
+            raise ValueError("Only sketches with the same precision can be merged")
+        self._counts += other.counts
+        self._sum += other.sum
+        lows = [v for v in (self._min, other.min) if v is not None]
+        highs = [v for v in (self._max, other.max) if v is not None]
+        self._min = min(lows) if lows else None
+        self._max = max(highs) if highs else None
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Returns the value at quantile q (0 <= q <= 1)"""
+        total = self.count
+        if not total:
+            return float("nan")
+        rank = max(int(numpy.ceil(q * total)), 1)
+        index = int(numpy.searchsorted(numpy.cumsum(self._counts), rank))
+        lower, width = self._bounds(numpy.array([index]))
+        value = float(lower[0] + (width[0] - 1) / 2)
+        # The extremes are known exactly, and set once a value is recorded
+        return float(min(max(value, self._min), self._max))  # type: ignore[type-var, arg-type]
+
+    def histogram(self, edges: Iterable[int] = HISTOGRAM_EDGES) -> pd.Series:
+        """Returns the number of values below each edge and above the previous one.
+        Buckets straddling an edge are assigned by their lower bound."""
+        edges = list(edges)
+        nonzero = numpy.nonzero(self._counts)[0]
+        lower, _ = self._bounds(nonzero)
+        bins = numpy.searchsorted(numpy.asarray(edges), lower, side="right")
+        counts = numpy.bincount(
+            bins, weights=self._counts[nonzero], minlength=len(edges) + 1
+        )
+        return pd.Series(
+            counts.round().astype(numpy.int64), index=_histogram_labels(edges)
+        )
+
+    def to_dict(self) -> dict:
+        """Sparse serialisable representation of the sketch"""
+        nonzero = numpy.nonzero(self._counts)[0]
+        return {
+            "precision": self._precision,
+            "counts": {str(i): float(self._counts[i]) for i in nonzero},
+            "sum": self._sum,
+            "min": self._min,
+            "max": self._max,
+        }
+
+    @classmethod
+    def from_dict(cls, content: dict) -> "LatencySketch":
+        """Builds a sketch out of its serialised representation"""
+        sketch = cls(content["precision"])
+        for index, count in content["counts"].items():
+            sketch._counts[int(index)] = count
+        sketch._sum = content["sum"]
+        sketch._min = content["min"]
+        sketch._max = content["max"]
+        return sketch
+
+
+def _groups(stats: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Key of each trace for each of the dimensions, NaN when not applicable"""
+    connection = stats["job_type"] == "CONNECTION"
+    label = stats["label"] if "label" in stats else pd.Series(None, index=stats.index)
+    return {
+        "job_type": stats["job_type"].where(~connection),
+        "job_step": stats["job_step"],
+        "user": stats["user"],
+        # Connector calls are identified by their label or, without one, by step
+        "connector": label.fillna(stats["job_step"]).where(connection),
+    }
+
+
+def build_sketches(stats: pd.DataFrame) -> Dict[SketchKey, LatencySketch]:
+    """
+    Sketches the trace durations per job type, step, user and connector label.
+    Sampled traces are counted as many times as their weight.
+
+    Args:
+        stats: profiled traces
+
+    Returns the sketches keyed by (dimension, value)
+    """
+    total = (stats["end"] - stats["start"]).to_numpy(dtype=numpy.int64)
+    weights = (
+        stats["weight"].fillna(1.0).to_numpy(dtype=numpy.float64)
+        if "weight" in stats
+        else numpy.ones(len(stats))
+    )
+    sketches = {}
+    for dimension, keys in _groups(stats).items():
+        codes, uniques = pd.factorize(keys)
+        for code, key in enumerate(uniques):
+            sketch = LatencySketch()
+            sketch.record(total[codes == code], weights[codes == code])
+            sketches[(dimension, str(key))] = sketch
+    return sketches
+
+
+def merge_sketches(
+    into: Dict[SketchKey, LatencySketch], other: Dict[SketchKey, LatencySketch]
+) -> Dict[SketchKey, LatencySketch]:
+    """Merges a set of sketches into another one"""
+    for key, sketch in other.items():
+        if key in into:
+            into[key].merge(sketch)
+        else:
+            into[key] = sketch
+    return into
+
+
+def dump_sketches(sketches: Dict[SketchKey, LatencySketch], path: str):
+    """Writes a set of sketches as json"""
+    content = [
+        {"dimension": d, "key": k, "sketch": s.to_dict()}
+        for (d, k), s in sketches.items()
+    ]
+    with open(path, "w", encoding="utf-8") as fid:
+        json.dump(content, fid)
+
+
+def load_sketches(path: str) -> Dict[SketchKey, LatencySketch]:
+    """Reads a set of sketches written by dump_sketches"""
+    with open(path, "r", encoding="utf-8") as fid:
+        content = json.load(fid)
+    return {
+        (c["dimension"], c["key"]): LatencySketch.from_dict(c["sketch"])
+        for c in content
+    }
+
+
+def _sketch_index(sketches: Dict[SketchKey, LatencySketch]) -> pd.MultiIndex:
+    """Index of the tables of the sketches, also when there are none"""
+    return pd.MultiIndex.from_tuples(sorted(sketches), names=["dimension", "key"])
+
+
+def percentiles_table(
+    sketches: Dict[SketchKey, LatencySketch], percentiles=PERCENTILES
+) -> pd.DataFrame:
+    """Returns count, mean, percentiles and max of each sketch, durations in ns"""
+    columns = ["count", "mean", *(f"p{p:g}" for p in percentiles), "max"]
+    rows = [
+        [round(s.count), s.mean, *(s.quantile(p / 100) for p in percentiles), s.max]
+        for _, s in sorted(sketches.items())
+    ]
+    return pd.DataFrame(rows, index=_sketch_index(sketches), columns=columns)
+
+
+def histogram_table(sketches: Dict[SketchKey, LatencySketch]) -> pd.DataFrame:
+    """Returns the coarse histogram of each sketch, one row per sketch"""
+    rows = [s.histogram() for _, s in sorted(sketches.items())]
+    return pd.DataFrame(
+        rows,
+        index=_sketch_index(sketches),
+        columns=_histogram_labels(list(HISTOGRAM_EDGES)),
+    )
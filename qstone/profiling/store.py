@@ -0,0 +1,181 @@
+"""Append-only profile store partitioned by run, user and date"""
+
+import datetime
+import json
+import os
+import uuid
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from qstone.profiling.sketch import (
+    LatencySketch,
+    SketchKey,
+    build_sketches,
+    dump_sketches,
+    load_sketches,
+    merge_sketches,
+)
+
+PARTITION_KEYS = ("run", "user", "date")
+INDEX_FILE = "index.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+Filters = Dict[str, Union[str, Sequence[str]]]
+
+
+def new_run_id() -> str:
+    """Returns a run identifier based on the current UTC time"""
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+
+def _matches(partition: dict, filters: Optional[Filters]) -> bool:
+    """Checks a partition against filters on the partition keys"""
+    for key, value in (filters or {}).items():
+        if key not in PARTITION_KEYS:
+            raise KeyError(f"{key} is not a partition key, expected {PARTITION_KEYS}")
+        values = [value] if isinstance(value, str) else value
+        if partition[key] not in values:
+            return False
+    return True
+
+
+class ProfileStore:
+    """
+    Dataset of profiled traces. Each ingestion appends Parquet files under
+    `<path>/run=<run>/user=<user>/date=<date>/` and one line per file to an index,
+    so existing data is never read or rewritten when new stats are stored.
+
+    Args:
+        path: root folder of the store
+    """
+
+    def __init__(self, path: str):
+        if os.path.isfile(path):
+            raise ValueError(
+                f"{path} is a file. Profiles are now stored in a folder, please "
+                "provide a new location."
+            )
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        """Returns the root folder of the store"""
+        return self._path
+
+    @property
+    def manifest_path(self) -> str:
+        """Returns the location of the manifest of ingested trace files"""
+        return os.path.join(self._path, MANIFEST_FILE)
+
+    def partitions(self, filters: Optional[Filters] = None) -> List[dict]:
+        """Returns the index entries of the partition files matching the filters
+
+        Args:
+            filters: accepted value(s) for each partition key, e.g. {"user": "user0"}
+        """
+        index = os.path.join(self._path, INDEX_FILE)
+        if not os.path.exists(index):
+            return []
+        with open(index, "r", encoding="utf-8") as fid:
+            entries = [json.loads(line) for line in fid if line.endswith("\n")]
+        return [e for e in entries if _matches(e, filters)]
+
+    def append(self, stats: pd.DataFrame, run: str) -> List[str]:
+        """Stores the stats of a run, one file per user
+
+        Args:
+            stats: dataframe to store
+            run: identifier of the run
+
+        Returns the list of files written
+        """
+        date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+        written = []
+        for user, df in stats.groupby("user", sort=True):
+            partition = {"run": run, "user": str(user), "date": date}
+            folder = os.path.join(
+                *(f"{k}={quote(partition[k], safe='')}" for k in PARTITION_KEYS)
+            )
+            os.makedirs(os.path.join(self._path, folder), exist_ok=True)
+            filename = os.path.join(folder, f"part-{uuid.uuid4().hex}.parquet")
+            tmp = os.path.join(self._path, f"{filename}.tmp")
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, os.path.join(self._path, filename))
+            # Latency sketches are kept next to the data to be merged without it
+            sketch = filename.replace(".parquet", ".sketch.json")
+            dump_sketches(build_sketches(df), os.path.join(self._path, sketch))
+            # The files are only listed once they are complete
+            entry = {**partition, "file": filename, "sketch": sketch, "rows": len(df)}
+            with open(
+                os.path.join(self._path, INDEX_FILE), "a", encoding="utf-8"
+            ) as fid:
+                fid.write(json.dumps(entry) + "\n")
+            written.append(filename)
+        return written
+
+    def sketches(
+        self, filters: Optional[Filters] = None
+    ) -> Dict[SketchKey, LatencySketch]:
+        """Merges the latency sketches of the partitions matching the filters,
+        without loading their rows
+
+        Args:
+            filters: accepted value(s) for each partition key
+        """
+        sketches: Dict[SketchKey, LatencySketch] = {}
+        for entry in self.partitions(filters):
+            if "sketch" in entry:
+                merge_sketches(
+                    sketches, load_sketches(os.path.join(self._path, entry["sketch"]))
+                )
+        return sketches
+
+    def iter_partitions(
+        self,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+        query: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Iterates over the partitions matching the filters, one dataframe each
+
+        Args:
+            columns: columns to load, all of them if None
+            filters: accepted value(s) for each partition key
+            query: pandas query expression applied to the rows of each partition
+        """
+        for entry in self.partitions(filters):
+            path = os.path.join(self._path, entry["file"])
+            available = pq.ParquetFile(path).schema_arrow.names
+            to_read = (
+                available if columns is None else [c for c in columns if c in available]
+            )
+            df = pd.read_parquet(path, columns=to_read)
+            for key in ("run", "date"):
+                if columns is None or key in columns:
+                    df[key] = entry[key]
+            if query:
+                df = df.query(query)
+            yield df
+
+    def read(
+        self,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+        query: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Loads the partitions matching the filters into a single dataframe
+
+        Args:
+            columns: columns to load, all of them if None
+            filters: accepted value(s) for each partition key
+            query: pandas query expression applied to the rows
+        """
+        frames = list(self.iter_partitions(columns, filters, query))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True, sort=False)
+        return df if columns is None else df[[c for c in columns if c in df]]
@@ -10,6 +10,15 @@ FULL_SCHEMA = {
                 "scheduling_mode": {"enum": ["LOCK", "SCHEDULER", "POLLING", "NONE"]},
                 "lock_file": {"type": "string"},
                 "job_count": {"type": "number"},
+                "trace_format": {"enum": ["jsonl", "records"]},
+                "trace_resources": {"type": "boolean"},
+                "trace_metrics": {"type": "string"},
+                "pilot_workers": {"type": "integer", "minimum": 1},
+                "worker_socket": {"type": "string"},
+                "trace_sampling": {
+                    "type": "object",
+                    "additionalProperties": {"type": "number", "exclusiveMinimum": 0},
+                },
                 "qpu": {
                     "type": "object",
                     "properties": {
@@ -20,7 +29,8 @@ FULL_SCHEMA = {
                 "connectivity": {
                     "type": "object",
                     "properties": {
-                        "mode": {"enum": ["NO_LINK", "HTTPS", "RIGETTI", "GRPC"]},
+                        # NO_LINK, HTTPS, RIGETTI, GRPC or a connector plugin
+                        "mode": {"type": "string"},
                         "ip_address": {"type": "string", "format": "hostname"},
                         "qpu": {
                             "type": "object",
@@ -49,34 +59,56 @@ FULL_SCHEMA = {
                 },
             },
             "required": ["scheduling_mode", "connectivity"],
-            "jobs": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "qubit": {"type": "array", "minItems": 1, "maxItems": 2},
-                        "shots": {"type": "array", "minItems": 1, "maxItems": 2},
-                        "walltime": {"type": "number"},
-                        "app_args": {"type": "object"},
-                        "app_logging_level": {
-                            "type": "integer",
-                            "minimum": 0,
-                            "maximum": 2,
-                        },
+        },
+        "jobs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "qubit": {"type": "array", "minItems": 1, "maxItems": 2},
+                    "shots": {"type": "array", "minItems": 1, "maxItems": 2},
+                    "walltime": {"type": "number"},
+                    "app_args": {"type": "object"},
+                    "app_logging_level": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "maximum": 2,
                     },
                 },
             },
-            "users": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "user": {"type": "string"},
-                        "job_count": {"type": "number"},
-                        "computations": {"type": "object"},
+        },
+        "users": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "user": {"type": "string"},
+                    "job_count": {"type": "number"},
+                    "computations": {"type": "object"},
+                    "arrival": {
+                        "type": "object",
+                        "properties": {
+                            "model": {"enum": ["poisson", "mmpp", "diurnal", "think"]},
+                            "rate": {"type": "number", "exclusiveMinimum": 0},
+                            "rates": {
+                                "type": "array",
+                                "minItems": 1,
+                                "items": {"type": "number", "minimum": 0},
+                            },
+                            "durations": {
+                                "type": "array",
+                                "minItems": 1,
+                                "items": {"type": "number", "exclusiveMinimum": 0},
+                            },
+                            "amplitude": {
+                                "type": "number",
+                                "minimum": 0,
+                                "maximum": 1,
+                            },
+                        },
                     },
-                    "required": ["user", "computation"],
                 },
+                "required": ["user", "computations"],
             },
         },
     },
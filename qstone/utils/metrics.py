@@ -0,0 +1,87 @@
+"""Live push of the traced spans to a node-local metrics aggregator"""
+
+import json
+import os
+import socket
+import time
+from typing import Optional, Union
+
+from .tracing import PROCESS_INFO
+
+Address = Union[str, tuple[str, int]]
+
+
+def parse_address(address: str) -> tuple[int, Address]:
+    """Socket family and address of a metrics endpoint: a Unix socket path, a
+    `host:port` pair, or a port on localhost"""
+    if address.isdigit():
+        return socket.AF_INET, ("127.0.0.1", int(address))
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class MetricsPusher:
+    """Sends the start and end of the traced spans to the metrics aggregator as
+    datagrams, one per event.
+
+    Pushing never blocks the job: events are dropped when the aggregator is not
+    running or falls behind, the traces remain the complete record.
+    """
+
+    def __init__(self):
+        self._socket: Optional[socket.socket] = None
+        self._address: Optional[str] = None
+        self._target: Address = ""
+        os.register_at_fork(after_in_child=self._close)
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket, self._address = None, None
+
+    def _send(self, address: str, event: dict):
+        if address != self._address:
+            self._close()
+            family, self._target = parse_address(address)
+            self._socket = socket.socket(family, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+            self._address = address
+        try:
+            self._socket.sendto(  # type: ignore[union-attr]
+                json.dumps(event).encode(), self._target
+            )
+        except OSError:
+            pass
+
+    def span_started(
+        self,
+        address: str,
+        computation_type: str,
+        computation_step: str,
+        label: Optional[str],
+        span: tuple[int, int],
+    ):
+        """Pushes the start of a span, so the aggregator can count it in flight"""
+        self._send(
+            address,
+            {
+                "event": "start",
+                "job_type": computation_type,
+                "job_step": computation_step,
+                "label": label,
+                "start": time.perf_counter_ns(),
+                "host": PROCESS_INFO.host,
+                "pid": PROCESS_INFO.pid,
+                "span_id": span[0],
+                "parent_id": span[1],
+            },
+        )
+
+    def span_ended(self, address: str, content: dict, connector: str):
+        """Pushes a completed span, its content being that of the trace"""
+        self._send(address, {"event": "end", "connector": connector, **content})
+
+
+METRICS_PUSHER = MetricsPusher()
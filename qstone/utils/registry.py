@@ -0,0 +1,92 @@
+"""Registries of classes imported only when they are selected"""
+
+import importlib
+import logging
+import sys
+from typing import Any, Dict, Optional, Union
+
+
+class LazyRegistry:
+    """
+    Maps names to classes given as `module:attribute` paths, imported on their
+    first lookup, so that selecting one entry does not import the dependencies
+    of the others.
+
+    Plugins extend the registry by declaring entry points in the group, e.g. in
+    their `pyproject.toml`:
+
+        [project.entry-points."qstone.apps"]
+        MyApp = "my_package.my_app:MyApp"
+
+    Entries registered in the code take precedence over the plugins. Built-in
+    classes defined in a module of their own name, e.g. `qstone.apps.VQE:VQE`,
+    are bound back on the package once imported, in place of their module.
+
+    Args:
+        group: entry point group of the plugins
+        entries: built-in entries, by name
+    """
+
+    def __init__(self, group: str, entries: Optional[Dict[str, str]] = None):
+        self.group = group
+        self._entries: Dict[str, Any] = dict(entries or {})
+        self._builtins = dict(self._entries)
+        self._plugins: Optional[Dict[str, Any]] = None
+
+    def _plugin_entries(self) -> Dict[str, Any]:
+        """Entry points of the group, discovered once"""
+        if self._plugins is None:
+            # Scanning the installed distributions is only done on a miss
+            from importlib import metadata  # pylint: disable=import-outside-toplevel
+
+            self._plugins = {
+                entry.name: entry for entry in metadata.entry_points(group=self.group)
+            }
+        return self._plugins
+
+    def register(self, name: str, target: Union[str, type]):
+        """Registers a class, or the `module:attribute` path to import it from"""
+        self._entries[name] = target
+
+    def names(self) -> list:
+        """Returns the names of the built-in, registered and plugin entries"""
+        return sorted(set(self._entries) | set(self._plugin_entries()))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries or name in self._plugin_entries()
+
+    def get(self, name: str) -> Any:
+        """Returns the class of an entry, importing it on the first lookup
+
+        Raises:
+            KeyError: no entry of that name
+        """
+        if name not in self._entries:
+            if name not in self._plugin_entries():
+                raise KeyError(f"{name} is not registered in {self.group}")
+            self._entries[name] = self._plugin_entries()[name].load()
+        target = self._entries[name]
+        if isinstance(target, str):
+            builtin = self._builtins.get(name) == target
+            module, _, attribute = target.partition(":")
+            target = getattr(importlib.import_module(module), attribute)
+            package, _, submodule = module.rpartition(".")
+            if builtin and package and submodule == attribute:
+                # Importing the module bound its name on the package to it
+                setattr(sys.modules[package], attribute, target)
+            self._entries[name] = target
+        return target
+
+    def load_all(self) -> list:
+        """Imports all the entries, e.g. before forking processes that use them
+
+        Returns the names of the entries that failed to import
+        """
+        failed = []
+        for name in self.names():
+            try:
+                self.get(name)
+            except ImportError:
+                logging.warning("%s of %s failed to import", name, self.group)
+                failed.append(name)
+        return failed
@@ -0,0 +1,541 @@
+"""Buffered sink for the profiling traces. Used across the jobs"""
+
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None  # type: ignore[assignment]
+
+TRACE_BUFFER_SIZE = int(os.environ.get("QS_TRACE_BUFFER_SIZE", "512"))
+TRACE_EXT = ".jsonl"
+RECORDS_EXT = ".qstrace"
+TRACE_EXTS = {"jsonl": TRACE_EXT, "records": RECORDS_EXT}
+
+# Fixed layout of a trace record in the columnar format. Strings longer than
+# their field are truncated.
+TRACE_DTYPE = numpy.dtype(
+    [
+        ("user", "S32"),
+        ("prog_id", "S16"),
+        ("job_id", "S32"),
+        ("job_type", "S64"),
+        ("job_step", "S8"),
+        ("label", "S64"),
+        ("start", "<i8"),
+        ("end", "<i8"),
+        ("success", "?"),
+        ("host", "S64"),
+        ("pid", "<i8"),
+        ("clock_offset", "<i8"),
+        ("span_id", "<i8"),
+        ("parent_id", "<i8"),
+        ("weight", "<f8"),
+        ("cpu_user", "<i8"),
+        ("cpu_system", "<i8"),
+        ("ctx_voluntary", "<i8"),
+        ("ctx_involuntary", "<i8"),
+        ("io_read", "<i8"),
+        ("io_write", "<i8"),
+        ("max_rss", "<i8"),
+        ("qubits", "<i8"),
+        ("shots", "<i8"),
+    ]
+)
+# Resource usage of a span: CPU times in ns, context switches, bytes read and
+# written, and the peak resident set size of the process in bytes
+RESOURCE_FIELDS = [
+    "cpu_user",
+    "cpu_system",
+    "ctx_voluntary",
+    "ctx_involuntary",
+    "io_read",
+    "io_write",
+    "max_rss",
+]
+# Settings of the job a span belongs to, replayed by `qstone generate`
+JOB_SETTINGS = ["qubits", "shots"]
+# Value of the fields missing from a record, other than empty strings and zeros.
+# Resource usage not captured and job settings not known are recorded as -1.
+RECORD_DEFAULTS = {
+    "weight": 1.0,
+    **{name: -1 for name in RESOURCE_FIELDS + JOB_SETTINGS},
+}
+RECORDS_MAGIC = b"QSTRACE1"
+
+
+def _measure_clock_offset() -> int:
+    """Offset from the performance counter to the epoch, in ns.
+
+    The wall clock is read between two reads of the counter, and the read with the
+    narrowest bracket is kept.
+    """
+    reads = []
+    for _ in range(5):
+        before = time.perf_counter_ns()
+        wall = time.time_ns()
+        after = time.perf_counter_ns()
+        reads.append((after - before, wall - (before + after) // 2))
+    return min(reads)[1]
+
+
+class _ProcessInfo:
+    """Identity of the tracing process: host, pid and the offset of its
+    performance counter to the epoch, captured at process start and after a fork"""
+
+    def __init__(self):
+        self.host = socket.gethostname()
+        self.capture()
+        os.register_at_fork(after_in_child=self.capture)
+
+    def capture(self):
+        """Captures the pid and clock offset of the current process"""
+        self.pid = os.getpid()
+        self.clock_offset = _measure_clock_offset()
+
+
+PROCESS_INFO = _ProcessInfo()
+
+# ru_maxrss is in kB on Linux and in bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class ResourceProbe:
+    """Reads the resource usage of the process: `getrusage` and, on Linux, the
+    characters read and written from `/proc/self/io`.
+
+    The io file is kept open and reopened after a fork, since it describes the
+    process that opened it. Counters that cannot be read are reported as -1.
+    """
+
+    def __init__(self):
+        self._io: Optional[int] = None
+        self._opened = False
+        os.register_at_fork(after_in_child=self._close)
+
+    def _close(self):
+        if self._io is not None:
+            os.close(self._io)
+        self._io, self._opened = None, False
+
+    def _io_counters(self) -> tuple[int, int]:
+        """Characters read and written by the process, including cached I/O"""
+        if not self._opened:
+            self._opened = True
+            try:
+                self._io = os.open("/proc/self/io", os.O_RDONLY)
+            except OSError:
+                self._io = None
+        if self._io is None:
+            return -1, -1
+        counters = dict(
+            line.split(b":", 1) for line in os.pread(self._io, 512, 0).splitlines()
+        )
+        return int(counters[b"rchar"]), int(counters[b"wchar"])
+
+    def snapshot(self) -> tuple:
+        """Returns the current usage, to be compared with `usage`"""
+        if resource is None:
+            return ()
+        return resource.getrusage(resource.RUSAGE_SELF), self._io_counters()
+
+    @staticmethod
+    def usage(before: tuple, after: tuple) -> dict:
+        """Returns the resources used between two snapshots, keyed by field.
+
+        The counters are those of the whole process: spans running concurrently
+        in other threads are accounted for as well.
+        """
+        if not before:
+            return {}
+        (start, (read0, write0)), (end, (read1, write1)) = before, after
+        return {
+            "cpu_user": round((end.ru_utime - start.ru_utime) * 1e9),
+            "cpu_system": round((end.ru_stime - start.ru_stime) * 1e9),
+            "ctx_voluntary": end.ru_nvcsw - start.ru_nvcsw,
+            "ctx_involuntary": end.ru_nivcsw - start.ru_nivcsw,
+            "io_read": read1 - read0 if read0 >= 0 else -1,
+            "io_write": write1 - write0 if write0 >= 0 else -1,
+            "max_rss": end.ru_maxrss * _MAXRSS_UNIT,
+        }
+
+
+RESOURCE_PROBE = ResourceProbe()
+
+# Traced call in progress in the current thread or task, 0 outside of any span.
+# Span ids are unique within a process: spans are identified by host, pid and id.
+CURRENT_SPAN: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "qstone_span", default=0
+)
+_SPAN_IDS = itertools.count(1)
+
+
+def new_span_id() -> int:
+    """Returns a new span id, unique within the process"""
+    return next(_SPAN_IDS)
+
+
+SAMPLING_PREFIX = "TRACE_SAMPLING_"
+
+
+class TraceConfig:
+    """Trace settings of the job, read once per process from the environment.
+
+    Sampling rates are set per label with `TRACE_SAMPLING_<LABEL>` variables, as
+    exported from the `trace_sampling` entry of the environment configuration.
+
+    Resource usage is captured for each traced call when `TRACE_RESOURCES` is
+    set, as exported from the `trace_resources` entry.
+
+    Spans are pushed live to the metrics aggregator listening at `TRACE_METRICS`,
+    when set, as exported from the `trace_metrics` entry.
+
+    Call `reconfigure` after changing them at runtime.
+    """
+
+    def __init__(self):
+        self.reload()
+
+    def reload(self):
+        """Reads the settings from the environment"""
+        self.logging_level = int(os.environ.get("APP_LOGGING_LEVEL", "0"))
+        self.profile_path = os.environ.get("PROFILE_PATH")
+        self.user = os.environ.get("QS_USER")
+        self.prog_id = os.environ.get("PROG_ID")
+        self.job_id = os.environ.get("JOB_ID")
+        self.qubits = int(os.environ.get("NUM_QUBITS") or -1)
+        self.shots = int(os.environ.get("NUM_SHOTS") or -1)
+        self.resources = os.environ.get("TRACE_RESOURCES", "").lower() in (
+            "1",
+            "true",
+        )
+        self.metrics = os.environ.get("TRACE_METRICS") or None
+        self.connector = os.environ.get("CONNECTIVITY_MODE", "NO_LINK")
+        self.sampling = {
+            key[len(SAMPLING_PREFIX) :]: float(value)
+            for key, value in os.environ.items()
+            if key.startswith(SAMPLING_PREFIX)
+        }
+        self._warned = False
+
+    def enabled(self, logging_level: int) -> bool:
+        """Whether calls traced at the logging level are recorded"""
+        if self.profile_path is None:
+            if not self._warned:
+                # Warned once per configuration, on the first traced call it disables
+                logging.warning("PROFILE_PATH is not set, tracing is disabled")
+                self._warned = True
+            return False
+        return logging_level >= self.logging_level
+
+    def sampling_rate(self, label: Optional[str]) -> float:
+        """Sampling rate of the calls traced with the label: every Nth call for
+        N >= 1, a probability for rates below 1"""
+        return self.sampling.get((label or "").upper(), 1.0)
+
+
+TRACE_CONFIG = TraceConfig()
+
+# Traced call of a function: traced(weight, args, kwargs), the weight being the
+# number of calls the trace accounts for.
+TracedCall = Callable[[float, tuple, dict], Any]
+
+
+def _sampled(func: Callable, traced: TracedCall, rate: float) -> Callable:
+    """Wrapper tracing the calls of a function at the sampling rate"""
+    if rate == 1:
+
+        @wraps(func)
+        def every_call(*args, **kwargs):
+            return traced(1.0, args, kwargs)
+
+        return every_call
+
+    if rate > 1:
+        every = int(rate)
+        calls = itertools.count()
+
+        @wraps(func)
+        def every_nth(*args, **kwargs):
+            if next(calls) % every:
+                return func(*args, **kwargs)
+            return traced(every, args, kwargs)
+
+        return every_nth
+
+    @wraps(func)
+    def probabilistic(*args, **kwargs):
+        if random.random() >= rate:
+            return func(*args, **kwargs)
+        return traced(1 / rate, args, kwargs)
+
+    return probabilistic
+
+
+class _TraceSite:
+    """A traced function, bound either to its tracing wrapper or, when its logging
+    level is disabled, to the function itself so that calls pay no overhead"""
+
+    def __init__(
+        self,
+        func: Callable,
+        traced: TracedCall,
+        logging_level: int,
+        label: Optional[str],
+    ):
+        self.func = func
+        self.traced = traced
+        self.logging_level = logging_level
+        self.label = label
+        self.bound = self.target()
+
+    def target(self) -> Callable:
+        """Returns the callable matching the current configuration"""
+        if not TRACE_CONFIG.enabled(self.logging_level):
+            return self.func
+        return _sampled(self.func, self.traced, TRACE_CONFIG.sampling_rate(self.label))
+
+    def rebind(self):
+        """Replaces the callable bound to the name of the function in its module
+        or class, unless it was bound to something else in the meantime"""
+        owner = sys.modules.get(self.func.__module__)
+        *path, name = self.func.__qualname__.split(".")
+        for part in path:
+            owner = getattr(owner, part, None)
+        if owner is None:
+            return
+        if vars(owner).get(name) in (self.func, self.bound):
+            self.bound = self.target()
+            setattr(owner, name, self.bound)
+
+
+_TRACE_SITES: List[_TraceSite] = []
+
+
+def register_trace_site(
+    func: Callable,
+    traced: TracedCall,
+    logging_level: int,
+    label: Optional[str] = None,
+) -> Callable:
+    """Returns the callable to bind to a traced function: its tracing wrapper when
+    its logging level is enabled, sampling the calls as set for its label, and
+    the function itself otherwise.
+
+    Functions defined at module or class level are rebound by `reconfigure`.
+    """
+    site = _TraceSite(func, traced, logging_level, label)
+    if "<locals>" not in func.__qualname__:
+        _TRACE_SITES.append(site)
+    return site.bound
+
+
+def reconfigure():
+    """Reads the trace settings from the environment again and rebinds the traced
+    functions accordingly, e.g. after changing `APP_LOGGING_LEVEL` in a test.
+
+    Functions defined in a local scope are configured when they are defined, and
+    references kept elsewhere (e.g. `from module import function`) are not updated.
+    """
+    TRACE_CONFIG.reload()
+    for site in _TRACE_SITES:
+        site.rebind()
+
+
+def trace_format() -> str:
+    """Returns the trace format selected for the current job"""
+    fmt = os.environ.get("TRACE_FORMAT", "jsonl")
+    if fmt not in TRACE_EXTS:
+        raise ValueError(f"Unknown trace format {fmt}, expected one of {TRACE_EXTS}")
+    return fmt
+
+
+def trace_filename(profile_path: str, fmt: str = "jsonl") -> str:
+    """Returns the per-process trace file for the given profile folder"""
+    return os.path.join(
+        profile_path,
+        f"trace_{PROCESS_INFO.host}_{PROCESS_INFO.pid}{TRACE_EXTS[fmt]}",
+    )
+
+
+def _records_header() -> bytes:
+    """Header of a columnar trace file: magic, length and layout of the records"""
+    descr = json.dumps(TRACE_DTYPE.descr).encode()
+    # Padding the header keeps the records aligned once memory-mapped.
+    descr += b" " * (-(len(RECORDS_MAGIC) + 4 + len(descr)) % 8)
+    return RECORDS_MAGIC + struct.pack("<I", len(descr)) + descr
+
+
+def _or_default(value: Any, name: str) -> Any:
+    """Value of a numeric field, its default when missing"""
+    return RECORD_DEFAULTS.get(name, 0) if value is None else value
+
+
+def _encode_records(contents: List[dict]) -> bytes:
+    """Packs the trace records into their fixed binary layout"""
+    records = numpy.array(
+        [
+            tuple(
+                (
+                    (content.get(name) or "").encode("utf-8")
+                    if TRACE_DTYPE[name].kind == "S"
+                    else _or_default(content.get(name), name)
+                )
+                for name in TRACE_DTYPE.names  # type: ignore[union-attr]
+            )
+            for content in contents
+        ],
+        dtype=TRACE_DTYPE,
+    )
+    return records.tobytes()
+
+
+def _append(filename: str, data: bytes, header: bytes = b""):
+    """Appends the data to the file.
+
+    The file is opened in append mode so that a flush never rewrites previously
+    stored records, and whole records are written so a reader only ever sees a
+    truncated record at the very end of the file. The header is only written
+    when the file is created.
+    """
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        if header and os.fstat(fd).st_size == 0:
+            data = header + data
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+
+def read_jsonl(filename: str) -> Iterator[Dict]:
+    """Iterates over the records of a trace file, skipping the malformed lines and
+    a truncated last line"""
+    with open(filename, "r", encoding="utf-8") as fid:
+        for number, line in enumerate(fid, 1):
+            if not line.endswith("\n"):
+                # Partially written record of a process that was killed mid-flush
+                break
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning("Skipping malformed record at %s:%d", filename, number)
+
+
+def read_records(filename: str) -> numpy.ndarray:
+    """Memory-maps the records of a columnar trace file.
+
+    A trailing partial record, left by a process killed mid-flush, is ignored.
+    """
+    with open(filename, "rb") as fid:
+        magic = fid.read(len(RECORDS_MAGIC))
+        if magic != RECORDS_MAGIC:
+            raise ValueError(f"{filename} is not a QStone trace file")
+        (length,) = struct.unpack("<I", fid.read(4))
+        descr = json.loads(fid.read(length))
+    dtype = numpy.dtype([tuple(field) for field in descr])
+    offset = len(RECORDS_MAGIC) + 4 + length
+    count = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if count <= 0:
+        return numpy.empty(0, dtype=dtype)
+    return numpy.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+class TraceBuffer:
+    """In-memory buffer of trace records, flushed in bulk to one append-only
+    file per process and profile folder.
+
+    The buffer is flushed when it holds `max_records` records, at interpreter
+    exit and on SIGTERM (e.g. scheduler walltime), so that a job that is killed
+    does not lose the traces collected so far. Records are stored as JSONL or,
+    when `TRACE_FORMAT` is `records`, as fixed-layout binary records that the
+    profiler can memory-map.
+
+    Args:
+        max_records: number of buffered records that triggers a flush
+    """
+
+    def __init__(self, max_records: int = TRACE_BUFFER_SIZE):
+        self._max_records = max(1, max_records)
+        self._records: Dict[str, List[dict]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._hooks_installed = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, profile_path: str, content: dict):
+        """Buffers a trace record destined to the given profile folder"""
+        if not self._hooks_installed:
+            self._install_hooks()
+        with self._lock:
+            self._records.setdefault(profile_path, []).append(content)
+            self._count += 1
+            full = self._count >= self._max_records
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes all the buffered records to disk"""
+        with self._lock:
+            records, self._records, self._count = self._records, {}, 0
+        if not records:
+            return
+        fmt = trace_format()
+        for profile_path, contents in records.items():
+            filename = trace_filename(profile_path, fmt)
+            if fmt == "records":
+                _append(filename, _encode_records(contents), _records_header())
+            else:
+                lines = [json.dumps(c, ensure_ascii=False) for c in contents]
+                _append(filename, ("\n".join(lines) + "\n").encode())
+
+    def _reset(self):
+        """Drops the records inherited from the parent after a fork"""
+        self._lock = threading.Lock()
+        self._records = {}
+        self._count = 0
+
+    def _on_signal(self, signum, _frame):
+        self.flush()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    def _install_hooks(self):
+        self._hooks_installed = True
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self._reset)
+        # Signal handlers can only be set from the main thread, and we never
+        # override a handler installed by the application.
+        if threading.current_thread() is threading.main_thread():
+            if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+                signal.signal(signal.SIGTERM, self._on_signal)
+
+
+TRACE_BUFFER = TraceBuffer()
+
+
+def flush_traces():
+    """Flushes the traces buffered by the current process"""
+    TRACE_BUFFER.flush()
@@ -1,12 +1,10 @@
 """General utilities. Used across the jobs"""
 
 import json
-import os
 import random
 import re
 import time
 from enum import Enum
-from functools import wraps
 from typing import Callable, Dict, Optional
 
 import jsonschema
@@ -14,6 +12,16 @@ import pandas as pd
 import pandera.pandas as pa
 
 from .config_schema import FULL_SCHEMA
+from .metrics import METRICS_PUSHER
+from .tracing import (
+    CURRENT_SPAN,
+    PROCESS_INFO,
+    RESOURCE_PROBE,
+    TRACE_BUFFER,
+    TRACE_CONFIG,
+    new_span_id,
+    register_trace_site,
+)
 
 
 class JobReturnCode(Enum):
@@ -33,6 +41,8 @@ class ComputationStep(Enum):
     RUN = "RUN"
     POST = "POST"
     QUERY = "QUERY"
+    # Task of a job run by a pilot: queued and executing
+    TASK = "TASK"
 
 
 CFG_ENVIRONMENT_VARIABLES = {
@@ -145,7 +155,7 @@ def qasm_circuit_random_sample(qasm: str, repetitions: int) -> Dict:
 
 def _get_job_id():
     """Returns the job id from the tool"""
-    return os.environ["JOB_ID"]
+    return TRACE_CONFIG.job_id
 
 
 def _get_content(
@@ -154,18 +164,34 @@ def _get_content(
     computation_step: ComputationStep,
     label: Optional[str],
     success: bool,
+    span: tuple[int, int] = (0, 0),
+    weight: float = 1.0,
+    usage: Optional[dict] = None,
 ):
     """Returns the dictionary that represents the time trace datapoint"""
     content = {}
-    content["user"] = os.environ["QS_USER"]
-    content["prog_id"] = os.environ["PROG_ID"]
+    content["user"] = TRACE_CONFIG.user
+    content["prog_id"] = TRACE_CONFIG.prog_id
     content["job_id"] = _get_job_id()
     content["job_type"] = computation_type
     content["job_step"] = computation_step.value
+    content["qubits"] = TRACE_CONFIG.qubits  # type: ignore[assignment]
+    content["shots"] = TRACE_CONFIG.shots  # type: ignore[assignment]
     content["label"] = label  # type: ignore[assignment]
     content["start"] = times[0]  # type: ignore[assignment]
     content["end"] = times[1]  # type: ignore[assignment]
     content["success"] = success  # type: ignore[assignment]
+    # Start and end are read from the performance counter of the process, the
+    # offset places them on the wall clock shared by all the hosts.
+    content["host"] = PROCESS_INFO.host
+    content["pid"] = PROCESS_INFO.pid  # type: ignore[assignment]
+    content["clock_offset"] = PROCESS_INFO.clock_offset  # type: ignore[assignment]
+    # Id of the span and of the traced call it is nested in (0 for none)
+    content["span_id"], content["parent_id"] = span  # type: ignore[assignment]
+    # Number of calls accounted for by this trace when its label is sampled
+    content["weight"] = weight  # type: ignore[assignment]
+    # CPU, context switches, I/O and peak RSS of the call, when captured
+    content.update(usage or {})
     return content
 
 
@@ -174,69 +200,110 @@ def _write_trace(
     times: tuple[int, int],
     computation_type: str,
     computation_step: ComputationStep,
-    label: str,
+    label: Optional[str],
     success: bool,
+    span: tuple[int, int] = (0, 0),
+    weight: float = 1.0,
+    usage: Optional[dict] = None,
 ):
-    """Handler for trace writing"""
+    """Handler for trace writing. Records are buffered and flushed in bulk"""
+    trace_content = _get_content(
+        times, computation_type, computation_step, label, success, span, weight, usage
+    )
+    TRACE_BUFFER.append(profile_path, trace_content)
+    if TRACE_CONFIG.metrics:
+        METRICS_PUSHER.span_ended(
+            TRACE_CONFIG.metrics, trace_content, TRACE_CONFIG.connector
+        )
+
+
+def trace_span(
+    times: tuple[int, int],
+    computation_type: str,
+    computation_step: ComputationStep,
+    label: Optional[str] = None,
+    success: bool = True,
+    logging_level: int = 2,
+    **job,
+):
+    """Records a span timed outside of a traced call, e.g. by a pilot for each of
+    the tasks it runs. The job settings given (job_id, qubits, shots) replace
+    those of the process.
+
+    Args:
+        times: start and end of the span, from `time.perf_counter_ns`
+        computation_type: type of the job
+        computation_step: step of the job
+        label: name of the span
+        success: whether the span completed
+        logging_level: level at which the span is recorded
+    """
+    if not TRACE_CONFIG.enabled(logging_level):
+        return
     trace_content = _get_content(
-        times, computation_type, computation_step, label, success
+        times, computation_type, computation_step, label, success, (new_span_id(), 0)
     )
-    with open(profile_path, "w", encoding="utf-8") as fid:
-        json.dump(trace_content, fid, ensure_ascii=False, indent=4)
+    trace_content.update(job)
+    TRACE_BUFFER.append(TRACE_CONFIG.profile_path, trace_content)  # type: ignore[arg-type]
 
 
 def trace(
     computation_type: str,
     computation_step: ComputationStep,
     label: Optional[str] = None,
-    logging_level: Optional[int] = 2,
+    logging_level: int = 2,
 ):
-    """General tracing of the function. Wrapper"""
+    """General tracing of the function. Wrapper
+
+    The trace settings are read once per process. When the logging level of the
+    function is disabled the function is left unwrapped, see `reconfigure` to
+    change the settings at runtime. Calls are sampled as set for their label,
+    and their resource usage recorded when `TRACE_RESOURCES` is set. Spans are
+    pushed to the metrics aggregator when `TRACE_METRICS` is set.
+    """
 
     def wrapper(func: Callable):
-        @wraps(func)
-        def wrapper_func(*args, **kwargs):
-            logging_level_met = logging_level >= int(
-                os.environ.get("APP_LOGGING_LEVEL", "0")
-            )
-            start = time.perf_counter_ns()
-            profile_name = "_".join(
-                filter(
-                    None,
-                    (
-                        "job",
-                        _get_job_id(),
-                        computation_step.value,
-                        computation_type,
-                        label,
-                        str(start),
-                    ),
+        def traced_call(weight: float, args: tuple, kwargs: dict):
+            # Nested traced calls record this call as their parent
+            span = (new_span_id(), CURRENT_SPAN.get())
+            token = CURRENT_SPAN.set(span[0])
+            if TRACE_CONFIG.metrics:
+                METRICS_PUSHER.span_started(
+                    TRACE_CONFIG.metrics,
+                    computation_type,
+                    computation_step.value,
+                    label,
+                    span,
                 )
-            )
-            profile_path = os.path.join(
-                os.environ["PROFILE_PATH"], f"{profile_name}.json"
-            )
+            success = False
+            resources = TRACE_CONFIG.resources
+            before = RESOURCE_PROBE.snapshot() if resources else ()
+            start = time.perf_counter_ns()
             try:
                 result = func(*args, **kwargs)
                 success = True
-            except Exception as e:  # pylint: disable=broad-except
-                result = None
-                success = False
-                raise e
             finally:
                 end = time.perf_counter_ns()
-                if logging_level_met:
-                    _write_trace(
-                        profile_path,
-                        (start, end),
-                        computation_type,
-                        computation_step,
-                        label,
-                        success,
-                    )
+                usage = (
+                    RESOURCE_PROBE.usage(before, RESOURCE_PROBE.snapshot())
+                    if resources
+                    else None
+                )
+                CURRENT_SPAN.reset(token)
+                _write_trace(
+                    TRACE_CONFIG.profile_path,  # type: ignore[arg-type]
+                    (start, end),
+                    computation_type,
+                    computation_step,
+                    label,
+                    success,
+                    span,
+                    weight,
+                    usage,
+                )
             return result
 
-        return wrapper_func
+        return register_trace_site(func, traced_call, logging_level, label)
 
     return wrapper
 
@@ -0,0 +1,289 @@
+"""Node-local pool of warm workers running the steps of the jobs.
+
+Starting a step in a fresh interpreter imports the computations and connectors,
+which takes seconds. The worker imports them once and forks a child per step,
+which runs with the environment, working directory, stdout and stderr of the
+`jobs.py` call that handed the step over, so that the time traced for a step is
+that of the computation.
+"""
+
+# The heavy modules are only imported by the worker, not by the jobs handing
+# their steps over to it.
+# pylint: disable=import-outside-toplevel
+
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import traceback
+from typing import Optional
+
+STEPS = ("pre", "run", "post", "full")
+# Period at which the worker reaps the finished steps and checks whether it is stopped
+ACCEPT_TIMEOUT = 0.2
+# Time a step waits for the request of the caller, in seconds
+REQUEST_TIMEOUT = 10.0
+BACKLOG = 64
+
+
+def run_step(step: str, src: str, cfg: str):
+    """Runs a step of a computation in the current process
+
+    Args:
+        step: pre, run, post, or full for the three of them
+        src: name of the computation in the registry, or module.class
+        cfg: configuration of the computation, as JSON
+    """
+    from qstone.apps import ENV_VARS, get_computation_src
+    from qstone.connectors import connector
+
+    computation_src = get_computation_src(src)(json.loads(cfg))
+    if step in ("pre", "full"):
+        computation_src.pre(ENV_VARS["OUTPUT_PATH"])
+    if step in ("run", "full"):
+        computation_src.run(
+            ENV_VARS["OUTPUT_PATH"],
+            connector.Connector(
+                ENV_VARS["CONNECTIVITY_MODE"],  # type: ignore [arg-type]
+                ENV_VARS["QPU_MODE"],  # type: ignore [arg-type]
+                ENV_VARS["CONNECTIVITY_QPU_IP_ADDRESS"],  # type: ignore [arg-type]
+                ENV_VARS["CONNECTIVITY_QPU_PORT"],  # type: ignore [arg-type]
+                ENV_VARS["CONNECTIVITY_COMPILER_IP_ADDRESS"],  # type: ignore [arg-type]
+                ENV_VARS["CONNECTIVITY_COMPILER_PORT"],  # type: ignore [arg-type]
+                ENV_VARS["CONNECTIVITY_TARGET"],  # type: ignore [arg-type]
+                ENV_VARS["LOCKFILE"],  # type: ignore [arg-type]
+            ),
+        )
+    if step in ("post", "full"):
+        computation_src.post(ENV_VARS["OUTPUT_PATH"])
+
+
+def submit_step(address: str, step: str, src: str, cfg: str) -> int:
+    """Hands a step over to the worker listening on a Unix socket, with the
+    environment, working directory, stdout and stderr of the caller, and waits
+    for it to end.
+
+    Args:
+        address: path of the socket of the worker
+        step: pre, run, post or full
+        src: name of the computation
+        cfg: configuration of the computation, as JSON
+
+    Returns the exit code of the step
+
+    Raises:
+        ConnectionError: no worker is listening on the socket
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError as exc:
+        sock.close()
+        raise ConnectionError(f"No worker listening on {address}") from exc
+    request = {
+        "step": step,
+        "src": src,
+        "cfg": cfg,
+        "env": dict(os.environ),
+        "cwd": os.getcwd(),
+        "path": sys.path,
+    }
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with sock:
+        socket.send_fds(sock, [b"\0"], [sys.stdout.fileno(), sys.stderr.fileno()])
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as reply:
+            code = reply.readline().strip()
+    # The step died without replying
+    return int(code) if code else 1
+
+
+def _setup_step(request: dict, fds: list):
+    """Gives the forked step the context of the caller"""
+    os.dup2(fds[0], sys.stdout.fileno())
+    os.dup2(fds[1], sys.stderr.fileno())
+    for fd in fds:
+        os.close(fd)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.path[:] = request["path"]
+    # Steps would otherwise all draw the random numbers of the worker
+    random.seed()
+    import numpy
+
+    from qstone import apps
+    from qstone.utils.tracing import reconfigure
+
+    numpy.random.seed()
+    apps.ENV_VARS.update(apps.load_env_vars())
+    reconfigure()
+
+
+def _read_request(conn: socket.socket) -> tuple[dict, list]:
+    """Reads the stdout and stderr of the caller and the step it requests
+
+    Raises:
+        ValueError: malformed request
+        OSError: the caller did not send it in time
+    """
+    conn.settimeout(REQUEST_TIMEOUT)
+    _, fds, _, _ = socket.recv_fds(conn, 1, 2)
+    with conn.makefile("rb") as lines:
+        line = lines.readline()
+    try:
+        request = json.loads(line)
+    except ValueError:
+        request = {}
+    if request.get("step") not in STEPS or len(fds) != 2:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError("Malformed step request")
+    conn.settimeout(None)
+    return request, fds
+
+
+def _kill_on_hangup(conn: socket.socket):
+    """Kills the step when the caller goes away, e.g. when its job is cancelled,
+    as the step does not run in the process tree of the job"""
+
+    def watch():
+        try:
+            hangup = not conn.recv(1)
+        except OSError:
+            hangup = True
+        if hangup:
+            os.kill(os.getpid(), signal.SIGKILL)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def _run_forked(conn: socket.socket):
+    """Runs the step requested on the connection in the forked child and replies
+    with its exit code"""
+    try:
+        request, fds = _read_request(conn)
+    except (OSError, ValueError):
+        logging.warning("Ignoring malformed step request")
+        os._exit(1)  # pylint: disable=protected-access
+    _kill_on_hangup(conn)
+    code = 1
+    try:
+        _setup_step(request, fds)
+        run_step(request["step"], request["src"], request["cfg"])
+        code = 0
+    except BaseException:  # pylint: disable=broad-exception-caught
+        traceback.print_exc()
+    finally:
+        try:
+            from qstone.utils.tracing import flush_traces
+
+            flush_traces()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(f"{code}\n".encode())
+        finally:
+            os._exit(code)  # pylint: disable=protected-access
+
+
+class WorkerServer:
+    """
+    Forkserver of the steps of the jobs of a node: imports the computations and
+    connectors once, then forks a child per step handed over on its Unix socket.
+
+    Args:
+        listen: path of the Unix socket, as set in `worker_socket`
+    """
+
+    def __init__(self, listen: str):
+        self._listen = listen
+        if os.path.exists(listen):
+            os.unlink(listen)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the user running the worker may hand steps over to it
+        umask = os.umask(0o077)
+        try:
+            self._socket.bind(listen)
+        finally:
+            os.umask(umask)
+        self._socket.listen(BACKLOG)
+        self._socket.settimeout(ACCEPT_TIMEOUT)
+        self._children: set[int] = set()
+
+    @staticmethod
+    def preload():
+        """Imports the computations and connections inherited by all the steps"""
+        from qstone.apps import load_computations
+        from qstone.connectors.connector import load_connections
+
+        load_computations()
+        load_connections()
+
+    def _reap(self):
+        """Collects the steps that ended"""
+        while self._children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            self._children.discard(pid)
+
+    def _fork(self, conn: socket.socket):
+        """Forks a child running the step requested on the connection. The
+        request is read by the child, so that a slow caller does not hold up
+        the others."""
+        pid = os.fork()
+        if pid == 0:
+            self._socket.close()
+            _run_forked(conn)
+        self._children.add(pid)
+
+    def serve(self, stopped: Optional[threading.Event] = None):
+        """Runs the steps handed over until stopped"""
+        stopped = stopped or threading.Event()
+        while not stopped.is_set():
+            self._reap()
+            try:
+                conn, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                try:
+                    self._fork(conn)
+                except OSError:
+                    logging.warning("Failed to fork a step")
+
+    def close(self):
+        """Stops listening, the running steps are left to complete"""
+        self._socket.close()
+        if os.path.exists(self._listen):
+            os.unlink(self._listen)
+
+    def __enter__(self) -> "WorkerServer":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def serve(listen: str):
+    """Runs the worker until interrupted
+
+    Args:
+        listen: path of the Unix socket the jobs hand their steps over to
+    """
+    WorkerServer.preload()
+    with WorkerServer(listen) as server:
+        logging.info("Running the steps handed over on %s", listen)
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
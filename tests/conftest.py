@@ -0,0 +1,48 @@
+"""Fixtures shared by the tests"""
+
+import glob
+import os
+
+import pytest
+
+from qstone.utils.tracing import flush_traces, read_jsonl
+
+
+def pytest_addoption(parser):
+    """Adds the option running the benchmarks"""
+    parser.addoption(
+        "--benchmark", action="store_true", help="run the timing benchmarks"
+    )
+
+
+def pytest_configure(config):
+    """Registers the marker of the benchmarks"""
+    config.addinivalue_line(
+        "markers", "benchmark: timing benchmark, only run with --benchmark"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skips the benchmarks, whose timings depend on the machine, by default"""
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture()
+def get_traces():
+    """Fixture returning a function that flushes the trace buffer and returns
+    all the records stored in a folder"""
+
+    def _get_traces(path):
+        flush_traces()
+        return [
+            record
+            for trace_file in glob.glob(os.path.join(path, "*.jsonl"))
+            for record in read_jsonl(trace_file)
+        ]
+
+    return _get_traces
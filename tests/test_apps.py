@@ -3,7 +3,6 @@
 import os
 import shutil
 
-import glob
 import numpy as np
 import pytest
 import importlib
@@ -12,31 +11,33 @@ import functools
 from qstone.connectors import connector
 from qstone.apps import get_computation_src
 from qstone.generators.generator import _to_bytes
+from qstone.utils.tracing import reconfigure
 
 DEFAULT_CONNECTOR = connector.Connector(
     connector.ConnectorType.NO_LINK, "RANDOM", "0", "0", "0", "0", "QPU0", None
 )
 
 
-def _get_file(regex):
-    return glob.glob(regex)[0]
-
-
 @pytest.fixture()
-def env(tmp_path):
+def env(tmp_path, monkeypatch):
     """Fixture to set environment variables"""
-    os.environ["JOB_ID"] = "test"
-    os.environ["PROG_ID"] = "test"
-    os.environ["QS_USER"] = "test"
-    os.environ["PROFILE_PATH"] = str(tmp_path.absolute())
-    os.environ["OUTPUT_PATH"] = str(tmp_path.absolute())
-    os.environ["NUM_QUBITS"] = "2"
-    os.environ["NUM_SHOTS"] = "12"
-    os.environ["CONNECTIVITY_QPU_MODE"] = "RANDOM"
-    os.environ["CONNECTIVITY_TARGET"] = "QPU0"
-    os.environ["APP_ARGS"] = (
-        "gASVOwAAAAAAAAB9lCiMC2Fub3RoZXJfb25llF2UKIwEYmxhaJSMBWJsYWgylGWMBGhlbHCUfZSMBmhlbHBtZZRLBXN1Lg=="
+    monkeypatch.setenv("JOB_ID", "test")
+    monkeypatch.setenv("PROG_ID", "test")
+    monkeypatch.setenv("QS_USER", "test")
+    monkeypatch.setenv("PROFILE_PATH", str(tmp_path.absolute()))
+    monkeypatch.setenv("OUTPUT_PATH", str(tmp_path.absolute()))
+    monkeypatch.setenv("NUM_QUBITS", "2")
+    monkeypatch.setenv("NUM_SHOTS", "12")
+    monkeypatch.setenv("CONNECTIVITY_QPU_MODE", "RANDOM")
+    monkeypatch.setenv("CONNECTIVITY_TARGET", "QPU0")
+    monkeypatch.setenv(
+        "APP_ARGS",
+        "gASVOwAAAAAAAAB9lCiMC2Fub3RoZXJfb25llF2UKIwEYmxhaJSMBWJsYWgylGWMBGhlbHCUfZSMBmhlbHBtZZRLBXN1Lg==",
     )
+    reconfigure()
+    yield
+    monkeypatch.undo()
+    reconfigure()
 
 
 def skip_if_package_missing(package_name):
@@ -71,27 +72,30 @@ def skip_if_package_missing(package_name):
     return decorator
 
 
-def test_app_logs_failures(tmp_path, env):
+def test_app_logs_failures(tmp_path, env, get_traces):
+    compute_src = get_computation_src("RB").from_json()
     with pytest.raises(Exception) as e_info:
-        compute_src = get_computation_src("RB").from_json()
         # This should fail due to the lack of npz file
-        profile_file = os.path.join(tmp_path, "job_test_POST_RB*.json")
         compute_src.post(tmp_path)
-        print(os.listdir(tmp_path))
-        with open(_get_file(profile_file), "r") as fir:
-            assert '"success": false' in fir.read()
+    traces = get_traces(tmp_path)
+    assert any(
+        t["job_step"] == "POST" and t["job_type"] == "RB" and not t["success"]
+        for t in traces
+    )
 
 
-def test_pre_RB(tmp_path, env):
+def test_pre_RB(tmp_path, env, get_traces):
     tmp_path.mkdir(exist_ok=True)
     run_file = tmp_path / "RB_run_test.npz"
     compute_src = get_computation_src("RB").from_json()
     compute_src.pre(tmp_path)
 
-    # Check profile file
-    profile_file = os.path.join(tmp_path, "job_test_PRE_RB*.json")
-    with open(_get_file(profile_file), "r") as fir:
-        assert '"success": true' in fir.read()
+    # Check profile traces
+    traces = get_traces(tmp_path)
+    assert any(
+        t["job_step"] == "PRE" and t["job_type"] == "RB" and t["success"]
+        for t in traces
+    )
     # Check generated file
     vals = np.load(run_file)
 
@@ -195,9 +199,9 @@ def test_call_post_QBC(tmp_path, env):
     assert os.path.exists(data_path)
 
 
-def test_pre_custom_app(tmp_path, env):
+def test_pre_custom_app(tmp_path, env, monkeypatch):
     """capability to call custom application"""
-    os.environ["APP_ARGS"] = _to_bytes({"content": "5"})
+    monkeypatch.setenv("APP_ARGS", _to_bytes({"content": "5"}))
     compute_src = get_computation_src("tests.data.apps.custom1.Custom1").from_json()
     compute_src.pre(tmp_path)
     assert os.path.exists(os.path.join(tmp_path, "pre.txt"))
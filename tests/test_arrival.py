@@ -0,0 +1,105 @@
+"""Tests for the arrival processes of the generated jobs"""
+
+import jsonschema
+import numpy
+import pytest
+
+from qstone.generators.arrival import CLOSED_LOOP, OPEN_LOOP, arrival_times
+from qstone.utils.config_schema import FULL_SCHEMA
+from qstone.utils.utils import parse_json
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    """Fixture to draw the same arrivals on every run"""
+    numpy.random.seed(0)
+
+
+def test_back_to_back():
+    """Test the jobs run back-to-back without an arrival model"""
+    assert arrival_times(None, 10) == (CLOSED_LOOP, None)
+    assert arrival_times(float("nan"), 10) == (CLOSED_LOOP, None)
+
+
+def test_poisson():
+    """Test Poisson releases are increasing at the target rate"""
+    loop, times = arrival_times({"model": "poisson", "rate": 4}, 10000)
+    assert loop == OPEN_LOOP
+    assert len(times) == 10000
+    assert (numpy.diff(times) > 0).all()
+    assert len(times) / times[-1] == pytest.approx(4, rel=0.05)
+
+
+def test_mmpp_is_bursty():
+    """Test the gaps of an MMPP vary more than those of a Poisson process"""
+    cfg = {"model": "mmpp", "rates": [0.1, 10], "durations": [100, 10]}
+    loop, times = arrival_times(cfg, 5000)
+    gaps = numpy.diff(times)
+    assert loop == OPEN_LOOP and len(times) == 5000
+    assert (gaps >= 0).all()
+    # The coefficient of variation of exponential gaps is 1
+    assert gaps.std() / gaps.mean() > 2
+
+
+def test_diurnal():
+    """Test the releases follow the cycle of the rate"""
+    cfg = {"model": "diurnal", "rate": 1, "amplitude": 0.9, "period": 1000}
+    loop, times = arrival_times(cfg, 20000)
+    assert loop == OPEN_LOOP and len(times) == 20000
+    assert (numpy.diff(times) >= 0).all()
+    phases = (times % 1000) / 1000
+    # The rate peaks in the first half of the period and is lowest in the second
+    assert (phases < 0.5).sum() > 3 * (phases >= 0.5).sum()
+
+
+@pytest.mark.parametrize(
+    "cfg,mean",
+    [
+        ({"distribution": "constant", "mean": 2}, 2),
+        ({"distribution": "exponential", "mean": 2}, 2),
+        ({"distribution": "uniform", "low": 1, "high": 3}, 2),
+        ({"distribution": "lognormal", "mean": 2, "sigma": 0.5}, 2),
+    ],
+)
+def test_think_times(cfg, mean):
+    """Test the think times are drawn from the distribution"""
+    loop, times = arrival_times({"model": "think", **cfg}, 20000)
+    assert loop == CLOSED_LOOP
+    assert (times >= 0).all()
+    assert times.mean() == pytest.approx(mean, rel=0.05)
+
+
+def test_unknown_model():
+    """Test a misconfigured model is reported"""
+    with pytest.raises(ValueError):
+        arrival_times({"model": "closed_form"}, 10)
+    with pytest.raises(ValueError):
+        arrival_times({"model": "think", "distribution": "pareto"}, 10)
+
+
+def test_mmpp_without_arrivals():
+    """Test an MMPP whose rates are all zero is reported rather than drawn forever"""
+    cfg = {"model": "mmpp", "rates": [0, 0], "durations": [1, 1]}
+    with pytest.raises(ValueError):
+        arrival_times(cfg, 10)
+    with pytest.raises(ValueError):
+        arrival_times({**cfg, "rates": [1]}, 10)
+    with pytest.raises(ValueError):
+        arrival_times({"model": "diurnal", "rate": 1, "amplitude": 2}, 10)
+
+
+@pytest.mark.parametrize(
+    "arrival",
+    [
+        {"model": "poisson", "rate": 0},
+        {"model": "diurnal", "rate": -1},
+        {"model": "mmpp", "rates": [-1, 1], "durations": [1, 1]},
+        {"model": "mmpp", "rates": [0, 1], "durations": [0, 1]},
+    ],
+)
+def test_invalid_arrivals_rejected_by_schema(arrival):
+    """Test the configuration schema rejects rates and durations out of range"""
+    config = parse_json("tests/data/generator/config_arrival.json")
+    config["users"][0]["arrival"] = arrival
+    with pytest.raises(jsonschema.ValidationError):
+        jsonschema.validate(config, FULL_SCHEMA)
@@ -0,0 +1,62 @@
+"""Tests for the Trace Event Format export"""
+
+import json
+
+import pandas as pd
+
+from qstone.profiling import profile
+from qstone.profiling.chrome import ChromeTraceWriter
+from qstone.profiling.store import ProfileStore
+
+
+def _traces(user):
+    """A job calling the connector, traced by one process"""
+    df = pd.DataFrame(
+        {
+            "job_type": ["VQE", "CONNECTION"],
+            "job_step": ["RUN", "RUN"],
+            "label": [None, "_request_and_process"],
+            "start": [1000, 2000],
+            "end": [9000, 5000],
+            "span_id": [1, 2],
+            "parent_id": [0, 1],
+        }
+    )
+    return df.assign(
+        user=user, prog_id="0", job_id="1", success=True, host="node0", pid=10
+    )
+
+
+def test_export_chrome(tmp_path):
+    """Test each job is a track of its host with its spans as nested slices"""
+    store = ProfileStore(str(tmp_path / "store"))
+    store.append(pd.concat([_traces("user0"), _traces("user1")]), "run")
+    output = str(tmp_path / "trace.json")
+    assert profile.export_chrome(store.path, output) == 7
+    with open(output, encoding="utf-8") as fid:
+        events = json.load(fid)["traceEvents"]
+    slices = [e for e in events if e["ph"] == "X"]
+    assert len(slices) == 4
+    assert {e["pid"] for e in slices} == {1}
+    assert len({e["tid"] for e in slices}) == 2
+    run, connection = slices[:2]
+    assert run["name"] == "VQE.RUN" and run["ts"] == 1 and run["dur"] == 8
+    assert connection["name"] == "CONNECTION.RUN:_request_and_process"
+    assert connection["tid"] == run["tid"]
+    names = {e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert names == {
+        "node0",
+        "user0 prog 0 job 1 (pid 10)",
+        "user1 prog 0 job 1 (pid 10)",
+    }
+
+
+def test_export_is_streamed(tmp_path):
+    """Test successive writes append to one valid document"""
+    output = str(tmp_path / "trace.json")
+    with ChromeTraceWriter(output) as writer:
+        for user in ["user0", "user1"]:
+            writer.write(profile._align_clocks(_traces(user)))
+        writer.write(profile._align_clocks(_traces("user0").iloc[:0]))
+    with open(output, encoding="utf-8") as fid:
+        assert len(json.load(fid)["traceEvents"]) == writer.events == 7
@@ -16,6 +16,7 @@ import qstone.connectors.http.runner as http_client
 # For GRPC connectors
 import tests.mocks.grpc.server as grpc_server
 from qstone.connectors.no_link import no_link
+from qstone.utils.tracing import reconfigure
 
 # For Rigetti connectors
 from qstone.connectors.backends.rigetti import runner as rigetti
@@ -26,21 +27,25 @@ def _get_file(regex):
 
 
 @pytest.fixture()
-def env(tmp_path):
+def env(tmp_path, monkeypatch):
     """Connector environment variables setup"""
-    os.environ["USER"] = "test"
-    os.environ["JOB_ID"] = "test"
-    os.environ["QS_USER"] = "test"
-    os.environ["PROG_ID"] = "test"
-    os.environ["OUTPUT_PATH"] = str(tmp_path)
-    os.environ["PROFILE_PATH"] = str(tmp_path)
-    os.environ["TIMEOUTS_LOCK"] = "1"
-    os.environ["TIMEOUTS_HTTP"] = "1"
-    os.environ["TARGET"] = "QPU0"
-    os.environ["MODE"] = "RANDOM"
-
-
-def test_no_link_run(tmp_path, env):
+    monkeypatch.setenv("USER", "test")
+    monkeypatch.setenv("JOB_ID", "test")
+    monkeypatch.setenv("QS_USER", "test")
+    monkeypatch.setenv("PROG_ID", "test")
+    monkeypatch.setenv("OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setenv("PROFILE_PATH", str(tmp_path))
+    monkeypatch.setenv("TIMEOUTS_LOCK", "1")
+    monkeypatch.setenv("TIMEOUTS_HTTP", "1")
+    monkeypatch.setenv("TARGET", "QPU0")
+    monkeypatch.setenv("MODE", "RANDOM")
+    reconfigure()
+    yield
+    monkeypatch.undo()
+    reconfigure()
+
+
+def test_no_link_run(tmp_path, env, get_traces):
     """Test that no link connection runs without error code"""
     mock_circuit = tmp_path / "circuit.qasm"
     with open(mock_circuit, "w", encoding="utf-8") as fid:
@@ -57,9 +62,11 @@ def test_no_link_run(tmp_path, env):
 
     # Assert number of readout results is equal to the number of repetitions
     assert len(result["measurements"]) == reps
-    # Check that profile file exists
-    output_path = os.path.join(tmp_path, "job_test_POST_CONNECTION*.json")
-    assert os.path.isfile(_get_file(output_path))
+    # Check that profile traces exist
+    traces = get_traces(tmp_path)
+    assert any(
+        t["job_step"] == "POST" and t["job_type"] == "CONNECTION" for t in traces
+    )
 
 
 def test_grpc_run(tmp_path, env):
@@ -99,7 +106,9 @@ def text_callback(request, context):
         ("test.com", 200, "anywhere.lock", False, None),
     ],
 )
-def test_http(tmp_path, env, capsys, mocker, http, retcode, lock, locked, expected):
+def test_http(
+    tmp_path, env, capsys, mocker, http, retcode, lock, locked, expected, get_traces
+):
     """Test that http connection runs without error code"""
 
     mock_circuit = tmp_path / "circuit.qasm"
@@ -140,15 +149,14 @@ def test_http(tmp_path, env, capsys, mocker, http, retcode, lock, locked, expect
 
         if expected:
             assert result["11"] == expected
-        # Check that profile file exists and contains the custom label
-        profile_trace = os.path.join(
-            tmp_path, "job_test_RUN_CONNECTION__request_and_process_*.json"
+        # Check that profile traces exist and contain the custom label
+        traces = get_traces(tmp_path)
+        assert any(
+            t["job_step"] == "RUN"
+            and t["job_type"] == "CONNECTION"
+            and t["label"] == "_request_and_process"
+            for t in traces
         )
-        assert os.path.isfile(_get_file(profile_trace))
-        if not locked:
-            with open(_get_file(profile_trace), "r", encoding="utf-8") as fid:
-                content = fid.read()
-                assert '"label": "_request_and_process"' in content
 
 
 def test_rigetti_run(tmp_path, env, mocker):
@@ -1,6 +1,8 @@
 """Tests for scheduler and job generation"""
 
-import importlib
+import gzip
+import importlib.util
+import json
 import os
 import shutil
 import subprocess
@@ -13,11 +15,11 @@ from pytest_mock import mocker
 import tests.mocks.lsf_jsrun.scheduler as jsrun_scheduler
 from qstone.connectors.connector import ConnectorType
 from qstone.generators import generator
+from qstone.utils.tracing import read_jsonl
 from qstone.utils.utils import parse_json
 from qstone.apps import PyMatching
 from qstone.utils.utils import JobReturnCode, QpuConfiguration
 
-
 SCHED_EXT = {"slurm": "sbatch", "jsrun": "bsub", "bare_metal": None}
 
 DEFAULT_CFG = {
@@ -60,6 +62,8 @@ def test_config_checks(tmp_path, test_input):
         ("config_multi.json", ["user0", "user1", "user2"], False, "slurm", False),
         ("config_single.json", ["user0"], True, "jsrun", False),
         ("config_single_scheduler.json", ["user0"], True, "slurm", True),
+        ("config_single_scheduler.json", ["user0"], False, "slurm", True),
+        ("config_single_scheduler.json", ["user0"], False, "jsrun", True),
     ],
 )
 def test_packaging(tmp_path, test_input, expected, atomic, scheduler, use_gres):
@@ -78,10 +82,12 @@ def test_packaging(tmp_path, test_input, expected, atomic, scheduler, use_gres):
         with tarfile.open(filename, "r:gz") as t:
             ext = SCHED_EXT[scheduler]
             if ext:
-                keywords = [
-                    "full" if atomic else "pre",
-                    "--gres=qpu:1" if use_gres else "",
-                ]
+                keywords = ["full" if atomic else "pre"]
+                if use_gres:
+                    # The whole job holds the QPU
+                    directive = {"slurm": "#SBATCH", "jsrun": "#BSUB"}[scheduler]
+                    request = generator.SCHEDULER_QPU_REQUESTS[scheduler]
+                    keywords.append(f"{directive} {request}")
                 content = str(t.extractfile(f"qstone_suite/type_exec_VQE.{ext}").read())
                 assert all(x in content for x in keywords)
 
@@ -160,13 +166,16 @@ def test_logging_level(tmp_path):
     log_dir = os.path.join(tmp_path, "qstone_suite", "qstone_profile")
     # Check that logging filter is applied correctly
     print(f"LOG_DI: {log_dir}")
-    pre_log_file = next((f for f in os.listdir(log_dir) if "PRE_Custom1" in f), None)
-    run_log_file = next((f for f in os.listdir(log_dir) if "RUN_Custom1" in f), None)
-    post_log_file = next((f for f in os.listdir(log_dir) if "POST_Custom1" in f), None)
-    # We set the logging level in a way that Custom1 should only output 2 files.
-    assert pre_log_file is None
-    assert run_log_file is not None
-    assert post_log_file is not None
+    steps = {
+        t["job_step"]
+        for f in os.listdir(log_dir)
+        for t in read_jsonl(os.path.join(log_dir, f))
+        if t["job_type"] == "Custom1"
+    }
+    # We set the logging level in a way that Custom1 should only output 2 steps.
+    assert "PRE" not in steps
+    assert "RUN" in steps
+    assert "POST" in steps
 
 
 @pytest.mark.parametrize(
@@ -200,3 +209,428 @@ def test_jsrun_batch_valid(tmp_path, test_input, usrs):
         assert "jsrun -special_setting=True" in bsub_script
 
         assert scheduler.run(bsub_script)
+
+
+def test_generate_user_jobs_settings():
+    """Test every job gets the settings of its own type, or the defaults."""
+    config = parse_json("tests/data/generator/config_single_logging.json")
+    jobs_cfg = generator.pa.DataFrame(config["jobs"])
+    user = generator.pa.DataFrame(config["users"]).iloc[0]
+    jobs, _ = generator._generate_user_jobs(
+        user, jobs_cfg, generator._compute_job_pdf(user), 50
+    )
+    assert len(jobs) == 50
+    for runner, qubits, job_id, shots, level, args in jobs:
+        if runner.endswith("VQE"):
+            assert (qubits, shots, level, args) == (2, 100, 2, "")
+        else:
+            assert 2 <= qubits < 4 and 2 <= shots < 4
+            assert level == 1 and args
+
+
+def test_generate_user_jobs_seeded():
+    """Test the qubits and shots are drawn as one call per job would draw them."""
+    config = parse_json("tests/data/generator/config_multi.json")
+    jobs_cfg = generator.pa.DataFrame(config["jobs"])
+    user = generator.pa.DataFrame(config["users"]).iloc[2]
+    pdf = generator._compute_job_pdf(user)
+    generator.numpy.random.seed(1)
+    jobs, _ = generator._generate_user_jobs(user, jobs_cfg, pdf, 100)
+    generator.numpy.random.seed(1)
+    job_types = generator.numpy.random.choice(
+        list(user["computations"]), p=pdf, size=100
+    )
+    expected = []
+    for job_type in job_types:
+        if job_type == "VQE":
+            qubits = generator.numpy.random.randint(2, 4)
+            expected.append((qubits, generator.numpy.random.randint(2, 4)))
+        elif job_type == "RB":
+            expected.append((2, generator.numpy.random.randint(2, 4)))
+        else:
+            expected.append((2, 100))
+    assert [(job[1], job[3]) for job in jobs] == expected
+
+
+def test_parallel_generation(tmp_path, monkeypatch):
+    """Test the suites are packed in parallel without staging files in the cwd."""
+    monkeypatch.chdir(tmp_path)
+    config = os.path.join(os.path.dirname(__file__), "data/generator/config_multi.json")
+    members = {}
+    for workers in (1, 3):
+        output_folder = tmp_path / f"workers{workers}"
+        output_folder.mkdir()
+        generator.numpy.random.seed(0)
+        paths = generator.generate_suite(
+            config=config,
+            job_count=10,
+            output_folder=str(output_folder),
+            atomic=False,
+            scheduler="slurm",
+            workers=workers,
+        )
+        assert [os.path.dirname(p) for p in paths] == [str(output_folder)] * 3
+        members[workers] = {}
+        for path in paths:
+            with tarfile.open(path, "r:gz") as tar:
+                members[workers][os.path.basename(path)] = {
+                    m.name: tar.extractfile(m).read() for m in tar if m.isfile()
+                }
+    assert members[1] == members[3]
+    assert not os.path.exists(tmp_path / "qstone_suite")
+    manifest = members[3]["slurm_user0.qstone.tar.gz"]["qstone_suite/jobs.jsonl.gz"]
+    assert len(gzip.decompress(manifest).splitlines()) == 10
+
+
+def _render(users: int):
+    """Renders the slurm templates of the users"""
+    sched = generator.SCHEDULERS["slurm"]
+    sched_path = os.path.join(generator.CURRENT_PATH, sched)
+    jobs_cfg = generator.pa.DataFrame(
+        parse_json("tests/data/generator/config_multi.json")["jobs"]
+    )
+    subs = {
+        "exports": "",
+        "jobs": "",
+        "project_name": "benchmark",
+        "atomic": False,
+        "sched_ext": "sbatch",
+        "sched_cmd": "sbatch",
+        "sched_aware": "",
+    }
+    for _ in range(users):
+        for _ in generator._render_templates(
+            sched, sched_path, subs, ["VQE", "RB"], jobs_cfg
+        ):
+            pass
+    return len(generator._find_files(sched_path)[0])
+
+
+def test_templates_compiled_once(tmp_path, monkeypatch, mocker):
+    """Test the templates are compiled once per process, then loaded from the
+    bytecode cache of the user by the next processes"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    generator._environment.cache_clear()
+    compile_template = mocker.spy(generator.Environment, "compile")
+    templates = _render(10)
+    assert compile_template.call_count == templates
+    assert len(os.listdir(tmp_path / "qstone" / "templates")) == templates
+    # As in a new process
+    generator._environment.cache_clear()
+    _render(10)
+    assert compile_template.call_count == templates
+    generator._environment.cache_clear()
+
+
+def test_template_cache_not_writable(tmp_path, monkeypatch):
+    """Test the temporary folder is used when the user cache cannot be created"""
+    (tmp_path / "file").write_text("")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "file"))
+    generator._environment.cache_clear()
+    assert _render(1)
+    generator._environment.cache_clear()
+
+
+@pytest.mark.benchmark
+def test_render_time_benchmark(tmp_path, monkeypatch):
+    """Rendering time of the suites against the number of users, with a cold and
+    a warm bytecode cache: the compilation is paid once, not per user"""
+    per_user = {}
+    for users in (1, 10, 100):
+        for cache in ("cold", "warm"):
+            if cache == "cold":
+                monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / str(users)))
+            # As in a new process
+            generator._environment.cache_clear()
+            start = time.perf_counter()
+            _render(users)
+            per_user[(users, cache)] = (time.perf_counter() - start) / users
+            print(
+                f"{users:>3} users, {cache} cache: {per_user[(users, cache)]:.4f} s/user"
+            )
+    generator._environment.cache_clear()
+    assert per_user[(1, "warm")] < per_user[(1, "cold")]
+    assert per_user[(100, "cold")] < per_user[(1, "cold")]
+
+
+def test_manifest_resume(tmp_path):
+    """Test the jobs are streamed from the manifest and resumed from an offset."""
+    generator.generate_suite(
+        config="tests/data/generator/config_single.json",
+        job_count=5,
+        output_folder=tmp_path,
+        atomic=False,
+        scheduler="bare_metal",
+    )
+    with tarfile.open(os.path.join(tmp_path, "bare_metal_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+        runner = t.extractfile("qstone_suite/qstone.sh").read()
+        assert runner.count(b"type_exec.py") == 1
+    suite = os.path.join(tmp_path, "qstone_suite")
+    with gzip.open(os.path.join(suite, "jobs.jsonl.gz"), "rt") as manifest:
+        jobs = [json.loads(line) for line in manifest]
+    assert [job[2] for job in jobs] == list(range(5))
+    subprocess.run(["bash", os.path.join(suite, "qstone.sh"), "4"], check=True)
+    with open(os.path.join(suite, "qstone_runs", "manifest.offset")) as progress:
+        assert progress.read() == "5\n"
+    log_dir = os.path.join(suite, "qstone_profile")
+    job_ids = {
+        t["job_id"]
+        for f in os.listdir(log_dir)
+        for t in read_jsonl(os.path.join(log_dir, f))
+    }
+    assert job_ids == {"4"}
+
+
+def test_open_loop_arrivals(tmp_path):
+    """Test jobs are released at their arrival times and overlap in an open loop."""
+    generator.generate_suite(
+        config="tests/data/generator/config_arrival.json",
+        job_count=3,
+        output_folder=tmp_path,
+        atomic=False,
+        scheduler="bare_metal",
+    )
+    with tarfile.open(os.path.join(tmp_path, "bare_metal_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+    suite = os.path.join(tmp_path, "qstone_suite")
+    with open(os.path.join(suite, "qstone.sh")) as runner:
+        assert 'export QS_ARRIVAL="open"' in runner.read()
+    with gzip.open(os.path.join(suite, "jobs.jsonl.gz"), "rt") as manifest:
+        releases = [json.loads(line)[6] for line in manifest]
+    assert releases == sorted(releases) and releases[0] > 0
+    subprocess.run(["bash", os.path.join(suite, "qstone.sh")], check=True)
+    log_dir = os.path.join(suite, "qstone_profile")
+    spans = {}
+    for f in os.listdir(log_dir):
+        for t in read_jsonl(os.path.join(log_dir, f)):
+            start, end = spans.get(t["job_id"], (t["start"], t["end"]))
+            spans[t["job_id"]] = (min(start, t["start"]), max(end, t["end"]))
+    assert len(spans) == 3
+    # Jobs are released at 50 per second, long before the first one is done
+    assert max(start for start, _ in spans.values()) < min(
+        end for _, end in spans.values()
+    )
+    with open(os.path.join(suite, "qstone_runs", "manifest.offset")) as progress:
+        assert progress.read() == "3\n"
+    # Jobs ending out of order only move the offset past the jobs all finished
+    spec = importlib.util.spec_from_file_location(
+        "type_exec", os.path.join(suite, "type_exec.py")
+    )
+    type_exec = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(type_exec)
+    finished = type_exec.Progress(str(tmp_path / "offset"), 3)
+    finished.done(4)
+    assert not os.path.exists(tmp_path / "offset")
+    finished.done(3)
+    assert (tmp_path / "offset").read_text() == "5\n"
+
+
+FAKE_SBATCH = """#!/bin/bash
+# Runs the tasks of an array job one after the other
+last=$(sed -n 's/^#SBATCH --array=0-\\([0-9]*\\)$/\\1/p' "$1")
+for i in $(seq 0 "$last"); do SLURM_ARRAY_TASK_ID=$i bash "$1" || exit 1; done
+"""
+FAKE_SRUN = """#!/bin/bash
+while [[ "$1" == -* ]]; do shift; done
+exec "$@"
+"""
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_slurm_array_jobs(tmp_path, monkeypatch, atomic):
+    """Test one array job is submitted per job type, each task running a job."""
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    for name, script in (("sbatch", FAKE_SBATCH), ("srun", FAKE_SRUN)):
+        (bin_path / name).write_text(script)
+        (bin_path / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    generator.generate_suite(
+        config="tests/data/generator/config_single.json",
+        job_count=4,
+        output_folder=tmp_path,
+        atomic=atomic,
+        scheduler="slurm",
+        array=True,
+    )
+    with tarfile.open(os.path.join(tmp_path, "slurm_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+    suite = os.path.join(tmp_path, "qstone_suite")
+    with gzip.open(os.path.join(suite, "jobs.jsonl.gz"), "rt") as manifest:
+        jobs = [json.loads(line) for line in manifest]
+    counts = {}
+    for job in jobs:
+        counts[job[0]] = counts.get(job[0], 0) + 1
+    for job_type, count in counts.items():
+        with open(os.path.join(suite, f"type_exec_{job_type}.sbatch")) as script:
+            assert f"#SBATCH --array=0-{count - 1}" in script.read()
+        with open(os.path.join(suite, f"tasks_{job_type}.jsonl"), "rb") as tasks:
+            assert len({len(line) for line in tasks}) == 1
+    subprocess.run(["bash", os.path.join(suite, "qstone.sh")], check=True)
+    log_dir = os.path.join(suite, "qstone_profile")
+    traces = [
+        t for f in os.listdir(log_dir) for t in read_jsonl(os.path.join(log_dir, f))
+    ]
+    # Every job ran once with its own settings
+    settings = {t["job_id"]: (t["job_type"], t["qubits"], t["shots"]) for t in traces}
+    assert settings == {str(j[2]): (j[0], j[1], j[3]) for j in jobs}
+    assert "PRE" in {t["job_step"] for t in traces}
+
+
+def test_lsf_array_jobs(tmp_path):
+    """Test the LSF array job is valid and its tasks are indexed from 1."""
+    generator.generate_suite(
+        config="tests/data/generator/config_single.json",
+        job_count=20,
+        output_folder=tmp_path,
+        atomic=False,
+        scheduler="jsrun",
+        array=True,
+    )
+    with tarfile.open(os.path.join(tmp_path, "jsrun_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+    suite = os.path.join(tmp_path, "qstone_suite")
+    with open(os.path.join(suite, "tasks_VQE.jsonl")) as tasks:
+        jobs = [json.loads(line) for line in tasks]
+    with open(os.path.join(suite, "type_exec_VQE.bsub")) as bsub_file:
+        bsub_script = bsub_file.read()
+    assert f'#BSUB -J "QStone[1-{len(jobs)}]"' in bsub_script
+    assert jsrun_scheduler.Scheduler().run(bsub_script)
+    result = subprocess.run(
+        ["python", os.path.join(suite, "type_exec.py"), "--task", "tasks_VQE.jsonl"],
+        cwd=suite,
+        env={**os.environ, "LSB_JOBINDEX": str(len(jobs))},
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert f"export JOB_ID={jobs[-1][2]}" in result.stdout
+    with pytest.raises(ValueError):
+        generator.generate_suite(
+            config="tests/data/generator/config_single.json",
+            job_count=20,
+            output_folder=tmp_path,
+            atomic=False,
+            scheduler="bare_metal",
+            array=True,
+        )
+
+
+FAKE_CHAINED_SBATCH = """#!/bin/bash
+# Runs the job at once and logs its id, dependency and script
+id=$(( $(wc -l < "$SUBMISSIONS" 2>/dev/null || echo 0) + 1 ))
+echo "$id $*" >> "$SUBMISSIONS"
+echo "Submitted batch job $id"
+bash "${@: -1}" > /dev/null
+"""
+
+
+def test_chained_jobs(tmp_path, monkeypatch):
+    """Test pre, run and post are dependent jobs and only run requests the QPU."""
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    for name, script in (("sbatch", FAKE_CHAINED_SBATCH), ("srun", FAKE_SRUN)):
+        (bin_path / name).write_text(script)
+        (bin_path / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("SUBMISSIONS", str(tmp_path / "submissions"))
+    generator.generate_suite(
+        config="tests/data/generator/config_single_scheduler.json",
+        job_count=2,
+        output_folder=tmp_path,
+        atomic=False,
+        scheduler="slurm",
+        chain=True,
+    )
+    with tarfile.open(os.path.join(tmp_path, "slurm_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+    suite = os.path.join(tmp_path, "qstone_suite")
+    with gzip.open(os.path.join(suite, "jobs.jsonl.gz"), "rt") as manifest:
+        job_types = {json.loads(line)[0] for line in manifest}
+    for job_type in job_types:
+        for step in ("pre", "run", "post"):
+            name = f"type_exec_{job_type}_{step}.sbatch"
+            with open(os.path.join(suite, name)) as script:
+                content = script.read()
+            assert f"jobs.py {step} " in content
+            assert ("#SBATCH --gres=qpu:1" in content) == (step == "run")
+    subprocess.run(["bash", os.path.join(suite, "qstone.sh")], check=True)
+    with open(tmp_path / "submissions") as submissions:
+        lines = [line.split() for line in submissions]
+    assert len(lines) == 6
+    for pre, run, post in (lines[:3], lines[3:]):
+        assert pre[1].endswith("_pre.sbatch") and len(pre) == 2
+        assert run[1:] == [f"--dependency=afterok:{pre[0]}", run[2]]
+        assert run[2].endswith("_run.sbatch")
+        assert post[1] == f"--dependency=afterok:{run[0]}"
+    log_dir = os.path.join(suite, "qstone_profile")
+    steps = {
+        t["job_step"]
+        for f in os.listdir(log_dir)
+        for t in read_jsonl(os.path.join(log_dir, f))
+    }
+    assert {"PRE", "RUN", "POST"} <= steps
+    # A submission without job id fails with the output of the scheduler
+    (bin_path / "sbatch").write_text("#!/bin/bash\necho queue full\n")
+    failed = subprocess.run(
+        ["bash", os.path.join(suite, "qstone.sh")], capture_output=True, text=True
+    )
+    assert failed.returncode != 0
+    assert "No job id in the output of sbatch" in failed.stderr
+    assert "queue full" in failed.stderr
+    with pytest.raises(ValueError):
+        generator.generate_suite(
+            config="tests/data/generator/config_single.json",
+            job_count=2,
+            output_folder=tmp_path,
+            atomic=True,
+            scheduler="slurm",
+            chain=True,
+        )
+
+
+def test_pilot_task_farm(tmp_path):
+    """Test the pilot runs the jobs on its workers and traces their tasks."""
+    generator.generate_suite(
+        config="tests/data/generator/config_single.json",
+        job_count=4,
+        output_folder=tmp_path,
+        atomic=False,
+        scheduler="pilot",
+    )
+    with tarfile.open(os.path.join(tmp_path, "pilot_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+    suite = os.path.join(tmp_path, "qstone_suite")
+    with open(os.path.join(suite, "qstone.sh")) as runner:
+        assert "type_exec.py --pilot" in runner.read()
+    env = {**os.environ, "PILOT_WORKERS": "2"}
+    subprocess.run(["bash", os.path.join(suite, "qstone.sh")], env=env, check=True)
+    log_dir = os.path.join(suite, "qstone_profile")
+    traces = [
+        t for f in os.listdir(log_dir) for t in read_jsonl(os.path.join(log_dir, f))
+    ]
+    tasks = {(t["job_id"], t["label"]): t for t in traces if t["job_step"] == "TASK"}
+    assert {job_id for job_id, _ in tasks} == {"0", "1", "2", "3"}
+    assert {"PRE", "RUN", "POST"} <= {t["job_step"] for t in traces}
+    for job_id in ("0", "1", "2", "3"):
+        queue, execution = tasks[(job_id, "queue")], tasks[(job_id, "execution")]
+        assert queue["end"] == execution["start"] and execution["success"]
+        assert queue["qubits"] == execution["qubits"] >= 2
+    # Two workers: the third task waits for one of the first two to end
+    executions = sorted(
+        (t["start"], t["end"])
+        for (_, label), t in tasks.items()
+        if label == "execution"
+    )
+    assert executions[2][0] >= min(end for _, end in executions[:2])
+    with open(os.path.join(suite, "qstone_runs", "manifest.offset")) as progress:
+        assert progress.read() == "4\n"
+    # The tasks run on the node of the pilot
+    failed = subprocess.run(
+        ["bash", os.path.join(suite, "qstone.sh")],
+        env={**env, "SLURM_JOB_NUM_NODES": "2"},
+        capture_output=True,
+        text=True,
+    )
+    assert failed.returncode != 0 and "-N 1" in failed.stderr
@@ -0,0 +1,122 @@
+"""Tests for the live metrics aggregator"""
+
+import os
+import socket
+import time
+import urllib.request
+
+import pytest
+
+from qstone.profiling.live import MetricsAggregator, MetricsServer
+from qstone.utils.metrics import parse_address
+from qstone.utils.tracing import reconfigure
+from qstone.utils.utils import ComputationStep, trace
+
+
+def _event(event, span_id, job_type, job_step, start, end=0, parent_id=0, **extra):
+    return {
+        "event": event,
+        "host": "node0",
+        "pid": 1,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "job_type": job_type,
+        "job_step": job_step,
+        "start": start,
+        "end": end,
+        **extra,
+    }
+
+
+def _samples(text: str) -> dict:
+    return dict(
+        line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#")
+    )
+
+
+def test_parse_address():
+    """Test the push address is a Unix socket, a host and port or a local port"""
+    assert parse_address("9000") == (socket.AF_INET, ("127.0.0.1", 9000))
+    assert parse_address("localhost:9000") == (socket.AF_INET, ("localhost", 9000))
+    assert parse_address("/tmp/qstone:1.sock") == (socket.AF_UNIX, "/tmp/qstone:1.sock")
+
+
+def test_aggregator():
+    """Test circuits, jobs, lock waits and in-flight spans are accounted for"""
+    aggregator = MetricsAggregator(window=10)
+    aggregator.handle(_event("start", 1, "VQE", "RUN", 0), now=0)
+    aggregator.handle(_event("start", 2, "CONNECTION", "RUN", 0, parent_id=1), now=0)
+    label = "_request_and_process"
+    aggregator.handle(
+        _event("start", 3, "CONNECTION", "RUN", 3 * 10**6, parent_id=2, label=label),
+        now=0,
+    )
+    in_flight = _samples(aggregator.render(now=0))
+    assert in_flight["qstone_circuits_in_flight"] == "1"
+    assert in_flight['qstone_lock_wait_seconds_bucket{le="0.005"}'] == "1"
+    assert in_flight['qstone_lock_wait_seconds_bucket{le="0.0025"}'] == "0"
+    aggregator.handle(
+        _event("end", 2, "CONNECTION", "RUN", 0, 2 * 10**7, 1, connector="HTTPS"),
+        now=1,
+    )
+    aggregator.handle(_event("end", 1, "VQE", "RUN", 0, 10**8), now=1)
+    aggregator.handle(_event("end", 4, "VQE", "POST", 0, 10**8, weight=5), now=2)
+    samples = _samples(aggregator.render(now=2))
+    assert samples["qstone_circuits_in_flight"] == "0"
+    assert samples['qstone_circuits_total{connector="HTTPS"}'] == "1"
+    latency = 'qstone_connector_latency_seconds_bucket{connector="HTTPS",le="0.025"}'
+    assert samples[latency] == "1"
+    assert samples["qstone_jobs_total"] == "5"
+    assert samples["qstone_jobs_per_second"] == "0.5"
+    assert samples['qstone_spans_total{job_type="VQE",job_step="RUN"}'] == "1"
+    # The throughput only covers the last window
+    assert _samples(aggregator.render(now=20))["qstone_jobs_per_second"] == "0"
+
+
+def test_aggregator_expires_spans_not_ended():
+    """Test spans whose end is never received stop counting after the TTL"""
+    aggregator = MetricsAggregator(in_flight_ttl=10)
+    aggregator.handle(_event("start", 1, "CONNECTION", "RUN", 0), now=0)
+    aggregator.handle(_event("start", 2, "CONNECTION", "RUN", 0), now=5)
+    assert _samples(aggregator.render(now=10))["qstone_circuits_in_flight"] == "2"
+    assert _samples(aggregator.render(now=12))["qstone_circuits_in_flight"] == "1"
+    aggregator.handle(_event("start", 3, "VQE", "RUN", 0), now=16)
+    assert len(aggregator._in_flight) == 1
+
+
+@pytest.fixture()
+def server(tmp_path, monkeypatch):
+    """Fixture to run the metrics server and push the traces of the test to it"""
+    listen = os.path.join(tmp_path, "metrics.sock")
+    with MetricsServer(listen) as metrics_server:
+        monkeypatch.setenv("PROFILE_PATH", str(tmp_path))
+        monkeypatch.setenv("TRACE_METRICS", listen)
+        monkeypatch.setenv("CONNECTIVITY_MODE", "NO_LINK")
+        reconfigure()
+        yield metrics_server
+        monkeypatch.undo()
+        reconfigure()
+
+
+def test_traced_calls_are_pushed(server):
+    """Test the traced calls are pushed live and served over HTTP"""
+
+    @trace(computation_type="CONNECTION", computation_step=ComputationStep.RUN)
+    def circuit():
+        return 1
+
+    @trace(computation_type="VQE", computation_step=ComputationStep.POST)
+    def post():
+        return circuit() + circuit()
+
+    post()
+    url = f"http://127.0.0.1:{server.port}/metrics"
+    deadline = time.monotonic() + 5
+    while True:
+        with urllib.request.urlopen(url) as response:
+            samples = _samples(response.read().decode())
+        if samples["qstone_jobs_total"] == "1" or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    assert samples["qstone_jobs_total"] == "1"
+    assert samples['qstone_circuits_total{connector="NO_LINK"}'] == "2"
@@ -31,9 +31,37 @@ def test_cmd_generate():
             output_folder=output,
             atomic=False,
             scheduler="bare_metal",
+            workers=None,
+            replay=None,
+            array=False,
+            chain=False,
         )
 
 
+def test_cmd_generate_from_profile():
+    """Test that qstone generate replays the jobs of a profile store."""
+    with patch("qstone.generators.replay.recorded_jobs") as recorded_jobs, patch(
+        "qstone.generators.generator.generate_suite"
+    ) as generate_qstone:
+        main(
+            [
+                "generate",
+                "-i",
+                "config.json",
+                "--from-profile",
+                "QS_Profile",
+                "--filter",
+                "run=bad_day",
+                "--speedup",
+                "10",
+            ]
+        )
+        recorded_jobs.assert_called_once_with(
+            "QS_Profile", filters={"run": ["bad_day"]}, speedup=10.0
+        )
+        assert generate_qstone.call_args.kwargs["replay"] is recorded_jobs.return_value
+
+
 def test_cmd_run(tmp_path):
     """Test that arguments are provided to qstone run correctly."""
     input_path = "path/to/input_path"
@@ -52,4 +80,85 @@ def test_cmd_profile():
     # Check generate command
     with patch("qstone.profiling.profile.profile") as profile_qstone:
         main(["profile", "--cfg", input_path, "--folder", output])
-        profile_qstone.assert_called_once_with(input_path, [output], "./QS_Profile.pkl")
+        profile_qstone.assert_called_once_with(
+            input_path, [output], "./QS_Profile", workers=None, rescan=False, run=None
+        )
+
+
+def test_cmd_profile_pickle_is_rejected(capsys):
+    """Test that the replaced --pickle option points to --store."""
+    with patch("qstone.profiling.profile.profile") as profile_qstone:
+        with pytest.raises(SystemExit):
+            main(["profile", "--cfg", "cfg", "--folder", "out", "--pickle", "a.pkl"])
+        profile_qstone.assert_not_called()
+    assert "--store" in capsys.readouterr().err
+
+
+def test_cmd_profile_query():
+    """Test that query arguments are provided to profile query correctly."""
+    with patch("qstone.profiling.profile.query") as query_qstone:
+        main(
+            [
+                "profile",
+                "--store",
+                "path/to/store",
+                "--columns",
+                "user,total",
+                "--filter",
+                "user=user0",
+                "--filter",
+                "user=user1",
+                "--query",
+                "total > 0",
+            ]
+        )
+        query_qstone.assert_called_once_with(
+            "path/to/store",
+            columns=["user", "total"],
+            filters={"user": ["user0", "user1"]},
+            expr="total > 0",
+        )
+
+
+def test_cmd_profile_timeline():
+    """Test that the global timeline is loaded from the store with the filters."""
+    with patch("qstone.profiling.profile.timeline") as timeline_qstone:
+        main(["profile", "--store", "path/to/store", "--timeline", "--filter", "run=1"])
+        timeline_qstone.assert_called_once_with("path/to/store", filters={"run": ["1"]})
+
+
+def test_cmd_profile_flame():
+    """Test that the flame summaries are loaded from the store with the filters."""
+    with patch("qstone.profiling.profile.flames") as flames_qstone:
+        main(["profile", "--store", "path/to/store", "--flame"])
+        flames_qstone.assert_called_once_with("path/to/store", filters={})
+
+
+def test_cmd_profile_export_chrome():
+    """Test that the store is exported to the provided trace file."""
+    with patch("qstone.profiling.profile.export_chrome") as export_qstone:
+        main(["profile", "--store", "path/to/store", "--export-chrome", "out.json"])
+        export_qstone.assert_called_once_with("path/to/store", "out.json", filters={})
+
+
+def test_cmd_profile_resources():
+    """Test that the resource usage of the store is printed with the filters."""
+    with patch("qstone.profiling.profile.resource_usage") as usage_qstone:
+        main(
+            ["profile", "--store", "path/to/store", "--resources", "--filter", "user=u"]
+        )
+        usage_qstone.assert_called_once_with("path/to/store", filters={"user": ["u"]})
+
+
+def test_cmd_metrics():
+    """Test that the metrics server listens on the provided socket."""
+    with patch("qstone.profiling.live.serve") as serve_qstone:
+        main(["metrics", "--listen", "/tmp/qstone.sock", "--port", "9000"])
+        serve_qstone.assert_called_once_with("/tmp/qstone.sock", 9000, "127.0.0.1")
+
+
+def test_cmd_worker():
+    """Test that the worker listens on the provided socket."""
+    with patch("qstone.utils.worker.serve") as serve_qstone:
+        main(["worker", "--listen", "/tmp/qstone_worker.sock"])
+        serve_qstone.assert_called_once_with("/tmp/qstone_worker.sock")
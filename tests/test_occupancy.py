@@ -0,0 +1,81 @@
+"""Tests for the QPU occupancy analysis"""
+
+import pandas as pd
+import pytest
+
+from qstone.profiling import profile
+from qstone.profiling.occupancy import lock_waits, occupancy, timeline
+from qstone.profiling.store import ProfileStore
+
+
+def _traces(scheduling_mode="LOCK"):
+    """Three QPU requests, the first two contending for the lock"""
+    rows = [
+        ("1", None, 0, 100),
+        ("1", "_request_and_process", 0, 40),
+        ("2", None, 10, 150),
+        ("2", "_request_and_process", 50, 90),
+        ("3", None, 200, 260),
+        ("3", "_request_and_process", 210, 260),
+    ]
+    df = pd.DataFrame(rows, columns=["job_id", "label", "start", "end"])
+    df = df.assign(
+        user="user0", prog_id="0", job_type="CONNECTION", job_step="RUN", success=True
+    )
+    # Application spans are ignored
+    app = df.iloc[:1].assign(job_type="VQE", start=0, end=300)
+    df = pd.concat([df, app], ignore_index=True)
+    df["scheduling_mode"] = scheduling_mode
+    return df
+
+
+def test_timeline_depth():
+    """Test the depth follows the overlapping spans"""
+    spans = pd.DataFrame({"start": [0, 10, 100], "end": [100, 150, 120]})
+    line = timeline(spans)
+    assert list(line["depth"]) == [1, 2, 2, 1, 0]
+    assert line["duration"].sum() == 150
+
+
+def test_lock_waits():
+    """Test the wait is the time before the nested service started"""
+    df = _traces()
+    requests = df[df["label"].isna() & (df["job_type"] == "CONNECTION")]
+    services = df[df["label"] == "_request_and_process"]
+    assert list(lock_waits(requests, services)) == [0, 40, 10]
+
+
+def test_occupancy():
+    """Test the utilisation, idle gaps and rates of the QPU"""
+    row = occupancy(_traces()).loc["LOCK"].iloc[0]
+    assert row["requests"] == 3
+    assert row["window"] == 260
+    assert row["busy"] == 130
+    assert row["utilisation"] == pytest.approx(0.5)
+    assert (row["idle_gaps"], row["idle_total"], row["idle_max"]) == (2, 130, 120)
+    assert row["depth_max"] == 2
+    assert row["lock_wait_total"] == 50
+    assert row["offered_load"] == pytest.approx(0.5)
+    # Little's law matches the measured mean number of requests
+    assert row["littles_l"] == pytest.approx(row["depth_mean"])
+
+
+def test_occupancy_per_scheduling_mode():
+    """Test each scheduling mode is analysed separately"""
+    df = pd.concat([_traces("LOCK"), _traces("SCHEDULER")], ignore_index=True)
+    table = occupancy(df)
+    assert list(table.index.get_level_values("scheduling_mode")) == [
+        "LOCK",
+        "SCHEDULER",
+    ]
+    assert occupancy(df.iloc[:0]).empty
+
+
+def test_occupancy_from_store(tmp_path):
+    """Test the runs of the store are analysed separately"""
+    store = ProfileStore(str(tmp_path))
+    store.append(_traces(), "first")
+    store.append(_traces(), "second")
+    table = profile.contention(str(tmp_path), filters={"run": "second"})
+    assert list(table.index) == [("LOCK", "second")]
+    assert table["busy"].iloc[0] == 130
@@ -1,40 +1,303 @@
+import json
 import os
+import shutil
 
 import pandas as pd
 import pytest
 
 from qstone.profiling import profile
+from qstone.profiling.store import ProfileStore
 
 
 @pytest.fixture()
 def sample_traced(tmp_path):
     """Fixture of sample trace information"""
-    pickle = tmp_path / f"result.pkl"
+    store = tmp_path / f"result"
     tmp_path.mkdir(exist_ok=True)
     profile.profile(
         config="tests/data/profiler/run1.json",
         folder=["tests/data/profiler/run1"],
-        pickle=pickle,
+        store=store,
     )
 
 
 def test_profile(sample_traced, tmp_path):
-    """Test profile runs and writes pickles sucessfully"""
-    pickle = tmp_path / f"result.pkl"
-    assert os.path.isfile(pickle)
-    check = pd.read_pickle(pickle)
+    """Test profile runs and writes the store sucessfully"""
+    store = tmp_path / f"result"
+    assert os.path.isdir(store)
+    check = profile.query(store)
     assert "user1" in check["user"].unique()
 
 
 def test_profile_loads_all_jsons(sample_traced, tmp_path):
     """Test profiler stores all tracer information"""
-    pickle = tmp_path / f"result.pkl"
-    df = pd.read_pickle(pickle)
+    store = tmp_path / f"result"
+    df = profile.query(store)
     assert len(df) == len(os.listdir("tests/data/profiler/run1"))  # your directory path
 
 
 def test_profiler_valid_schema(sample_traced, tmp_path):
-    """Test generated hdf5 file is valid with the profiler schema"""
-    pickle = tmp_path / f"result.pkl"
-    df = pd.read_pickle(pickle)
+    """Test generated store is valid with the profiler schema"""
+    store = tmp_path / f"result"
+    df = profile.query(store)
     profile.PROFILER_SCHEMA.validate(df)
+
+
+def test_profile_store_is_partitioned(sample_traced, tmp_path):
+    """Test each run appends one partition per user, queried with filters"""
+    store = tmp_path / f"result"
+    run = tmp_path / "run"
+    shutil.copytree("tests/data/profiler/run1", run)
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, run="second")
+    partitions = ProfileStore(str(store)).partitions()
+    assert len(partitions) == 4
+    assert {p["user"] for p in partitions} == {"user0", "user1"}
+    df = profile.query(store, filters={"run": "second", "user": "user0"})
+    assert set(df["user"]) == {"user0"}
+    assert set(df["run"]) == {"second"}
+    df = profile.query(store, columns=["job_id", "total"], expr="total > 0")
+    assert list(df.columns) == ["job_id", "total"]
+    assert len(df) == 4
+    df = profile.query(store, columns=["job_id", "RUN_agg"], expr="RUN_agg >= 0")
+    assert list(df.columns) == ["job_id", "RUN_agg"]
+    assert len(df) == 4
+
+
+def test_profile_is_incremental(tmp_path, capsys):
+    """Test a second profile only ingests the traces added since the first one"""
+    run = tmp_path / "run"
+    shutil.copytree("tests/data/profiler/run1", run)
+    store = tmp_path / "result"
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, workers=1)
+    assert len(profile.query(store)) == 2
+    capsys.readouterr()
+    # Nothing new: the store is left untouched, the stats of the run are printed
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, workers=1)
+    assert len(profile.query(store)) == 2
+    assert "Total quantum computation" in capsys.readouterr().out
+    with open(run / "1.json", encoding="utf-8") as fid:
+        record = json.load(fid)
+    with open(run / "trace.jsonl", "w", encoding="utf-8") as fid:
+        fid.write(json.dumps(record) + "\n")
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, workers=1)
+    assert len(profile.query(store)) == 3
+    # Appended records are read from the position reached previously
+    with open(run / "trace.jsonl", "a", encoding="utf-8") as fid:
+        fid.write(json.dumps(record) + "\n" + json.dumps(record)[:10])
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, workers=1)
+    assert len(profile.query(store)) == 4
+    # The traces of the folder are all stored in the run of its first ingestion
+    assert len({p["run"] for p in ProfileStore(str(store)).partitions()}) == 1
+    # and the step aggregates account for all of them
+    df = profile.query(store)
+    for step in profile.STEPS:
+        per_prog = df["exclusive"].where(df["job_step"] == step, 0)
+        expected = per_prog.groupby(df["prog_id"]).transform("sum")
+        assert (df[f"{step}_agg"] == expected).all()
+    # Rescanning stores all the traces again in a new run
+    profile.profile(
+        "tests/data/profiler/run1.json", [str(run)], store, rescan=True, run="again"
+    )
+    assert len(profile.query(store, filters={"run": "again"})) == 4
+
+
+def test_exclusive_time_across_ingestions(tmp_path):
+    """Test a parent ingested after its children has their time subtracted"""
+    run = tmp_path / "run"
+    run.mkdir()
+    span = {"user": "user0", "prog_id": "1", "job_id": "1", "success": True}
+    span.update({"host": "node0", "pid": 1, "job_type": "VQE", "job_step": "RUN"})
+    child = {**span, "job_type": "CONNECTION", "span_id": 2, "parent_id": 1}
+    parent = {**span, "span_id": 1, "parent_id": 0, "start": 0, "end": 100}
+    with open(run / "trace.jsonl", "w", encoding="utf-8") as fid:
+        fid.write(json.dumps({**child, "start": 10, "end": 70}) + "\n")
+    store = tmp_path / "result"
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, workers=1)
+    with open(run / "trace.jsonl", "a", encoding="utf-8") as fid:
+        fid.write(json.dumps(parent) + "\n")
+    profile.profile("tests/data/profiler/run1.json", [str(run)], store, workers=1)
+    df = profile.query(store).sort_values("span_id")
+    assert list(df["exclusive"]) == [40, 60]
+    # Not 160, from the child counted again in the time of its parent
+    assert list(df["RUN_agg"]) == [100, 100]
+    assert "exclusive" not in ProfileStore(str(store)).read()
+
+
+def test_profile_parallel_ingestion(tmp_path):
+    """Test traces read over a pool of processes are all ingested"""
+    with open("tests/data/profiler/run1/1.json", encoding="utf-8") as fid:
+        record = json.load(fid)
+    folders = []
+    for i in range(3):
+        folder = tmp_path / f"run{i}"
+        folder.mkdir()
+        for j in range(2):
+            with open(folder / f"trace_{j}.jsonl", "w", encoding="utf-8") as fid:
+                fid.write((json.dumps(record) + "\n") * 5)
+        folders.append(str(folder))
+    store = tmp_path / "result"
+    profile.profile(
+        "tests/data/profiler/run1.json", folders + folders[:1], store, workers=2
+    )
+    assert len(profile.query(store)) == 30
+
+
+def _traces():
+    """Synthetic traces of two jobs of user0 and one of user1"""
+    rows = [
+        ("user0", "0", "1", "VQE", "PRE", 0, 10),
+        ("user0", "0", "1", "VQE", "RUN", 10, 110),
+        ("user0", "0", "1", "CONNECTION", "RUN", 20, 60),
+        ("user0", "0", "2", "RB", "POST", 0, 5),
+        ("user1", "1", "1", "VQE", "RUN", 0, 50),
+    ]
+    df = pd.DataFrame(
+        rows,
+        columns=["user", "prog_id", "job_id", "job_type", "job_step", "start", "end"],
+    )
+    df["success"] = True
+    return df
+
+
+def test_extrapolate_aggregates_steps():
+    """Test the step totals are aggregated per program"""
+    stats = profile._extrapolate(_traces())
+    assert list(stats["RUN_agg"]) == [140, 140, 140, 140, 50]
+    assert list(stats["PRE_agg"]) == [10, 10, 10, 10, 0]
+    assert "count" not in stats
+
+
+def test_summarise():
+    """Test the per job, user and job type summaries"""
+    summaries = profile.summarise(_traces())
+    jobs = summaries["job"]
+    assert len(jobs) == 3
+    job = jobs.loc[("user0", "0", "1")]
+    assert job["job_type"] == "VQE"
+    assert (job["PRE"], job["RUN"], job["CONNECTION"]) == (10, 100, 40)
+    assert summaries["user"].loc["user0", "jobs"] == 2
+    assert summaries["job_type"].loc["VQE", "RUN"] == 150
+    assert summaries["job_type"].loc["VQE", "RUN_mean"] == 75
+
+
+def test_profile_store_sketches(sample_traced, tmp_path):
+    """Test the latency percentiles are merged from the stored sketches"""
+    store = tmp_path / f"result"
+    table = profile.latency(store)
+    assert table.loc[("job_type", "PyMatching"), "count"] == 2
+    assert table.loc[("user", "user0"), "count"] == 1
+    table = ProfileStore(str(store)).sketches({"user": "user1"})
+    assert ("user", "user0") not in table
+    # No partition matching the filters, or no store at all
+    assert profile.latency(store, filters={"user": "nobody"}, histograms=True).empty
+    assert profile.latency(tmp_path / "none").empty
+
+
+def test_profile_store_occupancy(sample_traced, tmp_path):
+    """Test the QPU occupancy is reported per scheduling mode and run"""
+    store = tmp_path / f"result"
+    assert set(
+        profile.query(store, columns=["scheduling_mode"])["scheduling_mode"]
+    ) == {"NONE"}
+    # The sample has no connector traces
+    assert profile.contention(store).empty
+
+
+def test_align_clocks_across_hosts():
+    """Test spans of hosts with different counters are put on one timeline"""
+    traces = _traces().iloc[:2].assign(host=["node0", "node1"])
+    # The RUN step started on node1 after PRE ended on node0
+    traces["clock_offset"] = [1000, 500]
+    traces[["start", "end"]] = [[0, 10], [520, 600]]
+    stats = profile._align_clocks(traces)
+    assert list(stats["global_start"]) == [1000, 1020]
+    timeline = profile.global_timeline(stats)
+    assert list(timeline["host"]) == ["node0", "node1"]
+    assert list(timeline["offset"]) == [0, 20]
+    assert list(timeline["duration"]) == [10, 80]
+
+
+def _nested_traces():
+    """A RUN step calling the connector twice, which calls the QPU once each"""
+    df = _traces().iloc[:2].copy()
+    df = pd.concat([df, _traces().iloc[[2, 2, 2, 2]]], ignore_index=True)
+    df["label"] = [
+        None,
+        None,
+        None,
+        "_request_and_process",
+        None,
+        "_request_and_process",
+    ]
+    df["host"], df["pid"] = "node0", 1
+    df["span_id"] = [1, 2, 3, 4, 5, 6]
+    df["parent_id"] = [0, 0, 2, 3, 2, 5]
+    df[["start", "end"]] = [[0, 10], [10, 110], [20, 60], [30, 50], [60, 100], [70, 80]]
+    return df
+
+
+def test_exclusive_time():
+    """Test nested calls are only accounted for once"""
+    stats = profile._extrapolate(_nested_traces())
+    assert list(stats["exclusive"]) == [10, 20, 20, 20, 30, 10]
+    # The RUN step lasted 100, its nested connector calls are not added again
+    assert stats["RUN_agg"][0] == 100
+    job = profile.summarise(stats)["job"].loc[("user0", "0", "1")]
+    assert (job["RUN"], job["CONNECTION"]) == (20, 80)
+
+
+def test_flame():
+    """Test the call stacks of each job are aggregated"""
+    table = profile.flame(_nested_traces()).set_index("stack")
+    assert list(table.index) == [
+        "VQE.PRE",
+        "VQE.RUN",
+        "VQE.RUN;CONNECTION.RUN",
+        "VQE.RUN;CONNECTION.RUN;CONNECTION.RUN:_request_and_process",
+    ]
+    assert table.loc["VQE.RUN;CONNECTION.RUN", "calls"] == 2
+    assert table.loc["VQE.RUN;CONNECTION.RUN", "inclusive"] == 80
+    assert table.loc["VQE.RUN;CONNECTION.RUN", "exclusive"] == 50
+    assert table["exclusive"].sum() == 110
+
+
+def test_sampled_traces_are_scaled_up():
+    """Test sampled traces account for the calls that were not traced"""
+    traces = _nested_traces()
+    # One in four calls to the QPU traced
+    traces["weight"] = [1, 1, 1, 4, 1, 4]
+    stats = profile._extrapolate(traces)
+    assert list(stats["exclusive"]) == [10, 20, 0, 20, 0, 10]
+    assert stats["RUN_agg"][0] == 20 + 20 * 4 + 10 * 4
+    table = profile.flame(traces).set_index("stack")
+    qpu = "VQE.RUN;CONNECTION.RUN;CONNECTION.RUN:_request_and_process"
+    assert table.loc[qpu, "calls"] == 8
+    assert table.loc[qpu, "inclusive"] == 120
+
+
+def test_cpu_efficiency():
+    """Test the resource usage of nested calls is only accounted for once"""
+    traces = _nested_traces()
+    for name in ["cpu_system", "ctx_voluntary", "ctx_involuntary", "io_write"]:
+        traces[name] = 0
+    traces["cpu_user"] = [10, 60, 20, 0, 20, 0]
+    traces["io_read"] = [0, 300, 100, 0, 200, 0]
+    traces["max_rss"] = [1, 2, 3, 3, 4, 4]
+    table = profile.efficiency(traces)
+    assert list(table["wall"]) == [80, 10, 20]
+    assert list(table["efficiency"]) == [0.5, 1.0, 1.0]
+    assert list(table["io_read"]) == [300, 0, 0]
+    assert list(table["max_rss"]) == [4, 1, 2]
+    by_step = profile.efficiency(traces, ("job_step",))
+    assert by_step.loc["RUN", "cpu"] == 60
+
+
+def test_cpu_efficiency_without_usage():
+    """Test traces written without resource usage are left out"""
+    assert profile.efficiency(_nested_traces()).empty
+    traces = _nested_traces()
+    for name in profile.RESOURCE_FIELDS:
+        traces[name] = [-1, 5, -1, -1, -1, -1]
+    table = profile.efficiency(traces)
+    assert list(table.index) == [("VQE", "RUN")]
+    assert table["spans"].iloc[0] == 1
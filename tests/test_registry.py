@@ -0,0 +1,105 @@
+"""Tests for the lazy registries of the computations and connectors"""
+
+import importlib
+import subprocess
+import sys
+from importlib import metadata
+
+import pytest
+
+from qstone.connectors import connector
+from qstone.connectors.no_link.no_link import NoLinkConnection
+from qstone.utils.registry import LazyRegistry
+
+# Dependencies of the computations and connectors that a VQE job over NO_LINK
+# does not use
+UNUSED = ("pygsti", "stim", "pymatching", "scipy", "pyquil", "qcs_sdk", "grpc")
+
+
+def _import_times(code: str) -> dict:
+    """Cumulative import time in us of each module imported by the code, from
+    `python -X importtime`"""
+    stderr = subprocess.run(
+        # Warnings would interleave with the report
+        [sys.executable, "-X", "importtime", "-W", "ignore", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if line.startswith("import time:") and fields[0].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def test_selected_backends_only_are_imported():
+    """Test selecting a computation and connector does not import the others"""
+    times = _import_times(
+        "from qstone.apps import get_computation_src\n"
+        "from qstone.connectors import connector\n"
+        "get_computation_src('VQE')\n"
+        "connector.get_connection(connector.ConnectorType.NO_LINK)\n"
+    )
+    # Modules loaded by importlib are not reported, but the imports they run are
+    assert "qstone.apps.computation" in times
+    imported = {name.split(".")[0] for name in times}
+    assert not imported & set(UNUSED)
+    # The other computations are imported when selected
+    assert "pygsti" in _import_times(
+        "from qstone.apps import get_computation_src\nget_computation_src('RB')\n"
+    )
+
+
+def test_builtin_classes_after_loading():
+    """Test the built-in names resolve to the classes once their modules are imported"""
+    apps = importlib.import_module("qstone.apps")
+    apps.load_computations()
+    # pylint: disable-next=import-outside-toplevel
+    from qstone.apps import RB, VQE
+
+    assert isinstance(VQE, type) and VQE is apps.get_computation_src("VQE")
+    assert isinstance(RB, type) and RB is apps.get_computation_src("RB")
+
+
+def test_builtin_classes_can_be_replaced(monkeypatch):
+    """Test the built-in names of the package can still be set"""
+    apps = importlib.import_module("qstone.apps")
+    apps.load_computations()
+    monkeypatch.setattr(apps, "VQE", NoLinkConnection)
+    # pylint: disable-next=import-outside-toplevel
+    from qstone.apps import VQE
+
+    assert VQE is NoLinkConnection
+
+
+def test_plugins(monkeypatch):
+    """Test plugins are found by entry point and registered entries take precedence"""
+    plugin = metadata.EntryPoint(
+        name="Custom1", value="tests.data.apps.custom1:Custom1", group="qstone.apps"
+    )
+    monkeypatch.setattr(
+        metadata,
+        "entry_points",
+        lambda group: [plugin] if group == "qstone.apps" else [],
+    )
+    apps = LazyRegistry("qstone.apps", {"VQE": "qstone.apps.VQE:VQE"})
+    assert apps.names() == ["Custom1", "VQE"]
+    assert "Custom1" in apps and "RB" not in apps
+    assert apps.get("Custom1").COMPUTATION_NAME == "Custom1"
+    apps.register("Custom1", NoLinkConnection)
+    assert apps.get("Custom1") is NoLinkConnection
+    with pytest.raises(KeyError):
+        apps.get("RB")
+
+
+def test_registered_connection():
+    """Test a connector registered by name is used by the connector"""
+    connector.register_connection("LOOPBACK", NoLinkConnection)
+    assert connector.connector_type("LOOPBACK") == "LOOPBACK"
+    assert connector.connector_type("NO_LINK") is connector.ConnectorType.NO_LINK
+    link = connector.Connector("LOOPBACK", "RANDOM", "0", 0, "0", 0, "QPU0", None)
+    assert isinstance(link.connection, NoLinkConnection)
+    with pytest.raises(KeyError):
+        connector.Connector("UNKNOWN", "RANDOM", "0", 0, "0", 0, "QPU0", None)
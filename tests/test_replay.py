@@ -0,0 +1,92 @@
+"""Tests for the replay of recorded workloads"""
+
+import gzip
+import json
+import os
+import tarfile
+
+import numpy
+import pytest
+
+from qstone.generators import generator
+from qstone.generators.replay import recorded_jobs
+from qstone.profiling import profile
+
+S_TO_NS = 10**9
+
+
+def _record(user, job_id, job_type, step, start, qubits=-1, shots=-1, **extra):
+    return {
+        "user": user,
+        "prog_id": "0",
+        "job_id": str(job_id),
+        "job_type": job_type,
+        "job_step": step,
+        "start": start,
+        "end": start + 1000,
+        "success": True,
+        "qubits": qubits,
+        "shots": shots,
+        **extra,
+    }
+
+
+@pytest.fixture()
+def store(tmp_path):
+    """Fixture of a profile store recording jobs of two users"""
+    records = [
+        _record("user0", 0, "VQE", "PRE", 10 * S_TO_NS, 4, 64),
+        _record("user0", 0, "VQE", "RUN", 11 * S_TO_NS, 4, 64),
+        _record("user0", 0, "CONNECTION", "RUN", 12 * S_TO_NS, 4, 64),
+        # Traced on a host whose clock is 2s ahead, and before the settings
+        # were recorded
+        _record("user0", 1, "RB", "PRE", 12 * S_TO_NS, clock_offset=2 * S_TO_NS),
+        _record("user1", 0, "VQE", "PRE", 0, 3, 32),
+        _record("user1", 1, "VQE", "PRE", 30 * S_TO_NS, 5, 16),
+    ]
+    folder = tmp_path / "run"
+    folder.mkdir()
+    with open(folder / "trace.jsonl", "w", encoding="utf-8") as fid:
+        fid.writelines(json.dumps(r) + "\n" for r in records)
+    path = str(tmp_path / "store")
+    profile.profile("tests/data/profiler/run1.json", [str(folder)], path, run="bad")
+    return path
+
+
+def test_recorded_jobs(store):
+    """Test the jobs, their settings and release times are loaded in order"""
+    jobs = recorded_jobs(store, speedup=2)
+    assert jobs["user"].tolist() == ["user1", "user0", "user0", "user1"]
+    assert jobs["job_type"].tolist() == ["VQE", "VQE", "RB", "VQE"]
+    assert jobs["release"].tolist() == [0, 5, 7, 15]
+    assert jobs["qubits"].tolist()[:2] == [3, 4]
+    assert numpy.isnan(jobs["qubits"][2]) and numpy.isnan(jobs["shots"][2])
+    assert len(recorded_jobs(store, filters={"user": "user1"})) == 2
+    with pytest.raises(ValueError):
+        recorded_jobs(store, filters={"run": "good"})
+
+
+def test_replay_generation(store, tmp_path):
+    """Test the suites replay the recorded jobs at their release times"""
+    paths = generator.generate_suite(
+        config="tests/data/generator/config_single.json",
+        job_count=None,
+        output_folder=str(tmp_path),
+        atomic=False,
+        scheduler="bare_metal",
+        workers=1,
+        replay=recorded_jobs(store),
+    )
+    assert [os.path.basename(p) for p in paths] == [
+        "bare_metal_user0.qstone.tar.gz",
+        "bare_metal_user1.qstone.tar.gz",
+    ]
+    with tarfile.open(paths[0]) as tar:
+        runner = tar.extractfile("qstone_suite/qstone.sh").read()
+        manifest = tar.extractfile("qstone_suite/jobs.jsonl.gz").read()
+    assert b'export QS_ARRIVAL="open"' in runner
+    jobs = [json.loads(line) for line in gzip.decompress(manifest).splitlines()]
+    vqe, rb = jobs
+    assert vqe[:4] == ["VQE", 4, 0, 64] and vqe[6] == 10
+    # Settings not recorded are drawn from the configuration of the job type
+    assert rb[0] == "RB" and 2 <= rb[1] < 4 and 2 <= rb[3] < 4 and rb[6] == 14
@@ -0,0 +1,96 @@
+"""Tests for the latency sketches"""
+
+import numpy
+import pandas as pd
+import pytest
+
+from qstone.profiling.sketch import (
+    LatencySketch,
+    build_sketches,
+    dump_sketches,
+    histogram_table,
+    load_sketches,
+    merge_sketches,
+    percentiles_table,
+)
+
+
+@pytest.mark.parametrize("q", [0.5, 0.9, 0.99, 0.999])
+def test_quantile_accuracy(q):
+    """Test the quantiles are within the relative error of the layout"""
+    values = numpy.random.default_rng(0).lognormal(15, 2, 100000).astype(numpy.int64)
+    sketch = LatencySketch()
+    sketch.record(values)
+    exact = numpy.quantile(values, q, method="inverted_cdf")
+    assert abs(sketch.quantile(q) - exact) / exact < 0.01
+
+
+def test_small_values_are_exact():
+    """Test durations below 2**precision are counted exactly"""
+    sketch = LatencySketch()
+    sketch.record(range(1, 101))
+    assert sketch.quantile(0.5) == 50
+    assert sketch.mean == 50.5
+    assert sketch.max == 100
+
+
+def test_merge_matches_single_sketch():
+    """Test merged sketches equal the sketch of all the values"""
+    values = numpy.random.default_rng(1).integers(0, 10**9, 1000)
+    single, first, second = LatencySketch(), LatencySketch(), LatencySketch()
+    single.record(values)
+    first.record(values[:300])
+    second.record(values[300:])
+    merged = first.merge(second)
+    assert merged.to_dict() == single.to_dict()
+
+
+def test_histogram_counts_all_values():
+    """Test the coarse histogram accounts for every value"""
+    sketch = LatencySketch()
+    sketch.record([10, 2000, 3 * 10**6, 10**13])
+    histogram = sketch.histogram()
+    assert histogram.sum() == 4
+    assert histogram["<1us"] == 1
+    assert histogram[">=1000s"] == 1
+
+
+def test_sketches_roundtrip(tmp_path):
+    """Test the sketches per dimension survive serialisation"""
+    stats = pd.DataFrame(
+        {
+            "user": ["user0", "user0", "user1"],
+            "job_type": ["VQE", "CONNECTION", "VQE"],
+            "job_step": ["RUN", "RUN", "PRE"],
+            "label": [None, "run_job", None],
+            "start": [0, 0, 0],
+            "end": [10, 20, 30],
+        }
+    )
+    sketches = build_sketches(stats)
+    assert ("connector", "run_job") in sketches
+    assert ("job_type", "CONNECTION") not in sketches
+    assert sketches[("job_type", "VQE")].count == 2
+    dump_sketches(sketches, str(tmp_path / "sketch.json"))
+    loaded = merge_sketches({}, load_sketches(str(tmp_path / "sketch.json")))
+    assert percentiles_table(loaded).equals(percentiles_table(sketches))
+
+
+def test_weighted_values():
+    """Test sampled values are counted as many times as their weight"""
+    sketch = LatencySketch()
+    sketch.record([10, 20], weights=[3, 1])
+    assert sketch.count == 4
+    assert sketch.mean == 12.5
+    assert sketch.quantile(0.75) == 10
+    assert LatencySketch.from_dict(sketch.to_dict()).to_dict() == sketch.to_dict()
+
+
+def test_empty_tables():
+    """Test the tables of no sketches are empty, with the columns of the others"""
+    sketches = {("job_type", "VQE"): LatencySketch()}
+    sketches[("job_type", "VQE")].record([10])
+    for build in (percentiles_table, histogram_table):
+        empty = build({})
+        assert empty.empty and empty.index.names == ["dimension", "key"]
+        assert list(empty.columns) == list(build(sketches).columns)
@@ -0,0 +1,365 @@
+"""Tests for the buffered trace sink"""
+
+import os
+import random
+import socket
+import time
+import timeit
+
+import numpy
+import pytest
+
+from qstone.profiling import profile
+from qstone.utils import tracing
+from qstone.utils.tracing import (
+    TraceBuffer,
+    flush_traces,
+    read_jsonl,
+    read_records,
+    reconfigure,
+    trace_filename,
+)
+from qstone.utils.utils import ComputationStep, trace
+
+RECORD = {
+    "user": "user0",
+    "prog_id": "0",
+    "job_id": "1",
+    "job_type": "VQE",
+    "job_step": "RUN",
+    "label": None,
+    "start": 1,
+    "end": 2,
+    "success": True,
+}
+
+
+@trace(computation_type="VQE", computation_step=ComputationStep.RUN, logging_level=1)
+def traced_at_level_one():
+    """Module level traced function, rebound when the trace settings change"""
+    return 1
+
+
+@pytest.fixture()
+def logging_level(tmp_path, monkeypatch):
+    """Fixture to change the logging level, restoring the settings afterwards"""
+
+    def set_level(level):
+        monkeypatch.setenv("APP_LOGGING_LEVEL", str(level))
+        reconfigure()
+
+    monkeypatch.setenv("PROFILE_PATH", str(tmp_path))
+    yield set_level
+    monkeypatch.undo()
+    reconfigure()
+
+
+@pytest.fixture()
+def env(tmp_path, monkeypatch):
+    """Fixture to set environment variables, restoring the settings afterwards"""
+    monkeypatch.setenv("JOB_ID", "1")
+    monkeypatch.setenv("PROG_ID", "0")
+    monkeypatch.setenv("QS_USER", "user0")
+    monkeypatch.setenv("PROFILE_PATH", str(tmp_path))
+    reconfigure()
+    yield
+    monkeypatch.undo()
+    reconfigure()
+
+
+def test_buffer_flushes_at_threshold(tmp_path):
+    """Records stay in memory until the size threshold is reached"""
+    buffer = TraceBuffer(max_records=3)
+    buffer.append(str(tmp_path), RECORD)
+    buffer.append(str(tmp_path), RECORD)
+    assert not os.path.exists(trace_filename(str(tmp_path)))
+    buffer.append(str(tmp_path), RECORD)
+    assert len(buffer) == 0
+    assert len(list(read_jsonl(trace_filename(str(tmp_path))))) == 3
+
+
+def test_buffer_appends_one_file_per_process(tmp_path):
+    """Consecutive flushes append to the same per-process file"""
+    buffer = TraceBuffer()
+    for _ in range(2):
+        buffer.append(str(tmp_path), RECORD)
+        buffer.flush()
+    assert os.listdir(tmp_path) == [os.path.basename(trace_filename(str(tmp_path)))]
+    assert len(list(read_jsonl(trace_filename(str(tmp_path))))) == 2
+
+
+def test_read_skips_truncated_record(tmp_path):
+    """A record cut by a crash mid-flush is ignored"""
+    buffer = TraceBuffer()
+    buffer.append(str(tmp_path), RECORD)
+    buffer.flush()
+    with open(trace_filename(str(tmp_path)), "a", encoding="utf-8") as fid:
+        fid.write('{"user": "us')
+    assert list(read_jsonl(trace_filename(str(tmp_path)))) == [RECORD]
+
+
+def test_read_skips_malformed_record(tmp_path, caplog):
+    """A malformed line anywhere in the file is logged and skipped"""
+    buffer = TraceBuffer()
+    buffer.append(str(tmp_path), RECORD)
+    buffer.flush()
+    with open(trace_filename(str(tmp_path)), "a", encoding="utf-8") as fid:
+        fid.write('{"user": "us\n')
+    buffer.append(str(tmp_path), RECORD)
+    buffer.flush()
+    assert list(read_jsonl(trace_filename(str(tmp_path)))) == [RECORD, RECORD]
+    assert "malformed record" in caplog.text
+
+
+def test_traced_calls_are_profiled(tmp_path, env):
+    """Traces written through the decorator are read back by the profiler"""
+
+    @trace(computation_type="VQE", computation_step=ComputationStep.RUN)
+    def traced():
+        return 1
+
+    for _ in range(5):
+        traced()
+    flush_traces()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    assert len(df) == 5
+    assert set(df["job_step"]) == {"RUN"}
+
+
+def test_records_roundtrip(tmp_path, monkeypatch):
+    """Binary records are memory-mapped back with the same content"""
+    monkeypatch.setenv("TRACE_FORMAT", "records")
+    buffer = TraceBuffer()
+    for _ in range(2):
+        buffer.append(str(tmp_path), RECORD)
+        buffer.flush()
+    records = read_records(trace_filename(str(tmp_path), "records"))
+    assert len(records) == 2
+    assert records[0]["user"] == b"user0"
+    assert records[1]["end"] == 2
+
+
+def test_records_skip_truncated_record(tmp_path, monkeypatch):
+    """A record cut by a crash mid-flush is ignored"""
+    monkeypatch.setenv("TRACE_FORMAT", "records")
+    buffer = TraceBuffer()
+    buffer.append(str(tmp_path), RECORD)
+    buffer.flush()
+    with open(trace_filename(str(tmp_path), "records"), "ab") as fid:
+        fid.write(b"\x00" * 10)
+    assert len(read_records(trace_filename(str(tmp_path), "records"))) == 1
+
+
+def test_profiler_reads_mixed_formats(tmp_path, env, monkeypatch):
+    """The profiler builds one dataframe out of textual and binary traces"""
+    buffer = TraceBuffer()
+    buffer.append(str(tmp_path), RECORD)
+    buffer.flush()
+    monkeypatch.setenv("TRACE_FORMAT", "records")
+    buffer.append(str(tmp_path), {**RECORD, "label": "binary"})
+    buffer.flush()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    assert len(df) == 2
+    assert set(df["label"].dropna()) == {"binary"}
+
+
+def test_traces_carry_clock_offset(tmp_path, env):
+    """Traced spans are placed on the wall clock by the profiler"""
+
+    @trace(computation_type="VQE", computation_step=ComputationStep.RUN)
+    def traced():
+        return 1
+
+    before = time.time_ns()
+    traced()
+    after = time.time_ns()
+    flush_traces()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    assert df["host"][0] == socket.gethostname()
+    assert df["pid"][0] == os.getpid()
+    # Within a millisecond of the wall clock
+    assert before - 10**6 <= df["global_start"][0] <= df["global_end"][0]
+    assert df["global_end"][0] <= after + 10**6
+
+
+def test_records_without_process_info(tmp_path, monkeypatch):
+    """Binary traces written before host, pid and offset were added are read"""
+    monkeypatch.setattr(
+        tracing,
+        "TRACE_DTYPE",
+        numpy.dtype([d for d in tracing.TRACE_DTYPE.descr if d[0] in RECORD]),
+    )
+    monkeypatch.setenv("TRACE_FORMAT", "records")
+    buffer = TraceBuffer()
+    buffer.append(str(tmp_path), RECORD)
+    buffer.flush()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    assert list(df["global_start"]) == [1]
+    assert list(df["clock_offset"]) == [0]
+
+
+def test_nested_calls_record_their_parent(tmp_path, env):
+    """Spans of nested traced calls point to the span of the caller"""
+
+    @trace(computation_type="CONNECTION", computation_step=ComputationStep.RUN)
+    def inner():
+        return 1
+
+    @trace(computation_type="VQE", computation_step=ComputationStep.RUN)
+    def outer():
+        return inner() + inner()
+
+    outer()
+    inner()
+    flush_traces()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    parent = df[df["job_type"] == "VQE"]["span_id"].iloc[0]
+    assert list(df["parent_id"]) == [parent, parent, 0, 0]
+    assert df["span_id"].is_unique
+
+
+def test_disabled_level_is_not_wrapped(tmp_path, env, logging_level):
+    """Functions below the logging level are rebound to themselves"""
+    logging_level(2)
+    assert not hasattr(traced_at_level_one, "__wrapped__")
+    traced_at_level_one()
+    logging_level(1)
+    assert traced_at_level_one.__wrapped__.__name__ == "traced_at_level_one"
+    traced_at_level_one()
+    flush_traces()
+    assert len(list(read_jsonl(trace_filename(str(tmp_path))))) == 1
+
+
+def test_disabled_trace_overhead(logging_level, mocker):
+    """A call through a disabled trace neither reads the clock nor buffers a record"""
+    clock = mocker.patch("qstone.utils.utils.time")
+    clock.perf_counter_ns.return_value = 0
+    append = mocker.patch.object(tracing.TRACE_BUFFER, "append")
+    logging_level(2)
+    assert traced_at_level_one() == 1
+    clock.perf_counter_ns.assert_not_called()
+    append.assert_not_called()
+    logging_level(1)
+    assert traced_at_level_one() == 1
+    assert clock.perf_counter_ns.call_count == 2
+    append.assert_called_once()
+
+
+def _untraced():
+    """Same function as traced_at_level_one, without the trace"""
+    return 1
+
+
+@pytest.mark.benchmark
+def test_disabled_trace_overhead_benchmark(logging_level):
+    """A call through a trace below the logging level costs under 100 ns more than
+    a call to the bare function"""
+    logging_level(2)
+    calls = 100000
+    traced = min(timeit.repeat(traced_at_level_one, number=calls, repeat=5))
+    bare = min(timeit.repeat(_untraced, number=calls, repeat=5))
+    overhead = (traced - bare) / calls * 10**9
+    print(f"Disabled trace overhead: {overhead:.1f} ns per call")
+    assert overhead < 100
+
+
+def test_tracing_disabled_without_profile_path(logging_level, monkeypatch, caplog):
+    """Tracing is disabled with a warning when PROFILE_PATH is not set"""
+    monkeypatch.delenv("PROFILE_PATH")
+    logging_level(1)
+    assert not hasattr(traced_at_level_one, "__wrapped__")
+    assert "PROFILE_PATH is not set" in caplog.text
+
+
+def test_sampling_every_nth_call(tmp_path, env, monkeypatch):
+    """Every Nth call of a sampled label is traced with a weight of N"""
+    monkeypatch.setenv("TRACE_SAMPLING_HOT_LOOP", "4")
+    reconfigure()
+
+    @trace(
+        computation_type="QBC",
+        computation_step=ComputationStep.RUN,
+        label="hot_loop",
+    )
+    def traced():
+        return 1
+
+    assert sum(traced() for _ in range(10)) == 10
+    flush_traces()
+    records = list(read_jsonl(trace_filename(str(tmp_path))))
+    assert [r["weight"] for r in records] == [4, 4, 4]
+
+
+def test_sampling_probability(tmp_path, env, monkeypatch):
+    """Calls of a label sampled with a probability are weighted by its inverse"""
+    monkeypatch.setenv("TRACE_SAMPLING_HOT_LOOP", "0.25")
+    reconfigure()
+
+    @trace(
+        computation_type="QBC",
+        computation_step=ComputationStep.RUN,
+        label="hot_loop",
+    )
+    def traced():
+        return 1
+
+    random.seed(0)
+    for _ in range(400):
+        traced()
+    flush_traces()
+    records = list(read_jsonl(trace_filename(str(tmp_path))))
+    assert 60 < len(records) < 140
+    assert {r["weight"] for r in records} == {4}
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "records"])
+def test_resource_usage(tmp_path, env, monkeypatch, fmt):
+    """CPU time, I/O and peak RSS of the traced calls are recorded when enabled"""
+    monkeypatch.setenv("TRACE_FORMAT", fmt)
+    monkeypatch.setenv("TRACE_RESOURCES", "True")
+    reconfigure()
+
+    @trace(computation_type="RB", computation_step=ComputationStep.PRE)
+    def busy():
+        deadline = time.process_time() + 0.02
+        while time.process_time() < deadline:
+            pass
+        with open(os.path.join(tmp_path, "out.bin"), "wb") as fid:
+            fid.write(b"0" * 100000)
+
+    busy()
+    monkeypatch.setenv("TRACE_RESOURCES", "False")
+    reconfigure()
+    busy()
+    flush_traces()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    captured = df.iloc[0]
+    assert captured["cpu_user"] + captured["cpu_system"] >= 10**7
+    assert captured["max_rss"] > 0
+    if os.path.exists("/proc/self/io"):
+        assert captured["io_write"] >= 100000
+    assert df.iloc[1][tracing.RESOURCE_FIELDS].isna().all()
+    assert profile.efficiency(df)["spans"].sum() == 1
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "records"])
+def test_job_settings(tmp_path, env, monkeypatch, fmt):
+    """The qubits and shots of the job are recorded, to be replayed"""
+    monkeypatch.setenv("TRACE_FORMAT", fmt)
+    monkeypatch.setenv("NUM_QUBITS", "5")
+    monkeypatch.setenv("NUM_SHOTS", "100")
+    reconfigure()
+
+    @trace(computation_type="VQE", computation_step=ComputationStep.PRE)
+    def traced():
+        return 1
+
+    traced()
+    monkeypatch.setenv("NUM_QUBITS", "")
+    monkeypatch.setenv("NUM_SHOTS", "")
+    reconfigure()
+    traced()
+    flush_traces()
+    df = profile._get_stats_from_dir(str(tmp_path), profile.PROFILER_SCHEMA)
+    assert df.iloc[0][tracing.JOB_SETTINGS].tolist() == [5, 100]
+    assert df.iloc[1][tracing.JOB_SETTINGS].isna().all()
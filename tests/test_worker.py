@@ -0,0 +1,132 @@
+"""Tests for the warm worker running the steps of the jobs"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tarfile
+import time
+
+import pytest
+
+from qstone.generators import generator
+from qstone.utils.tracing import read_jsonl
+from qstone.utils.worker import submit_step
+
+PROBE = """
+import os
+import time
+
+
+class Probe:
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def pre(self, datapath):
+        print(os.getppid(), os.getcwd(), os.environ["PROBE"], self.cfg["value"])
+
+    def run(self, datapath, connection):
+        with open("step.pid", "w") as fid:
+            fid.write(str(os.getpid()))
+        time.sleep(60)
+
+    def post(self, datapath):
+        raise RuntimeError("post failed")
+"""
+
+
+@pytest.fixture()
+def worker(tmp_path):
+    """Fixture of a worker listening on a socket of the test folder"""
+    listen = str(tmp_path / "worker.sock")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "qstone", "worker", "--listen", listen]
+    )
+    deadline = time.monotonic() + 120
+    while not os.path.exists(listen) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    yield process, listen
+    process.terminate()
+    process.wait()
+
+
+def test_steps_run_in_worker(worker, tmp_path, monkeypatch, capfd):
+    """Test a step runs in a child of the worker, in the context of the caller"""
+    process, listen = worker
+    (tmp_path / "probe_app.py").write_text(PROBE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PROBE", "from the caller")
+    cfg = '{"value": 3}'
+    assert submit_step(listen, "pre", "probe_app.Probe", cfg) == 0
+    assert submit_step(listen, "post", "probe_app.Probe", cfg) == 1
+    out, err = capfd.readouterr()
+    assert out == f"{process.pid} {tmp_path} from the caller 3\n"
+    assert "RuntimeError: post failed" in err
+    with pytest.raises(ConnectionError):
+        submit_step(str(tmp_path / "none.sock"), "pre", "probe_app.Probe", cfg)
+
+
+def test_stalled_and_cancelled_callers(worker, tmp_path, monkeypatch):
+    """Test a caller not sending its request does not hold up the others, and a
+    step is killed when its caller goes away"""
+    _, listen = worker
+    assert os.stat(listen).st_mode & 0o077 == 0
+    (tmp_path / "probe_app.py").write_text(PROBE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PROBE", "")
+    cfg = '{"value": 0}'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled:
+        stalled.connect(listen)
+        assert submit_step(listen, "pre", "probe_app.Probe", cfg) == 0
+    request = {
+        "step": "run",
+        "src": "probe_app.Probe",
+        "cfg": cfg,
+        "env": dict(os.environ),
+        "cwd": str(tmp_path),
+        "path": sys.path,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as cancelled:
+        cancelled.connect(listen)
+        socket.send_fds(cancelled, [b"\0"], [1, 2])
+        cancelled.sendall(json.dumps(request).encode() + b"\n")
+        deadline = time.monotonic() + 30
+        while not (tmp_path / "step.pid").exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    pid = int((tmp_path / "step.pid").read_text())
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("The step outlived its caller")
+
+
+def test_suite_with_worker(worker, tmp_path):
+    """Test the jobs of a suite hand their steps over to the worker"""
+    _, listen = worker
+    generator.generate_suite(
+        config="tests/data/generator/config_single.json",
+        job_count=2,
+        output_folder=tmp_path,
+        atomic=False,
+        scheduler="bare_metal",
+    )
+    with tarfile.open(os.path.join(tmp_path, "bare_metal_user0.qstone.tar.gz")) as t:
+        t.extractall(tmp_path)
+    suite = os.path.join(tmp_path, "qstone_suite")
+    env = {**os.environ, "WORKER_SOCKET": listen}
+    subprocess.run(["bash", os.path.join(suite, "qstone.sh")], env=env, check=True)
+    log_dir = os.path.join(suite, "qstone_profile")
+    steps = {
+        (t["job_id"], t["job_step"])
+        for f in os.listdir(log_dir)
+        for t in read_jsonl(os.path.join(log_dir, f))
+    }
+    assert {(j, s) for j in ("0", "1") for s in ("PRE", "RUN", "POST")} <= steps